@@ -0,0 +1,93 @@
+import heapq
+from collections import deque
+
+
+class Agenda(object):
+    """Worklist of facts and rules waiting to be added to the KB. Inference
+        pushes what it derives here instead of recursing, so derivation chains
+        of any length run in constant stack.
+
+    Items come out first in, first out, unless a priority function is given,
+    in which case the item with the lowest priority value comes out first
+    (ties in push order).
+
+    Attributes:
+        priority (function|None): maps a Fact|Rule to a sortable priority
+    """
+    def __init__(self, priority=None):
+        """Constructor for an empty Agenda
+
+        Args:
+            priority (function|None): maps a Fact|Rule to a sortable
+                priority, lower comes out first. None for FIFO order
+        """
+        super(Agenda, self).__init__()
+        self.priority = priority
+        self._items = [] if priority else deque()
+        self._pushed = 0
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'Agenda({!r})'.format(list(self._items))
+
+    def __len__(self):
+        """Define behavior of len, the number of waiting items
+        """
+        return len(self._items)
+
+    def copy(self, copy_item=None):
+        """Make an agenda with the same priority function and waiting items
+
+        Args:
+            copy_item (function|None): applied to each waiting item to get
+                the copy's, None to share the items
+
+        Returns:
+            Agenda: the copy
+        """
+        agenda = Agenda(self.priority)
+        if copy_item is None:
+            agenda._items = type(self._items)(self._items)
+        elif self.priority:
+            agenda._items = [(priority, pushed, copy_item(item))
+                             for priority, pushed, item in self._items]
+        else:
+            agenda._items = deque(copy_item(item) for item in self._items)
+        agenda._pushed = self._pushed
+        return agenda
+
+    def discard(self, drop):
+        """Take the waiting items a function is true for off the agenda,
+            the others keep their order
+
+        Args:
+            drop (function): maps a Fact|Rule to True to take it off
+        """
+        if self.priority:
+            self._items = [entry for entry in self._items if not drop(entry[2])]
+            heapq.heapify(self._items)
+        else:
+            self._items = deque(item for item in self._items if not drop(item))
+
+    def push(self, item):
+        """Add an item to the agenda
+
+        Args:
+            item (Fact|Rule): fact or rule waiting to be added to the KB
+        """
+        if self.priority:
+            heapq.heappush(self._items, (self.priority(item), self._pushed, item))
+        else:
+            self._items.append(item)
+        self._pushed += 1
+
+    def pop(self):
+        """Take the next item off the agenda
+
+        Returns:
+            Fact|Rule: next fact or rule to add to the KB
+        """
+        if self.priority:
+            return heapq.heappop(self._items)[2]
+        return self._items.popleft()
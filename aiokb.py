@@ -0,0 +1,175 @@
+"""asyncio front-end for a KnowledgeBase.
+
+Writes go through one queue consumed by a single writer task. The writer
+takes everything queued (up to max_batch writes), applies it to a fork of
+the KB (KnowledgeBase.fork) in an executor thread, consecutive asserts with
+kb_assert_many, then commits the fork on the event loop thread. Forward
+chaining never blocks the loop, and reads, which run on the loop thread,
+always see the KB as of the last commit, never half of a batch. If a write
+of a batch fails, nothing of the batch is committed and its writes are
+applied again one by one, so only the writes that fail themselves get an
+error. If the commit itself fails, every write of the batch gets the error.
+"""
+import asyncio
+import itertools
+
+from student_code import KnowledgeBase
+
+
+class AsyncKnowledgeBase(object):
+    """Asyncio wrapper of a KnowledgeBase with a single writer, see the
+        module docstring. Use it from one event loop; the wrapped KB must
+        not be changed behind its back.
+
+    Attributes:
+        kb (KnowledgeBase): the wrapped KB
+        max_batch (int): most writes applied in one batch
+        version (int): number of batches committed so far
+    """
+    def __init__(self, kb=None, max_batch=10000, executor=None):
+        """Constructor for AsyncKnowledgeBase. The writer task starts with
+            the first write
+
+        Args:
+            kb (KnowledgeBase|None): KB to wrap, None for a new empty one
+            max_batch (int): most writes applied in one batch
+            executor (concurrent.futures.Executor|None): where batches are
+                applied, None for the loop's default executor
+        """
+        super(AsyncKnowledgeBase, self).__init__()
+        self.kb = kb if kb is not None else KnowledgeBase([], [])
+        self.max_batch = max_batch
+        self.version = 0
+        self._executor = executor
+        self._queue = asyncio.Queue()
+        self._writer = None
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'AsyncKnowledgeBase({!r}, version={})'.format(self.kb, self.version)
+
+    async def kb_assert(self, fact_rule):
+        """Assert a fact or rule, returning once it and its consequences
+            are committed
+
+        Args:
+            fact_rule (Fact|Rule): Fact or Rule we're asserting
+        """
+        await self._write('assert', fact_rule)
+
+    async def kb_retract(self, fact):
+        """Retract a fact, returning once the retraction and its cascade are
+            committed. Applied with KnowledgeBase.kb_retract in the batch of
+            the writes queued next to it
+
+        Args:
+            fact (Fact): Fact to be retracted
+        """
+        await self._write('retract', fact)
+
+    async def kb_ask(self, fact):
+        """Ask the KB as of the last committed batch, see KnowledgeBase.kb_ask
+
+        Args:
+            fact (Fact|listof Fact): Statement(s) to be asked
+
+        Returns:
+            ListOfBindings|list: the answers, [] if there is none
+        """
+        return self.kb.kb_ask(fact)
+
+    async def flush(self):
+        """Wait until every write queued so far is committed
+        """
+        await self._queue.join()
+
+    async def close(self):
+        """Commit the queued writes and stop the writer task
+        """
+        if self._writer is not None:
+            await self._queue.put(None)
+            await self._writer
+            self._writer = None
+
+    async def _write(self, kind, fact_rule):
+        # queue a write and wait for the batch holding it to be committed
+        if self._writer is None:
+            self._writer = asyncio.get_running_loop().create_task(self._run())
+        done = asyncio.get_running_loop().create_future()
+        await self._queue.put((kind, fact_rule, done))
+        await done
+
+    async def _run(self):
+        # the writer task: one batch of queued writes at a time
+        stopping = False
+        while not stopping:
+            writes = [await self._queue.get()]
+            while len(writes) < self.max_batch and not self._queue.empty():
+                writes.append(self._queue.get_nowait())
+            if None in writes:
+                stopping = True
+            batch = [write for write in writes if write is not None]
+            try:
+                if batch:
+                    await self._apply(batch)
+            finally:
+                for _ in writes:
+                    self._queue.task_done()
+
+    async def _apply(self, batch):
+        # commit a batch, or if a write fails each of its writes on its own,
+        # and settle the futures of the writers
+        error, committing = await self._commit(batch)
+        if error is None or committing or len(batch) == 1:
+            settled = [(batch, error)]
+        else:
+            settled = [([write], (await self._commit([write]))[0]) for write in batch]
+        for writes, error in settled:
+            for kind, fact_rule, done in writes:
+                if done.done():
+                    continue
+                if error is None:
+                    done.set_result(None)
+                else:
+                    done.set_exception(error)
+
+    async def _commit(self, writes):
+        # apply writes to a fork in the executor and commit it. Returns the
+        # error if that fails, with whether the commit raised it: the KB may
+        # then hold part of the writes, else the fork is dropped and it holds
+        # none. The error is caught here, in a frame that is done with once
+        # this returns: caught in _run, it would hold that task's suspended
+        # frame
+        try:
+            fork = self.kb.fork()
+            await asyncio.get_running_loop().run_in_executor(self._executor, apply_writes, fork, writes)
+        except Exception as error:
+            return error, False
+        try:
+            fork.commit()
+        except Exception as error:
+            return error, True
+        self.version += 1
+        return None, False
+
+
+def apply_writes(kb, writes):
+    """Apply a batch of queued writes in order, each run of consecutive
+        asserts with one kb_assert_many and each retract with kb_retract, so
+        the KB ends as if the writes were applied one at a time (a
+        kb_retract_many would also remove a target whose support a later
+        retract of the batch removes)
+
+    Args:
+        kb (KnowledgeBase): KB (the writer's fork) to apply them to
+        writes (listof (str, Fact|Rule, Future)): kind ('assert' or
+            'retract'), fact or rule, and the future of each write
+    """
+    for kind, run in itertools.groupby(writes, key=lambda write: write[0]):
+        items = [fact_rule for _, fact_rule, _ in run]
+        if kind == 'assert':
+            kb.kb_assert_many(items)
+        else:
+            for fact in items:
+                kb.kb_retract(fact)
@@ -0,0 +1,235 @@
+from logical_classes import *
+from util import is_var, canonical_pattern
+
+
+def extend(pattern, statement, values):
+    """Match a pattern against a statement under given variable values
+
+    Args:
+        pattern (Statement): pattern whose variables are in values or free
+        statement (Statement): statement to match, usually ground
+        values (dictof str): values of the pattern's bound variables
+
+    Returns:
+        dictof str|None: values extended with the pattern's free variables,
+            None if the statement doesn't match
+    """
+    if len(pattern) != len(statement) or pattern[0] != statement[0]:
+        return None
+    extended = values
+    for element, value in zip(pattern[1:], statement[1:]):
+        if is_var(element):
+            bound = extended.get(element)
+            if bound is None:
+                if extended is values:
+                    extended = dict(values)
+                extended[element] = value
+            elif bound != value:
+                return None
+        elif element != value:
+            return None
+    return extended
+
+
+def substitute(statement, values):
+    """Replace the bound variables of a statement by their values
+
+    Args:
+        statement (Statement): statement to instantiate
+        values (dictof str): variable values
+
+    Returns:
+        Statement
+    """
+    return Statement.from_tokens([values.get(element, element) for element in statement])
+
+
+class Table(object):
+    """Answers found so far for one goal (up to variable names)
+
+    Attributes:
+        goal (Statement): the goal
+        answers (dictof Fact): answers keyed by statement, KB facts first,
+            then facts derived by backward rules, each with the supported_by
+            justification of its first derivation
+        stored (int): number of answers that are KB facts
+    """
+    def __init__(self, goal):
+        """Constructor for an empty Table
+
+        Args:
+            goal (Statement): the goal
+        """
+        super(Table, self).__init__()
+        self.goal = goal
+        self.answers = {}
+        self.stored = 0
+
+
+class BackwardChainer(object):
+    """Goal-directed evaluation of the KB's backward rules (see
+        KnowledgeBase.kb_assert_backward) for one query: SLD resolution with
+        tabling. Every goal, up to variable names, gets a Table; a subgoal
+        met again while its table is being filled reads the answers found so
+        far instead of recursing, and the tables are re-evaluated until none
+        grows, so recursive rules terminate with every answer.
+
+    Derived answers are justified as forward chaining would justify them:
+    a rule with LHS (a b) and RHS c, resolved with facts A and B, gives the
+    curried rule (b') -> c' supported by [A, rule] and the fact c' supported
+    by [B, curried rule]. Neither is added to the KB.
+
+    Attributes:
+        kb (KnowledgeBase): KB holding the facts and backward rules
+        tables (dictof Table): tables by goal, see util.canonical_pattern
+        heads (dictof listof Rule): backward rules by (predicate, arity) of
+            their RHS
+    """
+    def __init__(self, kb):
+        """Constructor for BackwardChainer
+
+        Args:
+            kb (KnowledgeBase): KB to query
+        """
+        super(BackwardChainer, self).__init__()
+        self.kb = kb
+        self.tables = {}
+        self.heads = {}
+        for rule in kb.backward_rules:
+            self.heads.setdefault((rule.rhs[0], len(rule.rhs)), []).append(rule)
+
+    def derivable(self, statement):
+        """Check whether some backward rule concludes statements like this one
+
+        Args:
+            statement (Statement): goal
+
+        Returns:
+            bool
+        """
+        return (statement[0], len(statement)) in self.heads
+
+    def solve(self, goal):
+        """Find every answer to a goal
+
+        Args:
+            goal (Statement): goal to prove
+
+        Returns:
+            listof Fact: the answers, KB facts first
+        """
+        table = self.table(goal)
+        grown = True
+        while grown:
+            # until a round adds no answer and meets no new subgoal
+            tables = list(self.tables.values())
+            grown = False
+            for other in tables:
+                if self.evaluate(other):
+                    grown = True
+            grown = grown or len(self.tables) > len(tables)
+        return list(table.answers.values())
+
+    def derive(self, goal):
+        """Find the answers to a goal that the KB doesn't hold
+
+        Args:
+            goal (Statement): goal to prove
+
+        Returns:
+            listof Fact: the answers derived by backward rules
+        """
+        return self.solve(goal)[self.table(goal).stored:]
+
+    def table(self, goal):
+        """Get the table of a goal, making it (with the KB facts matching
+            the goal as first answers) the first time
+
+        Args:
+            goal (Statement): goal
+
+        Returns:
+            Table
+        """
+        key = canonical_pattern(goal)
+        table = self.tables.get(key)
+        if table is None:
+            table = self.tables[key] = Table(goal)
+            for fact in self.kb.facts.candidates(goal):
+                if extend(goal, fact.statement, {}) is not None:
+                    table.answers.setdefault(fact.statement, fact)
+            table.stored = len(table.answers)
+        return table
+
+    def lookup(self, statement):
+        """Get the facts a body statement can be resolved with: the KB's, or
+            the table's when backward rules conclude such statements
+
+        Args:
+            statement (Statement): body statement, partly instantiated
+
+        Returns:
+            listof Fact
+        """
+        if self.derivable(statement):
+            return list(self.table(statement).answers.values())
+        return self.kb.facts.candidates(statement)
+
+    def evaluate(self, table):
+        """Resolve a table's goal once with every backward rule concluding it
+
+        Args:
+            table (Table): table to fill
+
+        Returns:
+            bool: True if the table got new answers
+        """
+        goal = table.goal
+        grown = False
+        for rule in self.heads.get((goal[0], len(goal)), []):
+            # the goal's constants bind the rule's RHS variables
+            values = {}
+            for element, value in zip(rule.rhs[1:], goal[1:]):
+                if is_var(value):
+                    continue
+                if is_var(element):
+                    if values.setdefault(element, value) != value:
+                        break
+                elif element != value:
+                    break
+            else:
+                # resolve the LHS left to right, keeping every partial proof
+                partials = [(values, [])]
+                for statement in rule.lhs:
+                    resolved = []
+                    for values, facts in partials:
+                        for fact in self.lookup(substitute(statement, values)):
+                            extended = extend(statement, fact.statement, values)
+                            if extended is not None:
+                                resolved.append((extended, facts + [fact]))
+                    partials = resolved
+                for values, facts in partials:
+                    answer = substitute(rule.rhs, values)
+                    if answer not in table.answers and extend(goal, answer, {}) is not None:
+                        table.answers[answer] = self.justify(rule, facts, answer)
+                        grown = True
+        return grown
+
+    def justify(self, rule, facts, answer):
+        """Build a derived answer and the curried rules justifying it
+
+        Args:
+            rule (Rule): backward rule
+            facts (listof Fact): facts its LHS statements were resolved with
+            answer (Statement): the instantiated RHS
+
+        Returns:
+            Fact: the answer, supported by the last fact and curried rule
+        """
+        lhs, rhs = rule.lhs, rule.rhs
+        values = {}
+        for i in range(len(lhs) - 1):
+            values = extend(lhs[i], facts[i].statement, values)
+            rule = Rule([[substitute(statement, values) for statement in lhs[i + 1:]],
+                         substitute(rhs, values)], [[facts[i], rule]])
+        return Fact(answer, [[facts[-1], rule]])
@@ -0,0 +1,656 @@
+"""Benchmarks for the knowledge base.
+
+Run one with `python bench.py <name> [size]`, e.g. `python bench.py memory
+100000`. Each benchmark prints its measurements and returns them as a dict.
+"""
+import gc
+import logging
+import os
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+from logical_classes import *
+from student_code import KnowledgeBase
+from rete import ReteEngine
+import read
+import util
+
+
+def taxonomy_facts(n, classes=1000):
+    """Generate n (inst objI classJ) facts over the given number of classes
+
+    Args:
+        n (int): number of facts
+        classes (int): number of distinct classes
+
+    Returns:
+        listof Fact
+    """
+    return [Fact(['inst', 'obj' + str(i), 'class' + str(i % classes)]) for i in range(n)]
+
+
+def bench_memory(n=100000):
+    """Measure the memory taken per fact, by the Fact objects alone and by a
+        KnowledgeBase holding them (store and index included)
+
+    Args:
+        n (int): number of facts
+
+    Returns:
+        dict: bytes per fact for 'objects' and 'kb'
+    """
+    names = [('obj' + str(i), 'class' + str(i % 1000)) for i in range(n)]
+    gc.collect()
+    tracemalloc.start()
+    facts = [Fact(['inst', obj, cls]) for obj, cls in names]
+    objects = tracemalloc.get_traced_memory()[0] / float(n)
+    kb = KnowledgeBase([], [])
+    kb.kb_assert_many(facts)
+    in_kb = tracemalloc.get_traced_memory()[0] / float(n)
+    tracemalloc.stop()
+    print("bytes per fact: objects {:.0f}, in KB {:.0f}".format(objects, in_kb))
+    return {'objects': objects, 'kb': in_kb}
+
+
+def bench_match(n=20000):
+    """Compare the recursive matcher (util.match_recursive) with the loop
+        based one (util.match_compiled on a precompiled pattern) on a wide
+        statement (16 terms) and a long one (256 terms), half variables
+
+    Args:
+        n (int): matches per measurement, divided by 16 for the long statement
+
+    Returns:
+        dict: microseconds per match, keyed by (statement, matcher)
+    """
+    results = {}
+    for label, width, count in (('wide', 16, n), ('long', 256, max(1, n // 16))):
+        pattern = Statement(['p'] + ['?v' + str(i) if i % 2 else 'c' + str(i)
+                                     for i in range(width)])
+        fact = Statement(['p'] + ['c' + str(i) for i in range(width)])
+        compiled = util.compile_statement(pattern)
+        terms1, terms2 = pattern.terms, fact.terms
+        matchers = (
+            ('recursive', lambda: util.match_recursive(terms1, terms2, Bindings())),
+            ('loop', lambda: util.match_compiled(compiled, fact)),
+        )
+        for name, run in matchers:
+            assert run()
+            seconds = min(timeit.repeat(run, number=count, repeat=3))
+            results[(label, name)] = seconds / count * 1e6
+            print("{} ({} terms), {}: {:.2f} us per match".format(
+                label, width, name, results[(label, name)]))
+    return results
+
+
+def write_statements(file, n, rule_every=10):
+    """Write a statements file of n lines, one rule line every rule_every
+        lines and fact lines otherwise
+
+    Args:
+        file (file): open text file to write to
+        n (int): number of lines
+        rule_every (int): period of rule lines
+    """
+    for i in range(n):
+        if i % rule_every:
+            file.write("fact: (inst obj{} class{})\n".format(i, i % 1000))
+        else:
+            file.write("rule: ((inst ?x class{0}) (isa class{0} ?y)) -> (inst ?x ?y)\n".format(i % 1000))
+
+
+def bench_parse(n=1000000):
+    """Measure parse throughput: read.iter_tokenize over a generated file of
+        n fact: / rule: lines (one rule every 10 lines)
+
+    Args:
+        n (int): number of lines
+
+    Returns:
+        dict: 'seconds' taken and 'lines_per_second'
+    """
+    fd, path = tempfile.mkstemp(suffix='.txt')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            write_statements(file, n)
+        start = time.time()
+        count = sum(1 for _ in read.iter_tokenize(path))
+        seconds = time.time() - start
+    finally:
+        os.remove(path)
+    assert count == n
+    print("parsed {} lines in {:.2f} s, {:.0f} lines/s".format(n, seconds, n / seconds))
+    return {'seconds': seconds, 'lines_per_second': n / seconds}
+
+
+def taxonomy_kb(n, depth=10, chains=None):
+    """Build a KB of n (inst objI classJ) facts over chains of depth classes
+        linked by isa, with the usual inst/isa inheritance rule, so every
+        object gets depth inferred facts
+
+    Args:
+        n (int): number of asserted inst facts
+        depth (int): length of the isa chains
+        chains (int|None): number of isa chains, objects are spread evenly
+            over them. None for one chain per 100 objects
+
+    Returns:
+        KnowledgeBase: built with a ReteEngine
+    """
+    kb = KnowledgeBase([], [], ReteEngine())
+    if chains is None:
+        chains = max(1, n // 100)
+    items = [Fact(['isa', 'c{}_{}'.format(c, d), 'c{}_{}'.format(c, d + 1)])
+             for c in range(chains) for d in range(depth)]
+    items.extend(Fact(['inst', 'obj' + str(i), 'c{}_0'.format(i % chains)]) for i in range(n))
+    items.append(read.parse_input("rule: ((inst ?x ?y) (isa ?y ?z)) -> (inst ?x ?z)"))
+    kb.kb_assert_many(items)
+    return kb
+
+
+def bench_backward(n=20000, asks=100):
+    """Compare a taxonomy KB with its inheritance rule asserted forward and
+        backward: cost of asserting, facts stored, and cost of asking for
+        the classes of one object
+
+    Args:
+        n (int): number of asserted inst facts, see taxonomy_kb
+        asks (int): number of kb_ask calls timed
+
+    Returns:
+        dict: per mode, 'assert' and 'ask' seconds and stored 'facts'
+    """
+    chains, depth = max(1, n // 100), 10
+    facts = [Fact(['isa', 'c{}_{}'.format(c, d), 'c{}_{}'.format(c, d + 1)])
+             for c in range(chains) for d in range(depth)]
+    facts.extend(Fact(['inst', 'obj' + str(i), 'c{}_0'.format(i % chains)]) for i in range(n))
+    rule = read.parse_input("rule: ((inst ?x ?y) (isa ?y ?z)) -> (inst ?x ?z)")
+    ask = read.parse_input("fact: (inst obj0 ?c)")
+    results = {}
+    for mode in ('forward', 'backward'):
+        kb = KnowledgeBase([], [], ReteEngine())
+        start = time.time()
+        if mode == 'forward':
+            kb.kb_assert_many(facts + [rule])
+        else:
+            kb.kb_assert_many(facts)
+            kb.kb_assert_backward(rule)
+        asserted = time.time() - start
+        start = time.time()
+        for _ in range(asks):
+            answer = kb.kb_ask(ask)
+        asked = (time.time() - start) / asks
+        assert len(answer.list_of_bindings) == depth + 1
+        results[mode] = {'assert': asserted, 'ask': asked, 'facts': len(kb.facts)}
+    for mode, result in results.items():
+        print("{}: assert {:.3f} s, {} facts stored, ask {:.0f} us".format(
+            mode, result['assert'], result['facts'], result['ask'] * 1e6))
+    return results
+
+
+def bench_conjunction(n=100000, asks=10):
+    """Compare kb_ask_all with the caller's nested loop of kb_ask calls,
+        joining in the order written, on (size ?x big) (color ?x red)
+        (inst ?x pyramid) over n objects, one in a thousand a pyramid
+
+    Args:
+        n (int): number of objects, each with an inst, a color and a size
+        asks (int): number of times each query is run
+
+    Returns:
+        dict: seconds per query for 'nested' and 'planned', and 'answers'
+    """
+    kb = KnowledgeBase([], [])
+    colors, sizes = ['red', 'green', 'blue'], ['big', 'small']
+    items = []
+    for i in range(n):
+        name = 'obj' + str(i)
+        items.append(Fact(['inst', name, 'pyramid' if i % 1000 == 0 else 'block']))
+        items.append(Fact(['color', name, colors[i % 3]]))
+        items.append(Fact(['size', name, sizes[i % 2]]))
+    statements = [read.parse_input('fact: ' + text)
+                  for text in ('(size ?x big)', '(color ?x red)', '(inst ?x pyramid)')]
+    kb.kb_assert_many(items)
+
+    def nested():
+        answers = 0
+        for first in kb.kb_ask(statements[0]) or []:
+            second = Fact(util.instantiate(statements[1].statement, first))
+            for bindings in kb.kb_ask(second) or []:
+                third = Fact(util.instantiate(util.instantiate(statements[2].statement, first), bindings))
+                answers += len(kb.kb_ask(third))
+        return answers
+
+    start = time.time()
+    for _ in range(asks):
+        expected = nested()
+    loops = (time.time() - start) / asks
+    start = time.time()
+    for _ in range(asks):
+        answers = len(kb.kb_ask_all(statements))
+    planned = (time.time() - start) / asks
+    assert answers == expected
+    print("{} answers: nested kb_ask {:.4f} s, kb_ask_all {:.4f} s".format(answers, loops, planned))
+    return {'nested': loops, 'planned': planned, 'answers': answers}
+
+
+def bench_stream(n=200000, asks=10):
+    """Compare kb_ask with ask_exists, ask_count and taking the first answer
+        of ask_iter, on (inst ?x ?y) over n facts
+
+    Args:
+        n (int): number of inst facts, see taxonomy_facts
+        asks (int): number of times each form is run
+
+    Returns:
+        dict: seconds per call for 'ask', 'first', 'exists' and 'count'
+    """
+    kb = KnowledgeBase(taxonomy_facts(n), [])
+    ask = read.parse_input("fact: (inst ?x ?y)")
+    forms = [('ask', lambda: len(kb.kb_ask(ask))),
+             ('first', lambda: next(kb.ask_iter(ask))),
+             ('exists', lambda: kb.ask_exists(ask)),
+             ('count', lambda: kb.ask_count(ask))]
+    results = {}
+    for name, form in forms:
+        results[name] = timeit.timeit(form, number=asks) / asks
+    print("{} facts: kb_ask {:.4f} s, first of ask_iter {:.6f} s, ask_exists {:.6f} s, ask_count {:.4f} s".format(
+        n, results['ask'], results['first'], results['exists'], results['count']))
+    return results
+
+
+def bench_cache(n=100000, rounds=100, queries=20):
+    """Replay a dashboard on a taxonomy KB: every round asks the same
+        queries, then one fact is asserted, with the kb_ask cache off and on
+
+    Args:
+        n (int): number of inst facts, see taxonomy_facts
+        rounds (int): number of rounds
+        queries (int): number of (inst ?x classJ) queries per round
+
+    Returns:
+        dict: seconds with the cache 'off' and 'on', and the cache 'info'
+    """
+    asks = [read.parse_input("fact: (inst ?x class{})".format(j)) for j in range(queries)]
+    results = {}
+    for mode, maxsize in (('off', 0), ('on', 1000)):
+        kb = KnowledgeBase(taxonomy_facts(n), [])
+        kb.cache.maxsize = maxsize
+        start = time.time()
+        for r in range(rounds):
+            for ask in asks:
+                kb.kb_ask(ask)
+            kb.kb_assert(Fact(['inst', 'new' + str(r), 'class' + str(r % (2 * queries))]))
+        results[mode] = time.time() - start
+    results['info'] = kb.cache_info()
+    print("{} rounds of {} asks: cache off {:.3f} s, on {:.3f} s, {}".format(
+        rounds, queries, results['off'], results['on'], results['info']))
+    return results
+
+
+def bench_parallel(n=400000, workers=None, asks=5):
+    """Measure kb_ask_parallel on (inst ?x ?y) over n facts with 1 to
+        workers processes, against kb_ask
+
+    Args:
+        n (int): number of inst facts, see taxonomy_facts
+        workers (int|None): largest pool, None for one process per CPU
+        asks (int): number of timed asks per pool size
+
+    Returns:
+        dict: seconds per ask for 'serial' and for each pool size
+    """
+    import parallel
+    kb = KnowledgeBase(taxonomy_facts(n), [])
+    ask = read.parse_input("fact: (inst ?x ?y)")
+    results = {}
+    results['serial'] = timeit.timeit(lambda: kb.kb_ask(ask), number=asks) / asks
+    for count in range(1, (workers or os.cpu_count() or 1) + 1):
+        with parallel.ParallelAsker(kb, count) as asker:
+            asker.ask(ask.statement)
+            results[count] = timeit.timeit(lambda: asker.ask(ask.statement), number=asks) / asks
+    print("{} facts on {} CPUs: kb_ask {:.3f} s, ".format(n, os.cpu_count(), results['serial']) + ", ".join(
+        "{} workers {:.3f} s".format(count, results[count]) for count in results if count != 'serial'))
+    if (os.cpu_count() or 1) < 2:
+        print("single CPU: scaling over workers not measured")
+    return results
+
+
+def bench_batch(n=200000, patterns=500, workers=None):
+    """Measure a batch of independent asks, (inst objI ?c) and
+        (inst ?x classJ), run one after the other with kb_ask and spread
+        over warm workers with ask_batch
+
+    Args:
+        n (int): number of inst facts, see taxonomy_facts
+        patterns (int): number of asks in the batch
+        workers (int|None): number of worker processes, None for one per CPU
+
+    Returns:
+        dict: seconds for 'serial' and 'batch'
+    """
+    kb = KnowledgeBase(taxonomy_facts(n), [])
+    asks = [read.parse_input("fact: (inst obj{} ?c)".format(i) if i % 2 else
+                             "fact: (inst ?x class{})".format(i)) for i in range(patterns)]
+    start = time.time()
+    expected = [kb.kb_ask(ask) for ask in asks]
+    serial = time.time() - start
+    # start the workers, as a server would before taking requests
+    kb.ask_batch(asks[:1], workers)
+    start = time.time()
+    answers = kb.ask_batch(asks, workers)
+    batch = time.time() - start
+    assert [len(answer) for answer in answers] == [len(answer) for answer in expected]
+    print("{} asks on {} CPUs: kb_ask loop {:.3f} s, ask_batch on {} workers {:.3f} s".format(
+        patterns, os.cpu_count(), serial, kb._asker.workers, batch))
+    if (os.cpu_count() or 1) < 2:
+        print("single CPU: scaling over workers not measured")
+    return {'serial': serial, 'batch': batch}
+
+
+def bench_async(n=5000):
+    """Measure how long an event loop stalls while a taxonomy KB is built,
+        with kb_assert_many called on the loop and with the writes sent
+        through aiokb.AsyncKnowledgeBase, while a ticker task sleeps 1 ms at
+        a time
+
+    Args:
+        n (int): number of inst facts, see taxonomy_kb
+
+    Returns:
+        dict: per mode, 'seconds' to commit and longest 'stall' of the ticker
+    """
+    import asyncio
+    import aiokb
+    chains, depth = max(1, n // 100), 10
+    items = [Fact(['isa', 'c{}_{}'.format(c, d), 'c{}_{}'.format(c, d + 1)])
+             for c in range(chains) for d in range(depth)]
+    items.extend(Fact(['inst', 'obj' + str(i), 'c{}_0'.format(i % chains)]) for i in range(n))
+    items.append(read.parse_input("rule: ((inst ?x ?y) (isa ?y ?z)) -> (inst ?x ?z)"))
+
+    async def run(mode):
+        stalls, done = [0.0], []
+
+        async def ticker():
+            while not done:
+                start = time.time()
+                await asyncio.sleep(0.001)
+                stalls.append(time.time() - start)
+        task = asyncio.get_running_loop().create_task(ticker())
+        await asyncio.sleep(0.01)
+        start = time.time()
+        if mode == 'direct':
+            KnowledgeBase([], [], ReteEngine()).kb_assert_many(items)
+        else:
+            akb = aiokb.AsyncKnowledgeBase(KnowledgeBase([], [], ReteEngine()))
+            await asyncio.gather(*[akb.kb_assert(item) for item in items])
+            await akb.close()
+        seconds = time.time() - start
+        done.append(True)
+        await task
+        return {'seconds': seconds, 'stall': max(stalls)}
+
+    results = {}
+    for mode in ('direct', 'async'):
+        results[mode] = asyncio.run(run(mode))
+    for mode, result in results.items():
+        print("{}: {:.3f} s, longest loop stall {:.3f} s".format(mode, result['seconds'], result['stall']))
+    return results
+
+
+def bench_readers(n=20000, readers=4, rounds=3):
+    """Measure reader threads asking a taxonomy KB while a writer thread
+        retracts and re-asserts a hub fact (the bottom isa of a chain, see
+        bench_retract) rounds times, with every ask and write under one lock
+        vs readers on kb.reader() views, which take none
+
+    Args:
+        n (int): number of asserted inst facts, see taxonomy_kb
+        readers (int): number of reader threads
+        rounds (int): number of retract and re-assert rounds
+
+    Returns:
+        dict: per mode, 'seconds' the writer took, 'asks' answered meanwhile
+            and the longest 'wait' of one ask
+    """
+    import threading
+    hub = Fact(['isa', 'c0_0', 'c0_1'])
+    ask = read.parse_input("fact: (inst obj0 ?y)")
+    results = {}
+    for mode in ('lock', 'mvcc'):
+        kb = taxonomy_kb(n, chains=10)
+        lock, done, waits = threading.Lock(), [], []
+
+        def read_while_writing():
+            longest, count = 0.0, 0
+            while not done:
+                start = time.time()
+                if mode == 'lock':
+                    with lock:
+                        kb.kb_ask(ask)
+                else:
+                    with kb.reader() as view:
+                        view.kb_ask(ask)
+                longest, count = max(longest, time.time() - start), count + 1
+            waits.append((longest, count))
+        kb.reader().release()
+        threads = [threading.Thread(target=read_while_writing) for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+        start = time.time()
+        for _ in range(rounds):
+            for write in (kb.kb_retract, kb.kb_assert):
+                with lock:
+                    write(hub)
+        seconds = time.time() - start
+        done.append(True)
+        for thread in threads:
+            thread.join()
+        results[mode] = {'seconds': seconds, 'asks': sum(count for _, count in waits),
+                         'wait': max(longest for longest, _ in waits)}
+    for mode, result in results.items():
+        print("{}: writer {:.2f} s, {} asks meanwhile, longest ask {:.3f} s".format(
+            mode, result['seconds'], result['asks'], result['wait']))
+    return results
+
+
+def bench_snapshot(n=20000):
+    """Compare building a KB by inference with restoring it from a snapshot
+
+    Args:
+        n (int): number of asserted inst facts, see taxonomy_kb
+
+    Returns:
+        dict: seconds to 'infer', 'save' and 'load', and snapshot 'bytes'
+    """
+    fd, path = tempfile.mkstemp(suffix='.kb')
+    os.close(fd)
+    try:
+        start = time.time()
+        kb = taxonomy_kb(n)
+        infer = time.time() - start
+        start = time.time()
+        kb.save(path)
+        save = time.time() - start
+        start = time.time()
+        loaded = KnowledgeBase.load(path, ReteEngine())
+        load = time.time() - start
+        size = os.path.getsize(path)
+    finally:
+        os.remove(path)
+    assert len(loaded.facts) == len(kb.facts)
+    print("{} facts, {} rules: inference {:.2f} s, save {:.2f} s, load {:.2f} s, {} bytes".format(
+        len(kb.facts), len(kb.rules), infer, save, load, size))
+    return {'infer': infer, 'save': save, 'load': load, 'bytes': size}
+
+
+def bench_mapped(n=20000, asks=1000):
+    """Compare what a query worker pays to get a KB: KnowledgeBase.load
+        (objects on the worker's heap) vs mapped.MappedKnowledgeBase (the
+        shared, page-cached file), and the cost of a selective kb_ask on each
+
+    Args:
+        n (int): number of asserted inst facts, see taxonomy_kb
+        asks (int): number of (inst objI ?c) queries timed
+
+    Returns:
+        dict: 'seconds' to open, 'heap' bytes and 'ask' microseconds per
+            query, keyed by 'load' and 'mapped'
+    """
+    import mapped
+    fd, path = tempfile.mkstemp(suffix='.kb')
+    os.close(fd)
+    queries = [read.parse_input("fact: (inst obj{} ?c)".format(i * n // asks)) for i in range(asks)]
+    results = {}
+    try:
+        taxonomy_kb(n).save(path)
+        for label, open_kb in (('load', lambda: KnowledgeBase.load(path, ReteEngine())),
+                               ('mapped', lambda: mapped.MappedKnowledgeBase(path))):
+            gc.collect()
+            tracemalloc.start()
+            start = time.time()
+            kb = open_kb()
+            seconds = time.time() - start
+            heap = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            start = time.time()
+            for query in queries:
+                kb.kb_ask(query)
+            ask = (time.time() - start) / asks * 1e6
+            results[label] = {'seconds': seconds, 'heap': heap, 'ask': ask}
+            print("{}: open {:.3f} s, heap {} bytes, ask {:.1f} us".format(label, seconds, heap, ask))
+            del kb
+    finally:
+        os.remove(path)
+    return results
+
+
+def bench_retract(n=20000, hubs=3):
+    """Measure retraction of hub facts: the bottom isa fact of a chain in a
+        taxonomy KB with 10 chains, whose removal cascades to every fact and
+        curried rule inferred for the objects of that chain. The hubs are
+        retracted one kb_retract at a time, then on a fresh KB with one
+        kb_retract_many call.
+
+    Args:
+        n (int): number of asserted inst facts, see taxonomy_kb
+        hubs (int): number of chains whose bottom isa fact is retracted
+
+    Returns:
+        dict: 'seconds' taken by all the retractions and 'removed' facts and
+            rules, keyed by 'loop' and 'many'
+    """
+    targets = [Fact(['isa', 'c{}_0'.format(c), 'c{}_1'.format(c)]) for c in range(hubs)]
+    results = {}
+    for label in ('loop', 'many'):
+        kb = taxonomy_kb(n, chains=10)
+        before = len(kb.facts) + len(kb.rules)
+        start = time.time()
+        if label == 'loop':
+            for target in targets:
+                kb.kb_retract(target)
+        else:
+            kb.kb_retract_many(targets)
+        seconds = time.time() - start
+        removed = before - len(kb.facts) - len(kb.rules)
+        results[label] = {'seconds': seconds, 'removed': removed}
+        print("{}: retracted {} hub facts in {:.2f} s, {} facts and rules removed".format(
+            label, hubs, seconds, removed))
+    return results
+
+
+def bench_transaction(n=5000, batch=50):
+    """Measure a speculative batch run in a transaction and rolled back on
+        a taxonomy KB, against a copy.deepcopy of the KB, the way to undo a
+        batch before transactions
+
+    Args:
+        n (int): number of asserted inst facts, see taxonomy_kb
+        batch (int): number of new inst facts asserted in the transaction
+
+    Returns:
+        dict: seconds taken by the 'transaction' (batch and rollback) and by
+            the 'deepcopy'
+    """
+    import copy
+    kb = taxonomy_kb(n)
+    size = len(kb.facts) + len(kb.rules)
+    items = [Fact(['inst', 'new' + str(i), 'c0_0']) for i in range(batch)]
+    start = time.time()
+    try:
+        with kb.transaction():
+            kb.kb_assert_many(items)
+            raise ValueError("roll back")
+    except ValueError:
+        pass
+    transaction = time.time() - start
+    assert len(kb.facts) + len(kb.rules) == size
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 100000))
+    try:
+        start = time.time()
+        copy.deepcopy(kb)
+        deepcopy = time.time() - start
+    finally:
+        sys.setrecursionlimit(limit)
+    print("{} facts and rules: batch of {} and rollback {:.3f} s, deepcopy {:.2f} s".format(
+        size, batch, transaction, deepcopy))
+    return {'transaction': transaction, 'deepcopy': deepcopy}
+
+
+def bench_fork(n=20000, batch=50):
+    """Measure a what-if scenario on a fork of a taxonomy KB: making the
+        fork, asserting a batch of new inst facts in it, and the size of the
+        delta it records
+
+    Args:
+        n (int): number of asserted inst facts, see taxonomy_kb
+        batch (int): number of new inst facts asserted in the fork
+
+    Returns:
+        dict: 'fork' and 'scenario' seconds, and 'delta', the number of
+            facts and rules the fork holds itself
+    """
+    kb = taxonomy_kb(n)
+    items = [Fact(['inst', 'new' + str(i), 'c0_0']) for i in range(batch)]
+    start = time.time()
+    fork = kb.fork()
+    made = time.time() - start
+    start = time.time()
+    fork.kb_assert_many(items)
+    scenario = time.time() - start
+    delta = sum(len(store.added) + len(store.changed) for store in (fork.facts, fork.rules))
+    print("{} facts and rules: fork {:.6f} s, batch of {} {:.3f} s, delta of {} facts and rules".format(
+        len(kb.facts) + len(kb.rules), made, batch, scenario, delta))
+    return {'fork': made, 'scenario': scenario, 'delta': delta}
+
+
+BENCHMARKS = {
+    'memory': bench_memory,
+    'match': bench_match,
+    'parse': bench_parse,
+    'snapshot': bench_snapshot,
+    'mapped': bench_mapped,
+    'retract': bench_retract,
+    'transaction': bench_transaction,
+    'fork': bench_fork,
+    'backward': bench_backward,
+    'conjunction': bench_conjunction,
+    'stream': bench_stream,
+    'cache': bench_cache,
+    'parallel': bench_parallel,
+    'batch': bench_batch,
+    'async': bench_async,
+    'readers': bench_readers,
+}
+
+if __name__ == '__main__':
+    # keep the KB's messages (e.g. retracting a fact it doesn't hold) out of the timings
+    for module in ('student_code', 'read', 'util'):
+        logging.getLogger(module).setLevel(logging.ERROR)
+    name = sys.argv[1] if len(sys.argv) > 1 else 'memory'
+    args = [int(arg) for arg in sys.argv[2:]]
+    BENCHMARKS[name](*args)
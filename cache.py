@@ -0,0 +1,135 @@
+from collections import OrderedDict, namedtuple
+
+from logical_classes import *
+from util import is_var, canonical_pattern
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class QueryCache(object):
+    """Least recently used cache of kb_ask results, keyed by canonical query.
+        The KB calls invalidate with every fact it stores or removes, which
+        drops exactly the entries of the same predicate and arity whose
+        constants the fact agrees with (a variable on either side agrees
+        with anything), i.e. the queries the fact could match.
+
+    Cached answers share their Bindings and Facts with every caller that
+    gets them; treat them as read-only.
+
+    Attributes:
+        maxsize (int): number of queries kept, 0 disables the cache
+        hits (int): lookups answered from the cache
+        misses (int): lookups that weren't
+    """
+    def __init__(self, maxsize=0):
+        """Constructor for an empty QueryCache
+
+        Args:
+            maxsize (int): number of queries kept, 0 disables the cache
+        """
+        super(QueryCache, self).__init__()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # canonical key => (query, ListOfBindings), least recent first
+        self._entries = OrderedDict()
+        # (predicate, arity) => canonical keys of its entries
+        self._by_predicate = {}
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'QueryCache({!r})'.format(self.info())
+
+    def __len__(self):
+        """Define behavior of len, the number of cached queries
+        """
+        return len(self._entries)
+
+    def info(self):
+        """Get the counters of the cache, like functools.lru_cache
+
+        Returns:
+            CacheInfo: hits, misses, maxsize and currsize
+        """
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def get(self, statement):
+        """Get the cached answers of a query, with the bindings renamed to
+            its variables
+
+        Args:
+            statement (Statement): query
+
+        Returns:
+            ListOfBindings|None: the answers, None if they aren't cached
+        """
+        if not self.maxsize:
+            return None
+        key = canonical_pattern(statement)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        query, cached = entry
+        answers = ListOfBindings()
+        if query == statement:
+            answers.list_of_bindings = list(cached.list_of_bindings)
+            return answers
+        names = dict((old, new) for old, new in zip(query[1:], statement[1:]) if is_var(old))
+        for bindings, facts_rules in cached.list_of_bindings:
+            renamed = Bindings()
+            renamed.bindings_dict = dict((names.get(variable, variable), value)
+                                         for variable, value in bindings.bindings_dict.items())
+            answers.add_bindings(renamed, facts_rules)
+        return answers
+
+    def put(self, statement, answers):
+        """Cache the answers of a query, evicting the least recently used
+            query if the cache is full
+
+        Args:
+            statement (Statement): query
+            answers (ListOfBindings): its answers
+        """
+        if not self.maxsize:
+            return
+        key = canonical_pattern(statement)
+        if key not in self._entries:
+            self._by_predicate.setdefault((key[0], len(key)), set()).add(key)
+        self._entries[key] = (statement, answers)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._drop(next(iter(self._entries)))
+
+    def invalidate(self, statement):
+        """Drop the cached queries a statement could match
+
+        Args:
+            statement (Statement): statement of a fact stored or removed, or
+                pattern of the statements that changed
+        """
+        keys = self._by_predicate.get((statement[0], len(statement)))
+        if not keys:
+            return
+        for key in list(keys):
+            for cached, element in zip(key[1:], statement[1:]):
+                if cached != element and not is_var(cached) and not is_var(element):
+                    break
+            else:
+                self._drop(key)
+
+    def clear(self):
+        """Drop every cached query, keeping the counters
+        """
+        self._entries.clear()
+        self._by_predicate.clear()
+
+    def _drop(self, key):
+        del self._entries[key]
+        keys = self._by_predicate[(key[0], len(key))]
+        keys.discard(key)
+        if not keys:
+            del self._by_predicate[(key[0], len(key))]
@@ -1,3 +1,5 @@
+import itertools
+import sys
 from util import is_var
 
 class Fact(object):
@@ -10,11 +12,14 @@ class Fact(object):
         statement (Statement): statement of this fact, basically what the fact actually says
         asserted (bool): boolean flag indicating if fact was asserted instead of
             inferred from other rules/facts in the KB
-        supported_by (listof Fact|Rule): Facts/Rules that allow inference of
-            the statement
+        supported_by (listof Justification): [fact, rule] pairs that allow
+            inference of the statement
         supports_facts (listof Fact): Facts that this fact supports
         supports_rules (listof Rule): Rules that this fact supports
     """
+    __slots__ = ('statement', 'asserted', 'supported_by', 'supports_facts', 'supports_rules')
+    name = "fact"
+
     def __init__(self, statement, supported_by=[]):
         """Constructor for Fact setting up useful flags and generating appropriate statement
 
@@ -25,7 +30,6 @@ class Fact(object):
                 the statement
         """
         super(Fact, self).__init__()
-        self.name = "fact"
         self.statement = statement if isinstance(statement, Statement) else Statement(statement)
         self.asserted = not supported_by
         #self.supported_by = supported_by
@@ -33,7 +37,7 @@ class Fact(object):
         self.supports_facts = []
         self.supports_rules = []
         for pair in supported_by:
-           self.supported_by.append(pair)
+           self.supported_by.append(Justification(*pair))
 
     def __repr__(self):
         """Define internal string representation
@@ -66,13 +70,26 @@ class Fact(object):
     def __eq__(self, other):
         """Define behavior of == when applied to this object
         """
-        return isinstance(other, Fact) and self.statement == other.statement
+        return self is other or isinstance(other, Fact) and self.statement == other.statement
 
     def __ne__(self, other):
         """Define behavior of != when applied to this object
         """
         return not self == other
 
+    def __hash__(self):
+        """Define behavior of hash() so equal facts hash alike
+        """
+        return hash(self.key())
+
+    def key(self):
+        """Canonical, hashable key of this fact, see Statement.key
+
+        Returns:
+            tuple: key of this fact's statement
+        """
+        return self.statement
+
 class Rule(object):
     """Represents a rule in our knowledge base. Has a list of statements (the LHS)
         containing the statements that need to be in our KB for us to infer the
@@ -85,11 +102,21 @@ class Rule(object):
         rhs (Statement): RHS statment of this rule
         asserted (bool): boolean flag indicating if rule was asserted instead of
             inferred from other rules/facts in the KB
-        supported_by (listof Fact|Rule): Facts/Rules that allow inference of
-            the statement
+        supported_by (listof Justification): [fact, rule] pairs that allow
+            inference of the statement
         supports_facts (listof Fact): Facts that this rule supports
         supports_rules (listof Rule): Rules that this rule supports
+        plan (RulePlan|None): compiled form of the rule this one was asserted
+            or curried from, set when the rule enters the KB
+        depth (int): index in plan.lhs of this rule's first LHS statement,
+            i.e. how many LHS statements were curried away
+        values (tupleof str|None): value of each plan variable slot bound by
+            currying, None where not bound yet
     """
+    __slots__ = ('lhs', 'rhs', 'asserted', 'supported_by', 'supports_facts',
+                 'supports_rules', '_key', 'plan', 'depth', 'values')
+    name = "rule"
+
     def __init__(self, rule, supported_by=[]):
         """Constructor for Rule setting up useful flags and generating appropriate LHS & RHS
 
@@ -100,15 +127,18 @@ class Rule(object):
                 the statement
         """
         super(Rule, self).__init__()
-        self.name = "rule"
         self.lhs = [statement if isinstance(statement, Statement) else Statement(statement) for statement in rule[0]]
         self.rhs = rule[1] if isinstance(rule[1], Statement) else Statement(rule[1])
+        self._key = (tuple(self.lhs), self.rhs)
+        self.plan = None
+        self.depth = 0
+        self.values = None
         self.asserted = not supported_by
         self.supported_by = []
         self.supports_facts = []
         self.supports_rules = []
         for pair in supported_by:
-            self.supported_by.append(pair)
+            self.supported_by.append(Justification(*pair))
 
     def __repr__(self):
         """Define internal string representation
@@ -144,25 +174,121 @@ class Rule(object):
     def __eq__(self, other):
         """Define behavior of == when applied to this object
         """
-        is_rule = isinstance(other, Rule)
-        return is_rule and self.lhs == other.lhs and self.rhs == other.rhs
+        return self is other or isinstance(other, Rule) and self._key == other._key
 
     def __ne__(self, other):
         """Define behavior of != when applied to this object
         """
         return not self == other
 
-class Statement(object):
+    def __hash__(self):
+        """Define behavior of hash() so equal rules hash alike
+        """
+        return hash(self.key())
+
+    def key(self):
+        """Canonical, hashable key of this rule made of the keys of its LHS
+            statements and of its RHS statement. Computed once, so the LHS and
+            RHS of a rule must not be changed after it is made.
+
+        Returns:
+            tuple: (tuple of LHS statement keys, RHS statement key)
+        """
+        return self._key
+
+class Justification(list):
+    """One entry of a supported_by list: the [fact, rule] pair a fact or rule
+        was inferred from, plus an integer id that names the pair during
+        retraction (see KnowledgeBase.help_retract_cascade). Still a list, so
+        it compares equal to [fact, rule] and unpacks like one.
+
+    Attributes:
+        id (int): unique id of this justification
+    """
+    __slots__ = ('id',)
+    _ids = itertools.count()
+
+    def __init__(self, fact, rule):
+        """Constructor for Justification
+
+        Args:
+            fact (Fact): the fact of the pair
+            rule (Rule): the rule of the pair
+        """
+        super(Justification, self).__init__((fact, rule))
+        self.id = next(Justification._ids)
+
+class RulePlan(object):
+    """Compiled form of a rule, made once when the rule enters the KB and
+        shared by every rule curried from it. Each variable of the rule gets a
+        slot number and every statement becomes a template: the predicate
+        followed by, per term, either its constant (str) or its slot (int).
+        Firing the rule is then filling slots, see InferenceEngine.derive.
+
+    Attributes:
+        variables (listof str): variable names, indexed by slot
+        lhs (listof tuple): templates of the LHS statements
+        rhs (tuple): template of the RHS statement
+    """
+    __slots__ = ('variables', 'lhs', 'rhs')
+
+    def __init__(self, rule):
+        """Constructor for RulePlan compiling the given rule
+
+        Args:
+            rule (Rule): rule to compile
+        """
+        super(RulePlan, self).__init__()
+        slots = {}
+        def template(statement):
+            return (statement[0],) + tuple(
+                slots.setdefault(e, len(slots)) if e[0] == "?" else e
+                for e in statement[1:])
+        self.lhs = [template(statement) for statement in rule.lhs]
+        self.rhs = template(rule.rhs)
+        self.variables = sorted(slots, key=slots.get)
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'RulePlan({!r}, {!r}, {!r})'.format(self.variables, self.lhs, self.rhs)
+
+    def fill(self, template, values):
+        """Instantiate a template with slot values; unbound slots give back
+            their variable
+
+        Args:
+            template (tuple): one of this plan's templates
+            values (listof str|None): value of each slot
+
+        Returns:
+            Statement: the instantiated statement
+        """
+        elements = [template[0]]
+        for code in template[1:]:
+            if type(code) == int:
+                elements.append(values[code] or self.variables[code])
+            else:
+                elements.append(code)
+        return Statement(elements)
+
+class Statement(tuple):
     """Represents a statement in our knowledge base, e.g. (attacked Ai Nosliw),
         (diamonds Loot), (isa Sorceress Wizard), etc. These statements show up
         in Facts or on the LHS and RHS of Rules
 
+    A Statement is an immutable tuple of the predicate followed by the
+    element (str) of every term, e.g. ('isa', 'Sorceress', 'Wizard'), so it is
+    its own key and equality and hashing are tuple comparison and hashing.
+
     Attributes:
-        terms (listof Term): List of terms (Variable or Constant) in the
-            statement, e.g. 'Nosliw' or '?d'
+        terms (tupleof Term): Terms (Variable or Constant) in the statement,
+            e.g. 'Nosliw' or '?d'
         predicate (str): The predicate of the statement, e.g. isa, hero, needs
     """
-    def __init__(self, statement_list=[]):
+    __slots__ = ()
+
+    def __new__(cls, statement_list=[]):
         """Constructor for Statements with optional list of Statements that are
             converted to appropriate terms (and one predicate)
 
@@ -172,59 +298,105 @@ class Statement(object):
                 the list is either instantiated Terms or strings to be passed to the
                 Term constructor
         """
-        super(Statement, self).__init__()
-        self.terms = []
-        self.predicate = ""
+        if not statement_list:
+            return super(Statement, cls).__new__(cls, ("",))
+        elements = [sys.intern(statement_list[0])]
+        for t in statement_list[1:]:
+            if type(t) != str:
+                t = t.term.element if isinstance(t, Term) else t.element
+            elements.append(sys.intern(t))
+        return super(Statement, cls).__new__(cls, elements)
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        """Make a Statement straight from the string tokens of a parsed
+            statement, predicate first, interning them. Skips the per-term
+            conversions of the constructor.
 
-        if statement_list:
-            self.predicate = statement_list[0]
-            self.terms = [t if isinstance(t, Term) else Term(t) for t in statement_list[1:]]
+        Args:
+            tokens (listof str): predicate followed by the term elements
+
+        Returns:
+            Statement
+        """
+        return tuple.__new__(cls, map(sys.intern, tokens or ("",)))
+
+    @property
+    def predicate(self):
+        """The predicate of the statement
+        """
+        return self[0]
+
+    @property
+    def terms(self):
+        """The terms of the statement, as interned Terms
+        """
+        interned = Term._interned
+        return tuple(interned.get(element) or Term(element) for element in self[1:])
 
     def __repr__(self):
         """Define internal string representation
         """
-        return 'Statement({!r}, {!r})'.format(self.predicate, self.terms)
+        return 'Statement({!r}, {!r})'.format(self.predicate, list(self.terms))
 
     def __str__(self):
         """Define external representation when printed
         """
-        return "(" + self.predicate + " " + ' '.join((str(t) for t in self.terms)) + ")"
-
-    def __eq__(self, other):
-        """Define behavior of == when applied to this object
-        """
-        if self.predicate != other.predicate:
-            return False
+        return "(" + self[0] + " " + ' '.join(self[1:]) + ")"
 
-        for self_term, other_term in zip(self.terms, other.terms):
-            if self_term != other_term:
-                return False
+    def key(self):
+        """Canonical, hashable key of this statement: the predicate followed by
+            the element of every term, e.g. ('isa', 'Sorceress', 'Wizard').
+            That is the statement itself.
 
-        return True
-
-    def __ne__(self, other):
-        """Define behavior of != when applied to this object
+        Returns:
+            Statement: this statement
         """
-        return not self == other
+        return self
 
 class Term(object):
     """Represents a term (a Variable or Constant) in our knowledge base. Can
         sorta be thought of as a super class of Variable and Constant, though
         there is no inheritance implemented in the code.
 
+    Terms, like Variables and Constants, are interned: there is a single Term
+    object per distinct variable or constant, so Term('?x') is Term('?x').
+    The intern table is keyed by the Variable/Constant type and element, and
+    by the bare element string for the usual case where that string alone
+    tells whether it is a variable.
+
     Attributes:
         term (Variable|Constant): The Variable or Constant that this term holds (represents)
     """
-    def __init__(self, term):
-        """Constructor for Term which converts term to appropriate form
+    __slots__ = ('term',)
+    _interned = {}
+
+    def __new__(cls, term):
+        """Constructor for Term which converts term to appropriate form. Returns
+            the interned Term for term, making it the first time
 
         Args:
             term (Variable|Constant|string): Either an instantiated Variable or
                 Constant, or a string to be passed to the appropriate constructor
         """
-        super(Term, self).__init__()
-        is_var_or_const = isinstance(term, Variable) or isinstance(term, Constant)
-        self.term = term if is_var_or_const else (Variable(term) if is_var(term) else Constant(term))
+        self = cls._interned.get(term) if type(term) == str else None
+        if self is None:
+            is_var_or_const = isinstance(term, Variable) or isinstance(term, Constant)
+            term = term if is_var_or_const else (Variable(term) if is_var(term) else Constant(term))
+            key = (type(term), term.element)
+            self = cls._interned.get(key)
+            if self is None:
+                self = super(Term, cls).__new__(cls)
+                self.term = term
+                cls._interned[key] = self
+                if is_var(term.element) == isinstance(term, Variable):
+                    cls._interned[term.element] = self
+        return self
+
+    def __reduce__(self):
+        """Define how to pickle/copy, through the interning constructor
+        """
+        return (Term, (self.term,))
 
     def __repr__(self):
         """Define internal string representation
@@ -249,20 +421,40 @@ class Term(object):
         """
         return not self == other
 
+    def __hash__(self):
+        """Define behavior of hash(), consistent with == across Term,
+            Variable and Constant
+        """
+        return hash(self.term.element)
+
 class Variable(object):
-    """Represents a variable used in statements
+    """Represents a variable used in statements. Interned: there is a single
+        Variable object per name.
 
     Attributes:
         element (str): The name of the variable, e.g. '?x'
     """
-    def __init__(self, element):
-        """Constructor for Variable
+    __slots__ = ('element',)
+    _interned = {}
+
+    def __new__(cls, element):
+        """Constructor for Variable. Returns the interned Variable named
+            element, making it the first time
 
         Args:
             element (str): The name of the variable, e.g. '?x'
         """
-        super(Variable, self).__init__()
-        self.element = element
+        self = cls._interned.get(element)
+        if self is None:
+            self = super(Variable, cls).__new__(cls)
+            self.element = sys.intern(element)
+            cls._interned[self.element] = self
+        return self
+
+    def __reduce__(self):
+        """Define how to pickle/copy, through the interning constructor
+        """
+        return (Variable, (self.element,))
 
     def __repr__(self):
         """Define internal string representation
@@ -278,29 +470,49 @@ class Variable(object):
         """Define behavior of == when applied to this object
         """
         return (self is other
-            or isinstance(other, Term) and self.term.element == other.term.element
+            or isinstance(other, Term) and self.element == other.term.element
             or ((isinstance(other, Variable) or isinstance(other, Constant))
-                and self.term.element == other.element))
+                and self.element == other.element))
 
     def __ne__(self, other):
         """Define behavior of != when applied to this object
         """
         return not self == other
 
+    def __hash__(self):
+        """Define behavior of hash(), consistent with == across Term,
+            Variable and Constant
+        """
+        return hash(self.element)
+
 class Constant(object):
-    """Represents a constant used in statements
+    """Represents a constant used in statements. Interned: there is a single
+        Constant object per value.
 
     Attributes:
         element (str): The value of the constant, e.g. 'Nosliw'
     """
-    def __init__(self, element):
-        """Constructor for Constant
+    __slots__ = ('element',)
+    _interned = {}
+
+    def __new__(cls, element):
+        """Constructor for Constant. Returns the interned Constant with value
+            element, making it the first time
 
         Args:
             element (str): The value of the constant, e.g. 'Nosliw'
         """
-        super(Constant, self).__init__()
-        self.element = element
+        self = cls._interned.get(element)
+        if self is None:
+            self = super(Constant, cls).__new__(cls)
+            self.element = sys.intern(element)
+            cls._interned[self.element] = self
+        return self
+
+    def __reduce__(self):
+        """Define how to pickle/copy, through the interning constructor
+        """
+        return (Constant, (self.element,))
 
     def __repr__(self):
         """Define internal string representation
@@ -316,15 +528,21 @@ class Constant(object):
         """Define behavior of == when applied to this object
         """
         return (self is other
-            or isinstance(other, Term) and self.term.element == other.term.element
+            or isinstance(other, Term) and self.element == other.term.element
             or ((isinstance(other, Variable) or isinstance(other, Constant))
-                and self.term.element == other.element))
+                and self.element == other.element))
 
     def __ne__(self, other):
         """Define behavior of != when applied to this object
         """
         return not self == other
 
+    def __hash__(self):
+        """Define behavior of hash(), consistent with == across Term,
+            Variable and Constant
+        """
+        return hash(self.element)
+
 class Binding(object):
     """Represents a binding of a constant to a variable, e.g. 'Nosliw' might be
         bound to'?d'
@@ -333,6 +551,8 @@ class Binding(object):
         variable (Variable): The name of the variable associated with this binding
         constant (Constant): The value of the variable
     """
+    __slots__ = ('variable', 'constant')
+
     def __init__(self, variable, constant):
         """Constructor for Binding
 
@@ -358,17 +578,26 @@ class Bindings(object):
     """Represents Binding(s) used while matching two statements
 
     Attributes:
-        bindings (listof Bindings): bindings involved in match
+        bindings (listof Binding): bindings involved in match, built from
+            bindings_dict (in binding order) when asked for
         bindings_dict (dictof Bindings): bindings involved in match where key is
             bound variable and value is bound value,
             e.g. some_bindings.bindings_dict['?d'] => 'Nosliw'
     """
+    __slots__ = ('bindings_dict',)
+
     def __init__(self):
         """Constructor for Bindings creating initially empty instance
         """
-        self.bindings = []
         self.bindings_dict = {}
 
+    @property
+    def bindings(self):
+        """Binding objects of the bindings involved in match, in binding order
+        """
+        return [Binding(Variable(variable), Term(value).term)
+                for variable, value in self.bindings_dict.items()]
+
     def __repr__(self):
         """Define internal string representation
         """
@@ -377,7 +606,7 @@ class Bindings(object):
     def __str__(self):
         """Define external representation when printed
         """
-        if self.bindings == []:
+        if not self.bindings_dict:
             return "No bindings"
         return ", ".join((str(binding) for binding in self.bindings))
 
@@ -398,7 +627,6 @@ class Bindings(object):
             value (Constant): the value to bind to the variable
         """
         self.bindings_dict[variable.element] = value.element
-        self.bindings.append(Binding(variable, value))
 
     def bound_to(self, variable):
         """Check if variable is bound. If so return value bound to it, else False.
@@ -1,7 +1,19 @@
+import asyncio
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import traceback
 import unittest
 import read, copy
 from logical_classes import *
-from student_code import KnowledgeBase
+from student_code import KnowledgeBase, InferenceEngine
+from rete import ReteEngine
+from mapped import MappedKnowledgeBase
+from parallel import ParallelAsker
+from aiokb import AsyncKnowledgeBase
+from util import match, match_recursive
 
 class KBTest(unittest.TestCase):
 
@@ -71,6 +83,547 @@ class KBTest(unittest.TestCase):
         answer = self.KB.kb_ask(ask1)
         self.assertEqual(str(answer[0]), "?X : bing")
 
+    def test6(self):
+        # asks go through the predicate/argument index
+        ask1 = read.parse_input("fact: (motherof ?X chen)")
+        candidates = self.KB.facts.candidates(ask1.statement)
+        self.assertEqual(len(candidates), 2)
+        answer = self.KB.kb_ask(ask1)
+        self.assertEqual(str(answer[0]), "?X : bing")
+        self.assertEqual(str(answer[1]), "?X : dolores")
+        ask2 = read.parse_input("fact: (motherof nobody ?X)")
+        self.assertFalse(self.KB.kb_ask(ask2))
+
+    def test7(self):
+        # the Rete engine infers the same facts, rules and justifications
+        KB = KnowledgeBase([], [], ReteEngine())
+        for item in read.read_tokenize('statements_kb4.txt'):
+            KB.kb_assert(item)
+        for kb_fact in self.KB.facts:
+            fact = KB._get_fact(kb_fact)
+            self.assertTrue(fact is not None)
+            self.assertEqual(sorted((f.key(), r.key()) for f, r in fact.supported_by),
+                             sorted((f.key(), r.key()) for f, r in kb_fact.supported_by))
+        self.assertEqual(len(KB.facts), len(self.KB.facts))
+        self.assertEqual(len(KB.rules), len(self.KB.rules))
+        KB.kb_retract(read.parse_input("fact: (motherof ada bing)"))
+        answer = KB.kb_ask(read.parse_input("fact: (grandmotherof ada ?X)"))
+        self.assertEqual(len(answer), 1)
+        self.assertEqual(str(answer[0]), "?X : felix")
+
+    def test8(self):
+        # a batch load ends in the same KB as asserting one at a time
+        KB = KnowledgeBase([], [])
+        KB.kb_assert_many(read.read_tokenize('statements_kb4.txt'))
+        self.assertEqual(set(f.key() for f in KB.facts), set(f.key() for f in self.KB.facts))
+        self.assertEqual(set(r.key() for r in KB.rules), set(r.key() for r in self.KB.rules))
+        for kb_fact in self.KB.facts:
+            self.assertEqual(len(KB._get_fact(kb_fact).supported_by), len(kb_fact.supported_by))
+        ask1 = read.parse_input("fact: (grandmotherof ada ?X)")
+        self.assertEqual(len(KB.kb_ask(ask1)), 2)
+
+    def test9(self):
+        # derivation chains longer than the recursion limit, then retracted
+        KB = KnowledgeBase([], [])
+        KB.kb_assert(read.parse_input("rule: ((inst ?x ?y) (isa ?y ?z)) -> (inst ?x ?z)"))
+        for i in range(400):
+            KB.kb_assert(Fact(['isa', 'c' + str(i), 'c' + str(i + 1)]))
+        KB.kb_assert(Fact(['inst', 'obj', 'c0']))
+        answer = KB.kb_ask(read.parse_input("fact: (inst obj ?X)"))
+        self.assertEqual(len(answer), 401)
+        KB.kb_retract(read.parse_input("fact: (inst obj c0)"))
+        self.assertFalse(KB.kb_ask(read.parse_input("fact: (inst obj ?X)")))
+        self.assertEqual(len(KB.rules), 1)
+
+    def test10(self):
+        # a capped agenda leaves the rest of the work for run_agenda
+        KB = KnowledgeBase([], [])
+        KB.agenda_limit = 1
+        for item in self.data:
+            KB.kb_assert(item)
+        self.assertTrue(len(KB.agenda) > 0)
+        KB.run_agenda()
+        self.assertEqual(set(f.key() for f in KB.facts), set(f.key() for f in self.KB.facts))
+
+    def test11(self):
+        # symbols are interned and statements are immutable tuples
+        f1 = read.parse_input("fact: (motherof ada ?X)")
+        f2 = read.parse_input("fact: (motherof ada ?X)")
+        self.assertTrue(f1.statement.terms[0] is f2.statement.terms[0])
+        self.assertTrue(f1.statement.terms[1].term is Variable('?X'))
+        self.assertEqual(hash(f1), hash(f2))
+        self.assertEqual(f1.statement, ('motherof', 'ada', '?X'))
+        with self.assertRaises(AttributeError):
+            f1.statement.predicate = 'sisters'
+
+    def test12(self):
+        # the loop matcher agrees with the recursive one
+        pattern = Statement(['p', '?x', 'b', '?x', '?y'])
+        for terms, expected in ((['a', 'b', 'a', 'c'], "?X : a, ?Y : c"),
+                                (['a', 'b', 'z', 'c'], None),
+                                (['a', 'q', 'a', 'c'], None),
+                                (['?z', 'b', '?z', 'c'], "?X : ?z, ?Y : c")):
+            fact = Statement(['p'] + terms)
+            old = match_recursive(pattern.terms, fact.terms, Bindings())
+            new = match(pattern, fact)
+            self.assertEqual(bool(new), expected is not None)
+            self.assertEqual(bool(old), expected is not None)
+            if expected:
+                self.assertEqual(str(new), expected)
+                self.assertEqual(new.bindings_dict, old.bindings_dict)
+        self.assertFalse(match(pattern, Statement(['p', 'a', 'b', 'a'])))
+
+    def test13(self):
+        # curried rules share the compiled plan of the rule they come from
+        rule = self.KB._get_rule(read.parse_input(
+            "rule: ((parentof ?x ?y) (sisters ?x ?z)) -> (auntof ?z ?y)"))
+        self.assertEqual(rule.plan.variables, ['?x', '?y', '?z'])
+        curried = [r for r in self.KB.rules if r.plan is rule.plan and r.depth == 1]
+        self.assertEqual(len(curried), len(rule.supports_rules))
+        curried = self.KB._get_rule(read.parse_input(
+            "rule: ((sisters ada ?z)) -> (auntof ?z bing)"))
+        self.assertTrue(curried.plan is rule.plan)
+        self.assertEqual(curried.values, ('ada', 'bing', None))
+        answer = self.KB.kb_ask(read.parse_input("fact: (auntof ?X ?Y)"))
+        self.assertEqual(str(answer[0]), "?X : eva, ?Y : bing")
+
+    def test14(self):
+        # streaming a file in small batches gives the same KB
+        self.assertEqual([str(x) for x in read.iter_tokenize('statements_kb4.txt')],
+                         [str(x) for x in self.data])
+        KB = KnowledgeBase([], [])
+        self.assertEqual(KB.kb_assert_file('statements_kb4.txt', batch_size=2), len(self.data))
+        self.assertEqual(set(f.key() for f in KB.facts), set(f.key() for f in self.KB.facts))
+        self.assertEqual(set(r.key() for r in KB.rules), set(r.key() for r in self.KB.rules))
+
+    def test15(self):
+        # a snapshot restores facts, rules and supports without inference
+        fd, path = tempfile.mkstemp(suffix='.kb')
+        os.close(fd)
+        try:
+            self.KB.save(path)
+            KB = KnowledgeBase.load(path, ReteEngine())
+        finally:
+            os.remove(path)
+        def state(kb):
+            return [(x.key(), x.asserted, sorted((f.key(), r.key()) for f, r in x.supported_by))
+                    for x in list(kb.facts) + list(kb.rules)]
+        self.assertEqual(state(KB), state(self.KB))
+        # curried rules share their parent's plan again, with their own slots
+        def plans(kb):
+            return [(r.key(), repr(r.plan), r.depth, r.values) for r in kb.rules]
+        self.assertEqual(plans(KB), plans(self.KB))
+        self.assertEqual(len(set(id(r.plan) for r in KB.rules)),
+                         len(set(id(r.plan) for r in self.KB.rules)))
+        ask = read.parse_input("fact: (grandmotherof ada ?X)")
+        self.assertEqual(str(KB.kb_ask(ask)), str(self.KB.kb_ask(ask)))
+        retract = read.parse_input("fact: (motherof ada bing)")
+        KB.kb_retract(retract)
+        self.KB.kb_retract(retract)
+        self.assertEqual(state(KB), state(self.KB))
+        KB.kb_assert(retract)
+        self.KB.kb_assert(retract)
+        self.assertEqual(state(KB), state(self.KB))
+
+    def test16(self):
+        # a memory-mapped snapshot answers kb_ask like the KB it was saved from
+        fd, path = tempfile.mkstemp(suffix='.kb')
+        os.close(fd)
+        self.KB.save(path)
+        try:
+            with pickle.loads(pickle.dumps(MappedKnowledgeBase(path))) as KB:
+                self.assertEqual(len(KB.facts), len(self.KB.facts))
+                for text in ("fact: (grandmotherof ada ?X)", "fact: (parentof ?X ?Y)",
+                             "fact: (motherof eva ?X)", "fact: (motherof nobody ?X)",
+                             "fact: (nopredicate ?X)"):
+                    ask = read.parse_input(text)
+                    self.assertEqual(str(KB.kb_ask(ask)).split('Associated')[0],
+                                     str(self.KB.kb_ask(ask)).split('Associated')[0])
+        finally:
+            os.remove(path)
+
+    def test17(self):
+        # retracting a shared base fact removes exactly what it alone supported
+        KB = KnowledgeBase([], [], ReteEngine())
+        KB.kb_assert_many([read.parse_input("rule: ((inst ?x ?y) (isa ?y ?z)) -> (inst ?x ?z)"),
+                           read.parse_input("fact: (isa a b)"), read.parse_input("fact: (isa b c)"),
+                           read.parse_input("fact: (isa a c)")] +
+                          [read.parse_input("fact: (inst o{} a)".format(i)) for i in range(5)])
+        KB.kb_retract(read.parse_input("fact: (isa a b)"))
+        for i in range(5):
+            self.assertIsNone(KB._get_fact(read.parse_input("fact: (inst o{} b)".format(i))))
+            inst = KB._get_fact(read.parse_input("fact: (inst o{} c)".format(i)))
+            self.assertEqual(len(inst.supported_by), 1)
+            self.assertIsInstance(inst.supported_by[0], Justification)
+        for fact_or_rule in list(KB.facts) + list(KB.rules):
+            for fact, rule in fact_or_rule.supported_by:
+                self.assertIn(fact_or_rule, fact.supports_facts + fact.supports_rules)
+                self.assertIs(KB._get_fact(fact), fact)
+                self.assertIs(KB._get_rule(rule), rule)
+            for sup in fact_or_rule.supports_facts + fact_or_rule.supports_rules:
+                self.assertTrue(sup in KB.facts or sup in KB.rules)
+
+    def test18(self):
+        # one kb_retract_many ends where a kb_retract loop does
+        targets = [read.parse_input(text) for text in (
+            "fact: (motherof ada bing)", "fact: (sisters ada eva)",
+            "fact: (parentof bing chen)", "fact: (motherof nobody bing)")]
+        KB = KnowledgeBase([], [])
+        for item in self.data:
+            KB.kb_assert(item)
+        before = len(KB.facts) + len(KB.rules)
+        summary = KB.kb_retract_many(targets)
+        for target in targets:
+            self.KB.kb_retract(target)
+        self.assertEqual(set(f.key() for f in KB.facts), set(f.key() for f in self.KB.facts))
+        self.assertEqual(set(r.key() for r in KB.rules), set(r.key() for r in self.KB.rules))
+        self.assertEqual([f.key() for f in summary['missing']], [targets[3].key()])
+        self.assertEqual([f.key() for f in summary['kept']], [targets[2].key()])
+        self.assertIn(targets[0], summary['facts'])
+        self.assertEqual(len(summary['facts']) + len(summary['rules']),
+                         before - len(KB.facts) - len(KB.rules))
+
+    def test19(self):
+        # a transaction that fails halfway through inference leaves no trace
+        class FailingEngine(InferenceEngine):
+            calls = 0
+            def derive(self, fact, rule):
+                FailingEngine.calls += 1
+                if FailingEngine.calls == 5:
+                    raise RuntimeError("inference failed")
+                return super(FailingEngine, self).derive(fact, rule)
+        KB = KnowledgeBase([], [], FailingEngine())
+        data = read.read_tokenize('statements_kb4.txt')
+        KB.kb_assert_many(data[:6])
+        def state(kb):
+            return sorted((repr(x.key()), x.asserted, len(x.supported_by), len(x.supports_facts),
+                           len(x.supports_rules)) for x in list(kb.facts) + list(kb.rules))
+        before = state(KB)
+        with self.assertRaises(RuntimeError):
+            with KB.transaction():
+                KB.kb_retract(read.parse_input("fact: (sisters ada eva)"))
+                for item in data[6:]:
+                    KB.kb_assert(item)
+        self.assertEqual(state(KB), before)
+        self.assertEqual(len(KB.agenda), 0)
+        KB.kb_assert_many(data[6:])
+        self.assertEqual(set(f.key() for f in KB.facts), set(f.key() for f in self.KB.facts))
+
+    def test20(self):
+        # a fork sees its own changes, its parent doesn't until it commits
+        KB = KnowledgeBase([], [], ReteEngine())
+        data = read.read_tokenize('statements_kb4.txt')
+        KB.kb_assert_many(data[:6])
+        before = set(f.key() for f in KB.facts)
+        fork = KB.fork()
+        fork.kb_assert_many(data[6:])
+        fork.kb_retract(read.parse_input("fact: (sisters ada eva)"))
+        ask = read.parse_input("fact: (auntof ?X ?Y)")
+        self.assertEqual(set(f.key() for f in KB.facts), before)
+        self.assertFalse(KB.kb_ask(ask))
+        self.assertFalse(fork.kb_ask(ask))
+        self.assertTrue(fork.kb_ask(read.parse_input("fact: (grandmotherof ada chen)")))
+        self.assertTrue(len(fork.facts.added) + len(fork.facts.changed) < len(fork.facts))
+        fork.commit()
+        self.KB.kb_retract(read.parse_input("fact: (sisters ada eva)"))
+        self.assertEqual(set(f.key() for f in KB.facts), set(f.key() for f in self.KB.facts))
+        self.assertEqual(set(r.key() for r in KB.rules), set(r.key() for r in self.KB.rules))
+
+    def test21(self):
+        # backward rules answer asks like the materialized rules, storing nothing
+        KB = KnowledgeBase([], [])
+        for item in read.read_tokenize('statements_kb4.txt'):
+            if isinstance(item, Fact):
+                KB.kb_assert(item)
+            else:
+                KB.kb_assert_backward(item)
+        self.assertEqual(len(KB.facts), 6)
+        self.assertEqual(len(KB.rules), 0)
+        for ask in ["fact: (parentof ?X ?Y)", "fact: (auntof ?X ?Y)",
+                    "fact: (grandmotherof ?X ?Y)", "fact: (grandmotherof ada ?Y)"]:
+            expected = self.KB.kb_ask(read.parse_input(ask))
+            answer = KB.kb_ask(read.parse_input(ask))
+            self.assertEqual(sorted(str(b) for b in answer), sorted(str(b) for b in expected))
+        answer = KB.kb_ask(read.parse_input("fact: (auntof eva bing)"))
+        fact = answer.list_of_bindings[0][1][0]
+        self.assertEqual(str(fact.supported_by[0][0].statement), "(sisters ada eva)")
+        curried = fact.supported_by[0][1]
+        self.assertEqual(str(curried.supported_by[0][0].statement), "(parentof ada bing)")
+        self.assertEqual(len(KB.facts), 6)
+
+    def test22(self):
+        # a conjunctive ask joins most selective first and keeps the order given
+        statements = [read.parse_input("fact: " + text) for text in
+                      ("(motherof ?X ?Y)", "(parentof ?Y ?Z)", "(sisters ?X ?W)")]
+        self.assertEqual(self.KB.help_plan([s.statement for s in statements]), [2, 0, 1])
+        answer = self.KB.kb_ask(statements)
+        self.assertEqual(len(answer), 1)
+        self.assertEqual(answer[0].bindings_dict, {'?X': 'ada', '?Y': 'bing', '?Z': 'chen', '?W': 'eva'})
+        self.assertEqual([str(f.statement) for f in answer.list_of_bindings[0][1]],
+                         ["(motherof ada bing)", "(parentof bing chen)", "(sisters ada eva)"])
+        statements.append(read.parse_input("fact: (motherof ?Z ?V)"))
+        self.assertEqual(self.KB.kb_ask(statements), [])
+
+    def test23(self):
+        # ask_iter streams the answers of kb_ask, ask_exists stops at the first
+        ask = read.parse_input("fact: (motherof ?X ?Y)")
+        answers = self.KB.ask_iter(ask)
+        bindings, facts = next(answers)
+        self.assertEqual(str(bindings), "?X : ada, ?Y : bing")
+        self.assertEqual(str(facts[0].statement), "(motherof ada bing)")
+        self.assertEqual([str(b) for b, f in self.KB.ask_iter(ask)],
+                         [str(b) for b in self.KB.kb_ask(ask)])
+        self.assertEqual(self.KB.ask_count(ask), 4)
+        self.assertTrue(self.KB.ask_exists(read.parse_input("fact: (auntof eva ?Y)")))
+        self.assertFalse(self.KB.ask_exists(read.parse_input("fact: (auntof ada ?Y)")))
+        both = [ask, read.parse_input("fact: (sisters ?X ?Z)")]
+        self.assertEqual(self.KB.ask_count(both), 1)
+
+    def test24(self):
+        # cached asks are dropped exactly when a fact they could match changes
+        self.KB.cache.maxsize = 2
+        mothers = read.parse_input("fact: (motherof ?X ?Y)")
+        sisters = read.parse_input("fact: (sisters ada ?Y)")
+        self.assertEqual(len(self.KB.kb_ask(mothers)), 4)
+        self.assertEqual(len(self.KB.kb_ask(sisters)), 1)
+        answer = self.KB.kb_ask(read.parse_input("fact: (motherof ?A ?B)"))
+        self.assertEqual(str(answer[0]), "?A : ada, ?B : bing")
+        self.assertEqual(self.KB.cache_info().hits, 1)
+        self.KB.kb_assert(read.parse_input("fact: (sisters bing zoe)"))
+        self.assertEqual(len(self.KB.cache), 2)
+        self.KB.kb_retract(read.parse_input("fact: (motherof ada bing)"))
+        self.assertEqual(len(self.KB.kb_ask(mothers)), 3)
+        self.assertEqual(len(self.KB.kb_ask(sisters)), 1)
+        self.assertEqual(self.KB.cache_info(), (2, 3, 2, 2))
+
+    def test25(self):
+        # shards matched in worker processes merge back in kb_ask's order
+        ask = read.parse_input("fact: (parentof ?X ?Y)")
+        with ParallelAsker(self.KB, workers=2) as asker:
+            asker.serial_below = 0
+            answers = asker.ask(ask.statement)
+        expected = self.KB.kb_ask(ask).list_of_bindings
+        self.assertEqual([(str(b), f) for b, f in answers], [(str(b), f[0]) for b, f in expected])
+        self.assertTrue(answers[0][1] is self.KB._get_fact(expected[0][1][0]))
+        self.assertEqual(str(self.KB.kb_ask_parallel(ask, workers=2)), str(self.KB.kb_ask(ask)))
+
+    def test26(self):
+        # a batch of asks comes back from the workers in input order
+        asks = [read.parse_input("fact: " + text) for text in
+                ("(motherof ?X ?Y)", "(auntof eva ?Y)", "(sisters bing ?Y)", "(grandmotherof ada ?Y)")]
+        answers = self.KB.ask_batch(asks, workers=2)
+        self.assertEqual([str(answer) for answer in answers], [str(self.KB.kb_ask(ask)) for ask in asks])
+        self.assertEqual(answers[2], [])
+        self.KB.kb_assert(read.parse_input("fact: (sisters bing zoe)"))
+        self.assertEqual(len(self.KB.ask_batch(asks[2:3])[0]), 1)
+
+    def test27(self):
+        # concurrent writes are committed as one batch, reads never see half of it
+        class FailingEngine(InferenceEngine):
+            def derive(self, fact, rule):
+                if fact.statement.predicate == 'likes':
+                    raise RuntimeError("inference failed")
+                return super(FailingEngine, self).derive(fact, rule)
+        data = read.read_tokenize('statements_kb4.txt')
+        ask = read.parse_input("fact: (grandmotherof ?X ?Y)")
+
+        async def scenario(akb):
+            seen = []
+            async def read_while_writing():
+                for _ in range(10):
+                    seen.append((akb.version, len(await akb.kb_ask(ask))))
+                    await asyncio.sleep(0)
+            await asyncio.gather(read_while_writing(), *[akb.kb_assert(item) for item in data])
+            try:
+                await akb.kb_assert(read.parse_input("fact: (likes bing zoe)"))
+            except RuntimeError as error:
+                frames = traceback.extract_tb(error.__traceback__)
+            self.assertIn('derive', [frame.name for frame in frames])
+            # only the failing write of a batch gets the error
+            failed, added = await asyncio.gather(
+                akb.kb_assert(read.parse_input("fact: (likes ada zoe)")),
+                akb.kb_assert(read.parse_input("fact: (motherof zoe eve)")), return_exceptions=True)
+            self.assertIsInstance(failed, RuntimeError)
+            self.assertIsNone(added)
+            await akb.kb_retract(read.parse_input("fact: (motherof bing chen)"))
+            await akb.close()
+            return seen
+
+        akb = AsyncKnowledgeBase(KnowledgeBase([], [], FailingEngine()))
+        akb.kb.kb_assert(read.parse_input("rule: ((likes ?x ?y)) -> (knows ?x ?y)"))
+        seen = asyncio.run(scenario(akb))
+        self.assertEqual(akb.version, 3)
+        self.assertTrue(set(seen) <= set([(0, 0), (1, 2)]))
+        self.assertFalse(akb.kb.kb_ask(read.parse_input("fact: (likes ?x zoe)")))
+        self.assertTrue(akb.kb.kb_ask(read.parse_input("fact: (motherof zoe eve)")))
+        self.assertEqual(len(akb.kb.kb_ask(ask)), 1)
+
+    def test28(self):
+        # readers see the facts as of the last completed write, never half a cascade
+        ask = read.parse_input("fact: (grandmotherof ?X ?Y)")
+        mother = read.parse_input("fact: (motherof bing chen)")
+        grandmother = read.parse_input("fact: (grandmotherof ada chen)")
+        before = self.KB.reader()
+        self.KB.kb_retract(mother)
+        with self.KB.reader() as after:
+            self.assertEqual(len(before.kb_ask(ask)), 2)
+            self.assertEqual(len(after.kb_ask(ask)), 1)
+            with self.KB.transaction():
+                self.KB.kb_assert(mother)
+                with self.KB.reader() as inside:
+                    self.assertFalse(inside.ask_exists(grandmother))
+            self.assertFalse(after.ask_exists(mother))
+            self.assertEqual(len(self.KB.reader().kb_ask(ask)), 2)
+        before.release()
+
+        consistent = []
+        def read_while_writing():
+            for _ in range(200):
+                with self.KB.reader() as view:
+                    consistent.append(view.ask_exists(mother) == view.ask_exists(grandmother))
+        readers = [threading.Thread(target=read_while_writing) for _ in range(4)]
+        for thread in readers:
+            thread.start()
+        while any(thread.is_alive() for thread in readers):
+            self.KB.kb_retract(mother)
+            self.KB.kb_assert(mother)
+        for thread in readers:
+            thread.join()
+        self.assertTrue(all(consistent))
+
+    def test29(self):
+        # messages go through logging and are only formatted when a handler takes them
+        ask = read.parse_input("fact: (grandmotherof ada ?X)")
+        with self.assertLogs('student_code', level='DEBUG') as logs:
+            self.KB.kb_ask(ask)
+            self.KB.kb_assert(read.parse_input("fact: (motherof chen dan)"))
+        self.assertIn("INFO:student_code:Asking {}".format(ask), logs.output)
+        self.assertIn("DEBUG:student_code:New fact (grandmotherof bing dan)", logs.output)
+
+        class Unprintable(Fact):
+            def __repr__(self):
+                raise AssertionError("formatted a discarded message")
+        logger = logging.getLogger('student_code')
+        level = logger.level
+        logger.setLevel(logging.WARNING)
+        try:
+            fact = Unprintable(read.parse_input("fact: (motherof dan eve)").statement)
+            self.KB.kb_assert(fact)
+            self.KB.kb_ask(fact)
+            self.KB.kb_retract(fact)
+        finally:
+            logger.setLevel(level)
+
+    def test30(self):
+        # a fork runs its parent's pending items on copies, its commit replaces them
+        KB = KnowledgeBase([], [])
+        KB.agenda_limit = 1
+        for item in read.read_tokenize('statements_kb4.txt'):
+            KB.kb_assert(item)
+        pending = len(KB.agenda)
+        self.assertTrue(pending)
+        supports = [len(f.supported_by) for f in KB.facts]
+        fork = KB.fork()
+        fork.run_agenda()
+        self.assertEqual(len(KB.agenda), pending)
+        self.assertEqual([len(f.supported_by) for f in KB.facts], supports)
+        fork.commit()
+        self.assertEqual(len(KB.agenda), 0)
+        self.assertEqual(KB.run_agenda(), 0)
+        self.assertEqual(set(f.key() for f in KB.facts), set(f.key() for f in self.KB.facts))
+        for kb_fact in self.KB.facts:
+            fact = KB._get_fact(kb_fact)
+            self.assertEqual(sorted((f.key(), r.key()) for f, r in fact.supported_by),
+                             sorted((f.key(), r.key()) for f, r in kb_fact.supported_by))
+            self.assertTrue(all(KB._get_fact(f) is f and KB._get_rule(r) is r
+                                for f, r in fact.supported_by))
+
+    def test31(self):
+        # with agenda_limit, readers only see a cascade once the agenda has run empty
+        KB = KnowledgeBase([], [])
+        KB.reader().release()
+        KB.agenda_limit = 1
+        grandmother = read.parse_input("fact: (grandmotherof ada chen)")
+        for item in read.read_tokenize('statements_kb4.txt'):
+            KB.kb_assert(item)
+        self.assertTrue(len(KB.agenda))
+        with KB.reader() as view:
+            published = len(view.facts)
+        self.assertLess(published, len(KB.facts))
+        while KB.agenda:
+            with KB.reader() as view:
+                self.assertEqual(len(view.facts), published)
+            KB.run_agenda(1)
+        with KB.reader() as view:
+            self.assertTrue(view.ask_exists(grandmother))
+            self.assertEqual(len(view.facts), len(KB.facts))
+
+    def test32(self):
+        # a retraction drops the derivations it leaves waiting on the agenda
+        for retract in ('kb_retract', 'kb_retract_many'):
+            KB = KnowledgeBase([], [])
+            KB.agenda_limit = 1
+            KB.kb_assert(read.parse_input("rule: ((p ?x)) -> (q ?x)"))
+            KB.kb_assert(read.parse_input("fact: (p a)"))
+            self.assertEqual(len(KB.agenda), 1)
+            p = read.parse_input("fact: (p a)")
+            getattr(KB, retract)(p if retract == 'kb_retract' else [p])
+            self.assertEqual(len(KB.agenda), 0)
+            KB.run_agenda()
+            self.assertFalse(KB.kb_ask(read.parse_input("fact: (q ?x)")))
+
+    def test33(self):
+        # a batch retraction removes a target whose support it removes, like a loop
+        for order in ((0, 1), (1, 0)):
+            KB = KnowledgeBase([], [])
+            KB.kb_assert(read.parse_input("rule: ((p ?x)) -> (q ?x)"))
+            facts = [read.parse_input("fact: (p a)"), read.parse_input("fact: (q a)")]
+            for fact in facts:
+                KB.kb_assert(fact)
+            result = KB.kb_retract_many([facts[i] for i in order])
+            self.assertFalse(KB.facts)
+            self.assertEqual(sorted(str(f.statement) for f in result['facts']), ['(p a)', '(q a)'])
+            self.assertEqual(result['kept'], [])
+        loop = KnowledgeBase([], [])
+        for item in self.data:
+            loop.kb_assert(item)
+        targets = [read.parse_input("fact: (motherof ada bing)"), read.parse_input("fact: (grandmotherof ada chen)")]
+        for fact in targets:
+            loop.kb_retract(fact)
+        self.KB.kb_retract_many(reversed(targets))
+        self.assertEqual(set(f.key() for f in self.KB.facts), set(f.key() for f in loop.facts))
+        self.assertEqual(set(r.key() for r in self.KB.rules), set(r.key() for r in loop.rules))
+
+    def test34(self):
+        # writes end as if applied one at a time, a failed commit fails its batch
+        p, q = read.parse_input("fact: (p a)"), read.parse_input("fact: (q a)")
+        r = read.parse_input("fact: (r a)")
+
+        async def scenario(akb):
+            await asyncio.gather(*[akb.kb_assert(item) for item in
+                                   (read.parse_input("rule: ((p ?x)) -> (q ?x)"), p, q)])
+            await asyncio.gather(akb.kb_retract(q), akb.kb_retract(p))
+            fork = akb.kb.fork
+            def failing_fork():
+                forked = fork()
+                commit = forked.commit
+                def failing_commit():
+                    raise RuntimeError("commit failed")
+                forked.commit = failing_commit
+                return forked
+            akb.kb.fork = failing_fork
+            with self.assertRaises(RuntimeError):
+                await akb.kb_assert(r)
+            del akb.kb.fork
+            await akb.kb_assert(p)
+            await akb.close()
+
+        akb = AsyncKnowledgeBase()
+        asyncio.run(scenario(akb))
+        self.assertEqual(sorted(str(f.statement) for f in akb.kb.facts), ['(p a)', '(q a)'])
+        self.assertFalse(akb.kb.kb_ask(r))
+        self.assertEqual(akb.version, 3)
+
 
 def pprint_justification(answer):
     """Pretty prints (hence pprint) justifications for the answer.
@@ -0,0 +1,343 @@
+import mmap
+import sys
+
+from logical_classes import *
+from util import is_var
+from student_code import KnowledgeBase
+from cache import QueryCache
+import snapshot
+
+
+class MappedFactStore(object):
+    """Read-only fact store over the columns and index of a snapshot file
+        (see snapshot.py), read in place from a memory map. Nothing is
+        decoded up front: symbols are looked up by binary search over the
+        sorted symbol table and a Fact is only built for the candidates a
+        query touches, so every process mapping the same file shares one
+        page-cached copy of it.
+
+    Attributes:
+        sections (dictof memoryview): snapshot sections, see
+            snapshot.read_sections
+    """
+    def __init__(self, sections):
+        """Constructor for MappedFactStore
+
+        Args:
+            sections (dictof memoryview): sections of a snapshot with index
+        """
+        super(MappedFactStore, self).__init__()
+        self.sections = sections
+        # decoded symbols, ids of looked up symbols and, per (predicate,
+        # arity, position), whether some fact holds a variable there
+        self._symbols = {}
+        self._ids = {}
+        self._has_var = {}
+        self._distinct = {}
+
+    def __len__(self):
+        """Define behavior of len, the number of facts
+        """
+        return len(self.sections['FPRED'])
+
+    def __iter__(self):
+        """Iterate over the facts in KB order, building each one
+        """
+        return (self.fact(i) for i in range(len(self)))
+
+    def symbol(self, symbol_id):
+        """Decode a symbol, caching it
+
+        Args:
+            symbol_id (int): id of the symbol
+
+        Returns:
+            str: the interned symbol
+        """
+        symbol = self._symbols.get(symbol_id)
+        if symbol is None:
+            offsets = self.sections['SYMOFF']
+            text = self.sections['SYMTXT'][offsets[symbol_id]:offsets[symbol_id + 1]]
+            symbol = self._symbols[symbol_id] = sys.intern(bytes(text).decode('utf-8'))
+        return symbol
+
+    def symbol_id(self, symbol):
+        """Look a symbol up by binary search over SYMSORT, caching it
+
+        Args:
+            symbol (str): symbol to look up
+
+        Returns:
+            int|None: its id, None if the file doesn't hold it
+        """
+        try:
+            return self._ids[symbol]
+        except KeyError:
+            symbol_id = self._ids[symbol] = self._search_symbol(symbol)
+            return symbol_id
+
+    def _search_symbol(self, symbol):
+        wanted = symbol.encode('utf-8')
+        order, offsets, text = self.sections['SYMSORT'], self.sections['SYMOFF'], self.sections['SYMTXT']
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = order[mid]
+            if bytes(text[offsets[i]:offsets[i + 1]]) < wanted:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(order):
+            i = order[lo]
+            if bytes(text[offsets[i]:offsets[i + 1]]) == wanted:
+                return i
+        return None
+
+    def _search(self, key):
+        # first index key not below key, by binary search over IKEY
+        keys = self.sections['IKEY']
+        lo, hi = 0, len(keys) // 4
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if tuple(keys[4 * mid:4 * mid + 4]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def postings(self, key):
+        """Get the fact numbers of an index key by binary search over IKEY
+
+        Args:
+            key ((int, int, int, int)): predicate, arity, position and term
+                ids, see snapshot.py
+
+        Returns:
+            memoryview|None: fact numbers in KB order, None if no fact has it
+        """
+        keys = self.sections['IKEY']
+        i = self._search(key)
+        if i < len(keys) // 4 and tuple(keys[4 * i:4 * i + 4]) == key:
+            offsets = self.sections['IOFF']
+            return self.sections['IPOST'][offsets[i]:offsets[i + 1]]
+        return None
+
+    def statement(self, number):
+        """Build the statement of the fact stored at a position of the file
+
+        Args:
+            number (int): position of the fact in KB order
+
+        Returns:
+            Statement
+        """
+        offsets, terms = self.sections['FTOFF'], self.sections['FTERM']
+        return Statement.from_tokens(
+            [self.symbol(self.sections['FPRED'][number])] +
+            [self.symbol(t) for t in terms[offsets[number]:offsets[number + 1]]])
+
+    def fact(self, number):
+        """Build the Fact stored at a position of the file
+
+        Args:
+            number (int): position of the fact in KB order
+
+        Returns:
+            Fact: the fact, without support links
+        """
+        fact = Fact(self.statement(number))
+        fact.asserted = bool(self.sections['FASSERT'][number])
+        return fact
+
+    def _holds_var(self, predicate, arity, position):
+        # whether some fact holds a variable at the position, cached
+        has_var = self._has_var.get((predicate, arity, position))
+        if has_var is None:
+            has_var = self._has_var[(predicate, arity, position)] = \
+                self.postings((predicate, arity, position, -2)) is not None
+        return has_var
+
+    def estimate(self, statement, bound=()):
+        """Estimate how many facts match a statement, see
+            FactStore.estimate. The distinct elements at a position are the
+            index keys between (predicate, arity, position) and the next
+            position.
+
+        Args:
+            statement (Statement): statement (pattern) to estimate
+            bound (set of str): variables of the statement that will have
+                values when it is looked up
+
+        Returns:
+            float: expected number of matching facts
+        """
+        key = statement.key()
+        predicate, arity = self.symbol_id(key[0]), len(key) - 1
+        every = None if predicate is None else self.postings((predicate, arity, -1, -1))
+        if every is None:
+            return 0.0
+        estimate = float(len(every))
+        for position, element in enumerate(key[1:]):
+            if self._holds_var(predicate, arity, position):
+                continue
+            if not is_var(element):
+                term = self.symbol_id(element)
+                bucket = None if term is None else self.postings((predicate, arity, position, term))
+                estimate *= (0 if bucket is None else len(bucket)) / float(len(every))
+            elif element in bound:
+                distinct = self._distinct.get((predicate, arity, position))
+                if distinct is None:
+                    distinct = self._distinct[(predicate, arity, position)] = \
+                        self._search((predicate, arity, position + 1, -2)) - \
+                        self._search((predicate, arity, position, 0))
+                estimate /= distinct
+        return estimate
+
+    def candidate_numbers(self, statement):
+        """Get the positions of the facts that may match the given
+            statement, see candidates
+
+        Args:
+            statement (Statement): statement (pattern) to look up
+
+        Returns:
+            memoryview|list: fact numbers, ascending (KB order)
+        """
+        key = statement.key()
+        predicate, arity = self.symbol_id(key[0]), len(key) - 1
+        if predicate is None:
+            return []
+        best = self.postings((predicate, arity, -1, -1))
+        if best is None:
+            return []
+        for position, element in enumerate(key[1:]):
+            if is_var(element):
+                continue
+            if self._holds_var(predicate, arity, position):
+                continue
+            term = self.symbol_id(element)
+            bucket = None if term is None else self.postings((predicate, arity, position, term))
+            if bucket is None:
+                return []
+            if len(bucket) < len(best):
+                best = bucket
+        return best
+
+    def candidates(self, statement):
+        """Get the facts that may match the given statement, like
+            FactStore.candidates: same predicate and arity, holding the
+            statement's constants, using the most selective position and
+            skipping positions where some fact holds a variable
+
+        Args:
+            statement (Statement): statement (pattern) to look up
+
+        Returns:
+            listof Fact: candidate facts, in KB order
+        """
+        return [self.fact(number) for number in self.candidate_numbers(statement)]
+
+
+class MappedKnowledgeBase(object):
+    """Read-only KnowledgeBase served straight from a snapshot file written
+        by KnowledgeBase.save, for query workers. Opening one maps the file
+        and reads its section table, nothing else. kb_ask is the one of
+        KnowledgeBase, run against a MappedFactStore; the facts it returns as
+        support carry no support links. Pickling sends the path, so a worker
+        process maps the file itself instead of receiving a copy of the KB.
+
+    Attributes:
+        path (str): snapshot file
+        facts (MappedFactStore): the facts of the snapshot
+        backward_rules (listof Rule): the backward rules of the snapshot,
+            decoded when it is opened, see KnowledgeBase.kb_assert_backward
+        cache (QueryCache): kb_ask results, off until its maxsize is set
+    """
+    def __init__(self, path):
+        """Constructor for MappedKnowledgeBase, mapping the file
+
+        Args:
+            path (str): snapshot file written by KnowledgeBase.save
+
+        Raises:
+            ValueError: if the file is not a snapshot or has no index
+        """
+        super(MappedKnowledgeBase, self).__init__()
+        self.path = path
+        with open(path, 'rb') as file:
+            self._buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            sections = snapshot.read_sections(self._buffer)
+        except ValueError:
+            self._buffer.close()
+            raise
+        if 'IKEY' not in sections:
+            for section in sections.values():
+                section.release()
+            self._buffer.close()
+            raise ValueError("snapshot has no fact index, save it again")
+        self.facts = MappedFactStore(sections)
+        self.backward_rules = [self._rule(i) for i, backward in enumerate(sections.get('RBACK', b''))
+                               if backward]
+        self.cache = QueryCache()
+        # never changes, see KnowledgeBase.kb_ask_parallel
+        self._version = 0
+        self._asker = None
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'MappedKnowledgeBase({!r})'.format(self.path)
+
+    def __reduce__(self):
+        """Pickle as the path, the receiver maps the file again
+        """
+        return (MappedKnowledgeBase, (self.path,))
+
+    def __enter__(self):
+        """Define behavior of with, the view itself
+        """
+        return self
+
+    def __exit__(self, *exc_info):
+        """Unmap the file at the end of the with block
+        """
+        self.close()
+
+    kb_ask = KnowledgeBase.kb_ask
+    kb_ask_all = KnowledgeBase.kb_ask_all
+    cache_info = KnowledgeBase.cache_info
+    kb_ask_parallel = KnowledgeBase.kb_ask_parallel
+    ask_batch = KnowledgeBase.ask_batch
+    help_asker = KnowledgeBase.help_asker
+    help_collect = KnowledgeBase.help_collect
+    ask_iter = KnowledgeBase.ask_iter
+    ask_exists = KnowledgeBase.ask_exists
+    ask_count = KnowledgeBase.ask_count
+    help_join = KnowledgeBase.help_join
+    help_plan = KnowledgeBase.help_plan
+    help_ask = KnowledgeBase.help_ask
+    help_ask_backward = KnowledgeBase.help_ask_backward
+
+    def _rule(self, number):
+        # decode one rule's statements, see snapshot.py
+        sections, symbol = self.facts.sections, self.facts.symbol
+        offsets, terms = sections['STOFF'], sections['STERM']
+        statements = [Statement.from_tokens([symbol(sections['SPRED'][i])] +
+                                            [symbol(t) for t in terms[offsets[i]:offsets[i + 1]]])
+                      for i in range(sections['RSOFF'][number], sections['RSOFF'][number + 1])]
+        rule = Rule([statements[:-1], statements[-1]])
+        rule.asserted = True
+        return rule
+
+    def close(self):
+        """Stop the kb_ask_parallel workers, release the sections and unmap
+            the file
+        """
+        if self._asker is not None:
+            self._asker.close()
+            self._asker = None
+        for section in self.facts.sections.values():
+            section.release()
+        self.facts.sections = {}
+        self._buffer.close()
@@ -0,0 +1,307 @@
+"""Multi-version reads of a KnowledgeBase for reader threads.
+
+KnowledgeBase.reader() pins the last published version of the facts and
+returns a ReadView answering kb_ask and the other asks from that version
+only, while a writer keeps asserting and retracting. The KB publishes a
+new version when a write operation (kb_assert, kb_assert_many, kb_retract,
+kb_retract_many, an outermost transaction, a fork commit) is complete and
+the agenda has run empty, so a reader never sees half of an inference or
+retraction cascade, even when agenda_limit stops inference early.
+
+The KB records every fact it stores or removes in a VersionedFactStore:
+each fact key has a chain of versions, each with the version it was stored
+in (born) and the one it was removed in (died). A reader pinned at version v
+sees the versions with born <= v < died. Removed versions are dropped once
+no reader is pinned before they died. Readers take no lock while they
+query, only to pin and release a version; the store is written by one
+writer thread at a time.
+"""
+import threading
+from collections import deque
+
+from logical_classes import *
+from store import KeyIndex
+from cache import QueryCache
+from student_code import KnowledgeBase
+
+
+class Version(object):
+    """One version of a fact
+
+    Attributes:
+        fact (Fact): the fact
+        born (int): version it was stored in
+        died (int|None): version it was removed in, None while it is stored
+    """
+    __slots__ = ('fact', 'born', 'died')
+
+    def __init__(self, fact, born):
+        """Constructor for a Version of a stored fact
+
+        Args:
+            fact (Fact): the fact
+            born (int): version it is stored in
+        """
+        self.fact = fact
+        self.born = born
+        self.died = None
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'Version({!r}, {}, {})'.format(self.fact, self.born, self.died)
+
+
+class VersionedFactStore(object):
+    """Versions of the facts of a KB, see the module docstring
+
+    Attributes:
+        clock (int): last published version
+        chains (dictof listof Version): versions of each fact key, oldest
+            first
+        index (KeyIndex): index of the keys that have versions, in the
+            order the KB first stored them
+    """
+    def __init__(self, facts=[]):
+        """Constructor for VersionedFactStore
+
+        Args:
+            facts (iterable of Fact): facts of version 0
+        """
+        super(VersionedFactStore, self).__init__()
+        self.clock = 0
+        self.chains = {}
+        self.index = KeyIndex()
+        # (died, key) of removed versions, oldest first, see compact
+        self._dead = deque()
+        # number of readers pinned at each version
+        self._pins = {}
+        self._lock = threading.Lock()
+        for fact in facts:
+            self.add(fact, 0)
+
+    def add(self, fact, born=None):
+        """Record a fact the KB stored
+
+        Args:
+            fact (Fact): the fact
+            born (int|None): its version, None for the one being written
+        """
+        key = fact.key()
+        chain = self.chains.get(key)
+        if chain is None:
+            chain = self.chains[key] = []
+            self.index.add(key, None)
+        # else stored again while older versions are kept: the key stays
+        # where it is, unindexing it would hide it from readers meanwhile
+        chain.append(Version(fact, self.clock + 1 if born is None else born))
+
+    def remove(self, fact):
+        """Record that the KB removed a fact
+
+        Args:
+            fact (Fact): the fact
+        """
+        key = fact.key()
+        self.chains[key][-1].died = self.clock + 1
+        self._dead.append((self.clock + 1, key))
+
+    def publish(self):
+        """Make what was written since the last call the latest version,
+            then drop the versions no reader can see any more
+        """
+        self.clock += 1
+        self.compact()
+
+    def pin(self):
+        """Pin the latest version for a reader, see release
+
+        Returns:
+            int: the version
+        """
+        with self._lock:
+            version = self.clock
+            self._pins[version] = self._pins.get(version, 0) + 1
+        return version
+
+    def release(self, version):
+        """Unpin a version a reader pinned
+
+        Args:
+            version (int): the version
+        """
+        with self._lock:
+            self._pins[version] -= 1
+            if not self._pins[version]:
+                del self._pins[version]
+
+    def compact(self):
+        """Drop the removed versions that died at or before the oldest
+            pinned version (or the latest, if no reader is pinned)
+        """
+        with self._lock:
+            oldest = min(self._pins) if self._pins else self.clock
+        while self._dead and self._dead[0][0] <= oldest:
+            _, key = self._dead.popleft()
+            chain = self.chains.get(key)
+            if chain is None:
+                continue
+            # readers may be walking the old list, make a new one
+            kept = [version for version in chain if version.died is None or version.died > oldest]
+            if kept:
+                self.chains[key] = kept
+            else:
+                del self.chains[key]
+                self.index.remove(key)
+
+    def visible(self, key, version):
+        """Get the fact of a key as of a version
+
+        Args:
+            key (Statement): key of the fact
+            version (int): pinned version
+
+        Returns:
+            Fact|None: the fact, None if it wasn't stored at that version
+        """
+        for entry in reversed(self.chains.get(key, ())):
+            if entry.born <= version and (entry.died is None or entry.died > version):
+                return entry.fact
+        return None
+
+    def keys(self, statement):
+        """Get the keys of the facts that may match a statement, as of any
+            version, see FactStore.candidates
+
+        Args:
+            statement (Statement): statement (pattern) to look up
+
+        Returns:
+            listof Statement: candidate keys, in store order
+        """
+        return list(self.index.select(statement.key()))
+
+
+class VersionedFacts(object):
+    """The facts of a VersionedFactStore as of one version, used as the
+        facts of a ReadView
+
+    Attributes:
+        store (VersionedFactStore): the versions
+        version (int): the pinned version
+    """
+    def __init__(self, store, version):
+        """Constructor for VersionedFacts
+
+        Args:
+            store (VersionedFactStore): the versions
+            version (int): the pinned version
+        """
+        super(VersionedFacts, self).__init__()
+        self.store = store
+        self.version = version
+
+    def __iter__(self):
+        """Iterate over the facts of the version, in store order
+        """
+        facts = (self.store.visible(key, self.version) for key in list(self.store.chains))
+        return (fact for fact in facts if fact is not None)
+
+    def __len__(self):
+        """Define behavior of len, the number of facts of the version. O(n)
+        """
+        return sum(1 for _ in self)
+
+    def get(self, fact):
+        """Get the fact of the version equal to the given one
+
+        Args:
+            fact (Fact): fact we're searching for
+
+        Returns:
+            Fact|None: the fact, None if the version has none
+        """
+        return self.store.visible(fact.key(), self.version)
+
+    def candidates(self, statement):
+        """Get the facts of the version that may match a statement, see
+            FactStore.candidates
+
+        Args:
+            statement (Statement): statement (pattern) to look up
+
+        Returns:
+            listof Fact: candidate facts, in store order
+        """
+        facts = (self.store.visible(key, self.version) for key in self.store.keys(statement))
+        return [fact for fact in facts if fact is not None]
+
+    def estimate(self, statement, bound=()):
+        """Estimate how many facts match a statement, see FactStore.estimate.
+            Counts the keys of every version.
+        """
+        return self.store.index.estimate(statement.key(), bound)
+
+
+class ReadView(object):
+    """Read-only view of a KB as of a pinned version, made by
+        KnowledgeBase.reader. It answers kb_ask, kb_ask_all, ask_iter,
+        ask_exists and ask_count like the KB did when the version was
+        published, whatever the writer does meanwhile. Release it (or use a
+        with block) when done, so the versions it pins can be dropped.
+
+    Answers hold the KB's own Fact objects, whose support links are the
+    KB's current ones, not as of the version.
+
+    Attributes:
+        kb (KnowledgeBase): the KB
+        version (int): the pinned version
+        facts (VersionedFacts): the facts of the version
+        backward_rules (OrderedStore): the KB's backward rules
+    """
+    def __init__(self, kb, version):
+        """Constructor for ReadView
+
+        Args:
+            kb (KnowledgeBase): the KB
+            version (int): version pinned for this view
+        """
+        super(ReadView, self).__init__()
+        self.kb = kb
+        self.version = version
+        self.facts = VersionedFacts(kb.versions, version)
+        self.backward_rules = kb.backward_rules
+        self.cache = QueryCache()
+        self._released = False
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'ReadView(version={})'.format(self.version)
+
+    def __enter__(self):
+        """Define behavior of with, the view itself
+        """
+        return self
+
+    def __exit__(self, *exc_info):
+        """Release the view at the end of the with block
+        """
+        self.release()
+
+    def release(self):
+        """Unpin the version of the view
+        """
+        if not self._released:
+            self._released = True
+            self.kb.versions.release(self.version)
+
+    kb_ask = KnowledgeBase.kb_ask
+    kb_ask_all = KnowledgeBase.kb_ask_all
+    ask_iter = KnowledgeBase.ask_iter
+    ask_exists = KnowledgeBase.ask_exists
+    ask_count = KnowledgeBase.ask_count
+    help_join = KnowledgeBase.help_join
+    help_plan = KnowledgeBase.help_plan
+    help_ask = KnowledgeBase.help_ask
+    help_ask_backward = KnowledgeBase.help_ask_backward
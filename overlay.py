@@ -0,0 +1,284 @@
+from logical_classes import *
+from store import OrderedStore, FactStore
+from student_code import KnowledgeBase
+
+
+def copy_node(fact_rule):
+    """Copy a fact or rule for a fork to change: same statements, compiled
+        plan and flags, copies of the supported_by and supports lists (whose
+        entries are shared)
+
+    Args:
+        fact_rule (Fact|Rule): fact or rule to copy
+
+    Returns:
+        Fact|Rule: the copy
+    """
+    if isinstance(fact_rule, Fact):
+        copy = Fact(fact_rule.statement)
+    else:
+        copy = Rule([fact_rule.lhs, fact_rule.rhs])
+        copy.plan, copy.depth, copy.values = fact_rule.plan, fact_rule.depth, fact_rule.values
+    copy.asserted = fact_rule.asserted
+    copy.supported_by = list(fact_rule.supported_by)
+    copy.supports_facts = list(fact_rule.supports_facts)
+    copy.supports_rules = list(fact_rule.supports_rules)
+    return copy
+
+
+class OverlayStore(object):
+    """Store of a fork: the items of a base store, which is never changed,
+        overlaid with the fork's changes. Items are looked up in the fork's
+        own items first, so lookups stay O(1); iterating yields the base
+        items in their order (each replaced by the fork's copy, if any) then
+        the items only the fork has.
+
+    Attributes:
+        base (OrderedStore|OverlayStore): store of the parent KB
+        added (OrderedStore): items the base doesn't hold, in insertion order
+        changed (dictof Fact|Rule): fork's versions of base items, by key
+        removed (dictof Fact|Rule): base items the fork removed, by key
+    """
+    store_class = OrderedStore
+
+    def __init__(self, base):
+        """Constructor for an OverlayStore with no changes
+
+        Args:
+            base (OrderedStore|OverlayStore): store of the parent KB
+        """
+        super(OverlayStore, self).__init__()
+        self.base = base
+        self.added = self.store_class()
+        self.changed = {}
+        self.removed = {}
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return '{}({!r})'.format(type(self).__name__, list(self))
+
+    def __len__(self):
+        """Define behavior of len, the number of items in the fork
+        """
+        return len(self.base) - len(self.removed) + len(self.added)
+
+    def __iter__(self):
+        """Iterate over the items of the fork, see OverlayStore, without
+            copying. Like OrderedStore, the fork must not change during the
+            iteration. Walks the whole base: O(size of the KB)
+        """
+        for item in self.base:
+            key = item.key()
+            if key not in self.removed:
+                yield self.changed.get(key, item)
+        for item in self.added:
+            yield item
+
+    def __contains__(self, item):
+        """Define behavior of `in`, O(1) lookup by key
+        """
+        return self.get(item) is not None
+
+    def __getitem__(self, index):
+        """Positional access, see OrderedStore.__getitem__
+        """
+        return list(self)[index]
+
+    def get(self, item):
+        """Get the fork's item equal to the given one
+
+        Args:
+            item (Fact|Rule): fact or rule we're searching for
+
+        Returns:
+            Fact|Rule|None: the item, None if the fork has none
+        """
+        key = item.key()
+        found = self.changed.get(key) or self.added.get(item)
+        if found is not None or key in self.removed:
+            return found
+        return self.base.get(item)
+
+    def own(self, item):
+        """Get the fork's own version of an item, copying the base's the
+            first time
+
+        Args:
+            item (Fact|Rule): fact or rule of the fork
+
+        Returns:
+            Fact|Rule: the version the fork may change, the item itself if
+                the fork doesn't hold it
+        """
+        key = item.key()
+        found = self.changed.get(key) or self.added.get(item)
+        if found is not None or key in self.removed:
+            return found or item
+        found = self.base.get(item)
+        if found is None:
+            return item
+        copy = self.changed[key] = copy_node(found)
+        return copy
+
+    def append(self, item):
+        """Add an item to the fork, see OrderedStore.append
+
+        Args:
+            item (Fact|Rule): fact or rule to add
+        """
+        key = item.key()
+        if key in self.removed:
+            # back in after being removed: it replaces the base item
+            del self.removed[key]
+            self.changed[key] = item
+        elif self.base.get(item) is None:
+            self.added.append(item)
+
+    def remove(self, item):
+        """Remove the fork's item equal to the given one
+
+        Args:
+            item (Fact|Rule): fact or rule to remove
+
+        Raises:
+            ValueError: if the fork has no such item, like list.remove
+        """
+        key = item.key()
+        if self.added.get(item) is not None:
+            self.added.remove(item)
+            return
+        found = self.base.get(item)
+        if found is None or key in self.removed:
+            raise ValueError("{!r} not in store".format(item))
+        self.changed.pop(key, None)
+        self.removed[key] = found
+
+
+class OverlayFactStore(OverlayStore):
+    """OverlayStore of Facts, answering candidates from the base index and
+        an index of the facts only the fork has
+
+    Attributes:
+        added (FactStore): facts the base doesn't hold, indexed
+    """
+    store_class = FactStore
+
+    def candidates(self, statement):
+        """Get the fork's facts that may match the given statement, see
+            FactStore.candidates
+
+        Args:
+            statement (Statement): statement (pattern) to look up
+
+        Returns:
+            listof Fact: candidate facts, base ones first
+        """
+        candidates = []
+        for fact in self.base.candidates(statement):
+            key = fact.key()
+            if key not in self.removed:
+                candidates.append(self.changed.get(key, fact))
+        candidates.extend(self.added.candidates(statement))
+        return candidates
+
+    def estimate(self, statement, bound=()):
+        """Estimate how many of the fork's facts match a statement, see
+            FactStore.estimate. The facts the fork removed still count.
+        """
+        return self.base.estimate(statement, bound) + self.added.estimate(statement, bound)
+
+
+class ForkedKnowledgeBase(KnowledgeBase):
+    """Copy-on-write fork of a KnowledgeBase, made by KnowledgeBase.fork.
+        Its stores overlay the parent's and its engine is the parent
+        engine's fork (InferenceEngine.fork), so asserting and retracting in
+        the fork leave the parent untouched. A fact or rule of the parent is
+        copied into the fork the first time the fork changes its supports.
+
+    Lookups and index candidates cost what they cost in the parent. Only
+    iterating a store walks all of the parent's, which the default engine
+    does over the rules for each new fact (InferenceEngine.rules_for), so a
+    fork costs in proportion to what it changes with the ReteEngine only.
+
+    Attributes:
+        parent (KnowledgeBase): the forked KB
+    """
+    def __init__(self, parent):
+        """Constructor for a fork with no changes
+
+        Args:
+            parent (KnowledgeBase): KB to fork
+        """
+        super(ForkedKnowledgeBase, self).__init__([], [], parent.ie.fork())
+        self.parent = parent
+        self.facts = OverlayFactStore(parent.facts)
+        self.rules = OverlayStore(parent.rules)
+        self.backward_rules = OverlayStore(parent.backward_rules)
+        # the parent's pending items, copied: the fork stores and links what
+        # it takes off its agenda, which must not change the parent's
+        self.agenda = parent.agenda.copy(copy_node)
+        self.agenda_limit = parent.agenda_limit
+
+    def _own(self, fact_rule):
+        """INTERNAL USE ONLY
+        See KnowledgeBase._own, the fork's copy of a parent fact or rule
+        """
+        if isinstance(fact_rule, Fact):
+            owned = self.facts.own(fact_rule)
+            if owned is not fact_rule:
+                # cached answers may hold the parent's fact
+                self.cache.invalidate(owned.statement)
+            return owned
+        return self.rules.own(fact_rule)
+
+    def commit(self):
+        """Apply the fork's changes to the parent, through the parent's own
+            store methods so its engine, index and any open transaction see
+            them. The fork must not be used afterwards.
+        """
+        parent = self.parent
+        stores = ((self.facts, parent._get_fact), (self.rules, parent._get_rule))
+        # the parent's objects for the fork's copies of them
+        originals = {}
+        for store, get in stores:
+            for copy in store.changed.values():
+                originals[id(copy)] = get(copy)
+
+        def rebase(fact_rule, source):
+            # point the fork's lists at the parent's objects, not the copies
+            for justification in source.supported_by:
+                for side, node in enumerate(justification):
+                    if id(node) in originals:
+                        justification[side] = originals[id(node)]
+            parent._set(fact_rule, 'asserted', source.asserted)
+            parent._set(fact_rule, 'supported_by', source.supported_by)
+            for attribute in ('supports_facts', 'supports_rules'):
+                parent._set(fact_rule, attribute, [originals.get(id(item), item)
+                                                   for item in getattr(source, attribute)])
+
+        for store, get in stores:
+            for original in store.removed.values():
+                parent._unstore(original)
+        for store, get in stores:
+            for copy in store.changed.values():
+                rebase(originals[id(copy)], copy)
+            for fact_rule in store.added:
+                parent._store(fact_rule)
+                if originals:
+                    rebase(fact_rule, fact_rule)
+        for rule in self.backward_rules.added:
+            parent.kb_assert_backward(rule)
+        # what the fork left pending replaces the parent's pending items,
+        # which the fork started from
+        items = []
+        while self.agenda:
+            items.append(self.agenda.pop())
+        for fact_rule in items:
+            for justification in fact_rule.supported_by:
+                for side, node in enumerate(justification):
+                    if id(node) in originals:
+                        justification[side] = originals[id(node)]
+            self.agenda.push(fact_rule)
+        parent.agenda = self.agenda
+        parent._publish()
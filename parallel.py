@@ -0,0 +1,286 @@
+"""kb_ask fanned out over a pool of worker processes.
+
+A single broad query is split across the workers (ParallelAsker.ask), a
+batch of independent queries is spread over them (ParallelAsker.ask_batch).
+
+The workers share the KB through a snapshot file (see snapshot.py): each one
+maps it once, as a mapped.MappedKnowledgeBase, when the pool starts, and the
+page cache holds one copy of it for all of them. The candidates of a query,
+in KB order, are split into one contiguous shard per worker. Each worker
+matches its shard on the symbol ids, without decoding the facts, and sends
+back the numbers of the matching facts. The shards are concatenated in
+order, so the answers come back in the order kb_ask gives them, and the
+asking process reads the bindings off its own facts, which it returns with
+their support links.
+"""
+import os
+import tempfile
+import weakref
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from logical_classes import *
+from util import compile_statement, is_var, match_compiled
+from mapped import MappedKnowledgeBase
+
+# the snapshot mapped by this worker process, see ParallelAsker
+_worker_kb = None
+
+
+def _open_snapshot(path):
+    """Initializer of the worker processes: map the snapshot
+
+    Args:
+        path (str): snapshot file
+    """
+    global _worker_kb
+    _worker_kb = MappedKnowledgeBase(path)
+
+
+def _match_shard(statement, shard, shards):
+    """Match a statement against one shard of its candidates, in a worker
+
+    Args:
+        statement (Statement): statement (pattern) to match
+        shard (int): shard to match, 0 to shards - 1
+        shards (int): number of shards the candidates are split into
+
+    Returns:
+        array|listof (int, dictof str): numbers of the matching facts, in KB
+            order, or, when facts of the predicate hold variables, pairs of
+            number and bindings_dict
+    """
+    facts = _worker_kb.facts
+    numbers = facts.candidate_numbers(statement)
+    size = len(numbers)
+    numbers = numbers[size * shard // shards:size * (shard + 1) // shards]
+    matches = _match_ids(facts, statement, numbers)
+    if matches is not None:
+        return matches
+    query = compile_statement(statement)
+    matches = []
+    for number in numbers:
+        binding = match_compiled(query, facts.statement(number))
+        if binding:
+            matches.append((number, binding.bindings_dict))
+    return matches
+
+
+def _match_statements(statements):
+    """Match every statement of a batch against all its candidates, in a
+        worker
+
+    Args:
+        statements (listof Statement): statements (patterns) to match
+
+    Returns:
+        listof array|listof (int, dictof str): matches of each statement,
+            see _match_shard
+    """
+    return [_match_shard(statement, 0, 1) for statement in statements]
+
+
+def _match_ids(facts, statement, numbers):
+    """Match a statement against facts by comparing symbol ids in place,
+        without decoding the facts
+
+    Args:
+        facts (MappedFactStore): facts of the snapshot
+        statement (Statement): statement (pattern) to match
+        numbers (memoryview): numbers of the candidate facts
+
+    Returns:
+        array|None: numbers of the matching facts. None if some fact of the
+            predicate holds a variable: matching both ways is then left to
+            match_compiled
+    """
+    matches = array('I')
+    if not len(numbers):
+        return matches
+    predicate, arity = facts.symbol_id(statement[0]), len(statement) - 1
+    if any(facts._holds_var(predicate, arity, position) for position in range(arity)):
+        return None
+    # (position, position it must equal or None, symbol id it must be or None)
+    tests, first = [], {}
+    for position, element in enumerate(statement[1:]):
+        if is_var(element):
+            if element in first:
+                tests.append((position, first[element], None))
+            else:
+                first[element] = position
+        else:
+            term = facts.symbol_id(element)
+            if term is None:
+                return matches
+            tests.append((position, None, term))
+    if not tests:
+        matches.extend(numbers)
+        return matches
+    offsets, terms = facts.sections['FTOFF'], facts.sections['FTERM']
+    for number in numbers:
+        start = offsets[number]
+        for position, other, term in tests:
+            if terms[start + position] != (terms[start + other] if term is None else term):
+                break
+        else:
+            matches.append(number)
+    return matches
+
+
+def _shut_down(pool, path):
+    """Stop a pool and remove its temporary snapshot, see ParallelAsker.close
+
+    Args:
+        pool (ProcessPoolExecutor): the workers
+        path (str|None): temporary snapshot file, None if there is none
+    """
+    pool.shutdown()
+    if path is not None and os.path.exists(path):
+        os.remove(path)
+
+
+class ParallelAsker(object):
+    """Pool of worker processes answering kb_ask on a snapshot of a KB, see
+        the module docstring. The KB must not change while the asker is in
+        use; KnowledgeBase.kb_ask_parallel makes a new one when it has.
+
+    Attributes:
+        kb (KnowledgeBase|MappedKnowledgeBase): KB the answers come from
+        path (str): snapshot file the workers map
+        version (int): version of the KB the snapshot was taken at
+        workers (int): number of worker processes
+        serial_below (float): queries the index expects fewer matches for
+            (see FactStore.estimate) are answered in this process, as
+            shipping them costs more than matching them
+    """
+    serial_below = 10000
+
+    def __init__(self, kb, workers=None):
+        """Constructor for ParallelAsker, starting the workers. A
+            KnowledgeBase is saved to a temporary snapshot, removed by close;
+            a MappedKnowledgeBase shares its own file
+
+        Args:
+            kb (KnowledgeBase|MappedKnowledgeBase): KB to ask
+            workers (int|None): number of worker processes, None for one
+                per CPU
+        """
+        super(ParallelAsker, self).__init__()
+        self.kb = kb
+        self.version = kb._version
+        self.workers = workers or os.cpu_count() or 1
+        if isinstance(kb, MappedKnowledgeBase):
+            self.path, temporary = kb.path, None
+            self._facts = None
+        else:
+            descriptor, self.path = tempfile.mkstemp(suffix='.kbsnap')
+            os.close(descriptor)
+            temporary = self.path
+            # fact numbers of the snapshot are positions in this list
+            self._facts = list(kb.facts)
+            kb.save(self.path)
+        self._pool = ProcessPoolExecutor(self.workers, initializer=_open_snapshot,
+                                         initargs=(self.path,))
+        # also run when the asker is garbage collected or at exit
+        self._close = weakref.finalize(self, _shut_down, self._pool, temporary)
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'ParallelAsker({!r}, workers={})'.format(self.path, self.workers)
+
+    def __enter__(self):
+        """Define behavior of with, the asker itself
+        """
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop the workers at the end of the with block
+        """
+        self.close()
+
+    def fact(self, number):
+        """Get the KB's fact at a position of the snapshot
+
+        Args:
+            number (int): fact number
+
+        Returns:
+            Fact
+        """
+        if self._facts is None:
+            return self.kb.facts.fact(number)
+        return self._facts[number]
+
+    def ask(self, statement):
+        """Match a statement against the KB's facts, in the workers
+
+        Args:
+            statement (Statement): statement (pattern) to match
+
+        Returns:
+            listof (Bindings, Fact): bindings of every matching fact, in KB
+                order
+        """
+        if self.kb.facts.estimate(statement) < self.serial_below:
+            query = compile_statement(statement)
+            answers = []
+            for fact in self.kb.facts.candidates(statement):
+                binding = match_compiled(query, fact.statement)
+                if binding:
+                    answers.append((binding, fact))
+            return answers
+        futures = [self._pool.submit(_match_shard, statement, shard, self.workers)
+                   for shard in range(self.workers)]
+        answers = []
+        for future in futures:
+            answers.extend(self._answers(statement, future.result()))
+        return answers
+
+    def ask_batch(self, statements, chunks_per_worker=4):
+        """Match many statements against the KB's facts, spreading them over
+            the workers in chunks (a few per worker, so a slow chunk doesn't
+            hold the others up)
+
+        Args:
+            statements (listof Statement): statements (patterns) to match
+            chunks_per_worker (int): number of chunks per worker
+
+        Returns:
+            listof listof (Bindings, Fact): answers of every statement, in
+                input order, see ask
+        """
+        size = -(-len(statements) // (self.workers * chunks_per_worker)) or 1
+        chunks = [statements[i:i + size] for i in range(0, len(statements), size)]
+        answers = []
+        for chunk, results in zip(chunks, self._pool.map(_match_statements, chunks)):
+            for statement, matches in zip(chunk, results):
+                answers.append(self._answers(statement, matches))
+        return answers
+
+    def _answers(self, statement, matches):
+        # bindings and facts of the matches a worker sent back, see
+        # _match_shard; number-only matches have their bindings read off
+        # the facts, by first appearance of each variable
+        variables, seen = [], set()
+        for position, element in enumerate(statement):
+            if position and is_var(element) and element not in seen:
+                seen.add(element)
+                variables.append((element, position))
+        answers = []
+        for match in matches:
+            binding = Bindings()
+            if isinstance(match, tuple):
+                number, binding.bindings_dict = match
+                fact = self.fact(number)
+            else:
+                fact = self.fact(match)
+                binding.bindings_dict = dict((variable, fact.statement[position])
+                                             for variable, position in variables)
+            answers.append((binding, fact))
+        return answers
+
+    def close(self):
+        """Stop the workers and remove the temporary snapshot, if any
+        """
+        self._close()
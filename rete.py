@@ -0,0 +1,215 @@
+from util import is_var, match, canonical_pattern
+from student_code import InferenceEngine
+
+
+class AlphaMemory(object):
+    """Node of the alpha network: one distinct first LHS pattern, tested once
+        per fact, and the rules waiting on it
+
+    Attributes:
+        pattern (tuple): canonical key of the pattern, see util.canonical_pattern
+        equal_positions (listof (int, int)): argument positions that hold the
+            same variable, so must hold the same element in a matching fact
+        rules (dictof Rule): rules whose first LHS statement is this pattern,
+            keyed by rule key in insertion order
+    """
+    def __init__(self, pattern):
+        """Constructor for AlphaMemory
+
+        Args:
+            pattern (tuple): canonical key of the pattern
+        """
+        super(AlphaMemory, self).__init__()
+        self.pattern = pattern
+        first_seen = {}
+        self.equal_positions = []
+        for i, element in enumerate(pattern[1:]):
+            if is_var(element):
+                if element in first_seen:
+                    self.equal_positions.append((first_seen[element], i))
+                else:
+                    first_seen[element] = i
+        self.rules = {}
+
+    def test(self, key):
+        """Check the variable consistency part of the pattern against a fact,
+            the constant part is already checked by the hash lookup
+
+        Args:
+            key (tuple): canonical key of a ground fact
+
+        Returns:
+            bool
+        """
+        return all(key[i + 1] == key[j + 1] for i, j in self.equal_positions)
+
+
+class ReteEngine(InferenceEngine):
+    """Inference engine that only visits the rules a fact can trigger.
+
+    Rules are indexed by their first LHS statement in an alpha network:
+    (predicate, arity) -> constant positions -> constants at those positions
+    -> AlphaMemory. A new fact is hashed into the network once per distinct
+    set of constant positions instead of being matched against every rule.
+    A new rule is joined only against the facts the KB's FactStore index
+    returns for its first LHS statement. Curried rules play the part of the
+    beta memories (partial joins) and are created by fc_infer exactly as with
+    InferenceEngine, so the KB ends up with the same facts, rules and
+    supported_by justifications.
+
+    Attributes:
+        network (dictof dictof dictof AlphaMemory): network[(predicate,
+            arity)][constant_positions][constants][pattern] => AlphaMemory
+        memory_of (dictof AlphaMemory): alpha memory of every known rule,
+            keyed by rule key
+    """
+    def __init__(self):
+        """Constructor for an empty ReteEngine
+        """
+        super(ReteEngine, self).__init__()
+        self.network = {}
+        self.memory_of = {}
+
+    def rule_added(self, rule):
+        """Compile a rule and put it in the alpha memory of its first LHS
+            statement
+
+        Args:
+            rule (Rule) - The new rule
+        """
+        super(ReteEngine, self).rule_added(rule)
+        pattern = canonical_pattern(rule.lhs[0])
+        positions = tuple(i for i, e in enumerate(pattern[1:]) if not is_var(e))
+        constants = tuple(pattern[i + 1] for i in positions)
+        memories = (self.network.setdefault((pattern[0], len(pattern) - 1), {})
+                    .setdefault(positions, {}).setdefault(constants, {}))
+        memory = memories.get(pattern)
+        if memory is None:
+            memory = memories[pattern] = AlphaMemory(pattern)
+        memory.rules[rule.key()] = rule
+        self.memory_of[rule.key()] = memory
+
+    def rule_removed(self, rule):
+        """Take a rule out of its alpha memory, dropping emptied nodes
+
+        Args:
+            rule (Rule) - The removed rule
+        """
+        memory = self.memory_of.pop(rule.key(), None)
+        if memory is None:
+            return
+        del memory.rules[rule.key()]
+        if memory.rules:
+            return
+        pattern = memory.pattern
+        positions = tuple(i for i, e in enumerate(pattern[1:]) if not is_var(e))
+        constants = tuple(pattern[i + 1] for i in positions)
+        by_positions = self.network[(pattern[0], len(pattern) - 1)]
+        memories = by_positions[positions][constants]
+        del memories[pattern]
+        if not memories:
+            del by_positions[positions][constants]
+            if not by_positions[positions]:
+                del by_positions[positions]
+                if not by_positions:
+                    del self.network[(pattern[0], len(pattern) - 1)]
+
+    def fork(self):
+        """Get the engine of a fork of the KB, see InferenceEngine.fork
+
+        Returns:
+            ForkedReteEngine - a network of the fork's rules over this one
+        """
+        return ForkedReteEngine(self)
+
+    def rules_for(self, fact, kb):
+        """Get the rules whose first LHS statement matches a fact, found
+            through the alpha memories the fact passes
+
+        Args:
+            fact (Fact) - A fact
+            kb (KnowledgeBase) - A KnowledgeBase
+
+        Returns:
+            listof Rule: rules activated by the fact
+        """
+        key = fact.key()
+        by_positions = self.network.get((key[0], len(key) - 1))
+        if not by_positions:
+            return []
+        rules = []
+        if any(is_var(e) for e in key[1:]):
+            # facts with variables can't be hashed on constants, test each node
+            for memories in by_positions.values():
+                for by_pattern in memories.values():
+                    for memory in by_pattern.values():
+                        for rule in memory.rules.values():
+                            if match(fact.statement, rule.lhs[0]):
+                                rules.append(rule)
+            return rules
+        for positions, memories in by_positions.items():
+            by_pattern = memories.get(tuple(key[i + 1] for i in positions))
+            if by_pattern:
+                for memory in by_pattern.values():
+                    if memory.test(key):
+                        rules.extend(memory.rules.values())
+        return rules
+
+    def facts_for(self, rule, kb):
+        """Get the facts the KB's index returns for the first LHS statement
+            of a rule
+
+        Args:
+            rule (Rule) - A rule
+            kb (KnowledgeBase) - A KnowledgeBase
+
+        Returns:
+            listof Fact: candidate facts
+        """
+        return kb.facts.candidates(rule.lhs[0])
+
+
+class ForkedReteEngine(ReteEngine):
+    """ReteEngine of a fork of a KB, see KnowledgeBase.fork. Rules the fork
+        adds go in its own (initially empty) network; rules it removes are
+        hidden from the base engine's answers, which is never changed.
+
+    Attributes:
+        base (ReteEngine): engine of the parent KB
+        hidden (set): keys of the base rules the fork removed
+    """
+    def __init__(self, base):
+        """Constructor for ForkedReteEngine
+
+        Args:
+            base (ReteEngine): engine of the parent KB
+        """
+        super(ForkedReteEngine, self).__init__()
+        self.base = base
+        self.hidden = set()
+
+    def rule_removed(self, rule):
+        """Take a rule out of the fork's network or hide the base's
+
+        Args:
+            rule (Rule) - The removed rule
+        """
+        super(ForkedReteEngine, self).rule_removed(rule)
+        self.hidden.add(rule.key())
+
+    def rules_for(self, fact, kb):
+        """Get the rules activated by a fact: the base engine's, less the
+            hidden ones and those the fork has in its own network, and the
+            fork's
+
+        Args:
+            fact (Fact) - A fact
+            kb (KnowledgeBase) - A KnowledgeBase
+
+        Returns:
+            listof Rule: rules activated by the fact
+        """
+        rules = [rule for rule in self.base.rules_for(fact, kb)
+                 if rule.key() not in self.hidden and rule.key() not in self.memory_of]
+        rules.extend(super(ForkedReteEngine, self).rules_for(fact, kb))
+        return rules
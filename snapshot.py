@@ -0,0 +1,375 @@
+"""Binary snapshots of a fully inferred KnowledgeBase.
+
+A snapshot holds the facts, the rules and the support graph, so loading one
+restores the KB (asserted flags, supported_by, supports_facts, supports_rules)
+without running inference again.
+
+Layout, little-endian: the MAGIC bytes, the number of sections (u32, padded to
+8 bytes), then a table of sections, each entry an 8 byte name, a 1 byte array
+typecode (padded to 8 bytes), an offset (u64) and an item count (u64). Every
+section is one flat typed array starting on an 8 byte boundary, so it can be
+read in place from a memory-mapped file with memoryview.cast:
+
+    SYMOFF  I  offsets of the symbols in SYMTXT, one more than symbols
+    SYMTXT  B  utf-8 text of all predicates and term elements
+    FPRED   i  symbol of the predicate of every fact, in KB order
+    FTOFF   I  offsets of the terms of every fact in FTERM, one more than facts
+    FTERM   i  symbols of the fact terms
+    FASSERT B  asserted flag of every fact
+    SPRED   i  symbol of the predicate of every rule statement
+    STOFF   I  offsets of the terms of every rule statement in STERM
+    STERM   i  symbols of the rule statement terms
+    RSOFF   I  offsets of every rule's statements (LHS then RHS) in SPRED
+    RASSERT B  asserted flag of every rule
+    RBACK   B  backward flag of every rule: the KB's backward rules (see
+               KnowledgeBase.kb_assert_backward) follow its rules
+    RPLAN   i  plan (RulePlan) of every rule, numbered in order of first use,
+               -1 for none: the rules curried from one rule share its plan
+    RDEPTH  I  depth of every rule in its plan
+    RVOFF   I  offsets of the slot values of every rule in RVALUE
+    RVALUE  i  symbol of every slot value of every rule, -1 where unbound
+    PSOFF   I  offsets of the statements of every plan (LHS then RHS, with
+               the plan's variables) in SPRED, after those of the rules
+    SUPPORT i  support graph: (supported node, fact, rule) triples, one per
+               supported_by pair. Facts are nodes 0..facts-1, rules follow
+    SYMSORT I  symbol ids in utf-8 byte order, to look a symbol up by binary
+               search without decoding the table
+    IKEY    i  sorted (predicate, arity, position, term) index keys, four ints
+               per key: position -1 with term -1 lists every fact of the
+               predicate and arity, term -2 the facts holding a variable at
+               the position, other keys the facts holding that term there
+    IOFF    I  offsets of the postings of every key in IPOST, one more than keys
+    IPOST   I  fact numbers, ascending (KB order) within each key
+
+The index sections are only used by mapped.MappedKnowledgeBase, load ignores
+them.
+"""
+import mmap
+import struct
+import sys
+from array import array
+
+from logical_classes import *
+from util import is_var
+
+MAGIC = b'KBSNAP01'
+HEADER = struct.Struct('<8sI4x')
+ENTRY = struct.Struct('<8sc7xQQ')
+
+
+class SymbolTable(object):
+    """Assigns consecutive integer ids to distinct strings
+
+    Attributes:
+        ids (dictof int): id of each symbol
+        symbols (listof str): symbols, indexed by id
+    """
+    def __init__(self):
+        """Constructor for an empty SymbolTable
+        """
+        super(SymbolTable, self).__init__()
+        self.ids = {}
+        self.symbols = []
+
+    def id(self, symbol):
+        """Get the id of a symbol, giving it the next one the first time
+
+        Args:
+            symbol (str): symbol to look up
+
+        Returns:
+            int: its id
+        """
+        symbol_id = self.ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = self.ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return symbol_id
+
+
+def statement_columns(statements, symbols):
+    """Lay statements out in columns: predicate ids, term offsets, term ids
+
+    Args:
+        statements (iterable of Statement): statements to lay out
+        symbols (SymbolTable): symbol table to take ids from
+
+    Returns:
+        (array, array, array): predicates ('i'), offsets ('I'), terms ('i')
+    """
+    predicates, offsets, terms = array('i'), array('I', [0]), array('i')
+    for statement in statements:
+        predicates.append(symbols.id(statement[0]))
+        terms.extend(symbols.id(element) for element in statement[1:])
+        offsets.append(len(terms))
+    return predicates, offsets, terms
+
+
+def index_columns(facts, symbols):
+    """Build the fact index sections, see the module docstring
+
+    Args:
+        facts (listof Fact): facts in KB order
+        symbols (SymbolTable): symbol table to take ids from
+
+    Returns:
+        (array, array, array): keys ('i'), offsets ('I'), postings ('I')
+    """
+    postings = {}
+    for number, fact in enumerate(facts):
+        key = fact.key()
+        predicate, arity = symbols.id(key[0]), len(key) - 1
+        postings.setdefault((predicate, arity, -1, -1), []).append(number)
+        for position, element in enumerate(key[1:]):
+            term = -2 if is_var(element) else symbols.id(element)
+            postings.setdefault((predicate, arity, position, term), []).append(number)
+    keys, offsets, posts = array('i'), array('I', [0]), array('I')
+    for key in sorted(postings):
+        keys.extend(key)
+        posts.extend(postings[key])
+        offsets.append(len(posts))
+    return keys, offsets, posts
+
+
+def write_sections(path, sections):
+    """Write typed arrays as the sections of a snapshot file
+
+    Args:
+        path (str): file to write
+        sections (listof (str, array|bytes)): section names and contents;
+            bytes are written as typecode 'B'
+    """
+    table_end = HEADER.size + ENTRY.size * len(sections)
+    entries, offset = [], table_end
+    for name, data in sections:
+        if isinstance(data, array):
+            if sys.byteorder != 'little':
+                data = array(data.typecode, data)
+                data.byteswap()
+            typecode, count, raw = data.typecode, len(data), data.tobytes()
+        else:
+            typecode, count, raw = 'B', len(data), bytes(data)
+        entries.append((name, typecode, offset, count, raw))
+        offset += len(raw) + (-len(raw) % 8)
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, len(sections)))
+        for name, typecode, offset, count, raw in entries:
+            file.write(ENTRY.pack(name.encode('ascii'), typecode.encode('ascii'), offset, count))
+        for name, typecode, offset, count, raw in entries:
+            file.write(raw)
+            file.write(b'\0' * (-len(raw) % 8))
+
+
+def read_sections(buffer):
+    """Get the sections of a snapshot as typed memoryviews over the buffer,
+        without copying them
+
+    Args:
+        buffer (bytes|mmap): contents of a snapshot file
+
+    Returns:
+        dictof memoryview: sections by name
+
+    Raises:
+        ValueError: if the buffer is not a snapshot
+    """
+    magic, count = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("not a knowledge base snapshot")
+    view = memoryview(buffer)
+    sections = {}
+    for i in range(count):
+        name, typecode, offset, items = ENTRY.unpack_from(buffer, HEADER.size + ENTRY.size * i)
+        typecode = typecode.decode('ascii')
+        size = array(typecode).itemsize * items
+        section = view[offset:offset + size].cast(typecode)
+        if sys.byteorder != 'little' and typecode != 'B':
+            swapped = array(typecode, section.tobytes())
+            swapped.byteswap()
+            section = memoryview(swapped)
+        sections[name.rstrip(b'\0').decode('ascii')] = section
+    return sections
+
+
+def read_symbols(sections):
+    """Decode the symbol table of a snapshot
+
+    Args:
+        sections (dictof memoryview): sections from read_sections
+
+    Returns:
+        listof str: interned symbols, indexed by id
+    """
+    offsets, text = sections['SYMOFF'], sections['SYMTXT']
+    return [sys.intern(bytes(text[offsets[i]:offsets[i + 1]]).decode('utf-8'))
+            for i in range(len(offsets) - 1)]
+
+
+def read_statements(symbols, predicates, offsets, terms):
+    """Rebuild the statements laid out by statement_columns. Equal
+        statements, e.g. the LHS shared by the rules curried from one fact,
+        are built once and shared (statements are immutable)
+
+    Args:
+        symbols (listof str): symbols, indexed by id
+        predicates, offsets, terms (memoryview): the three columns
+
+    Returns:
+        listof Statement
+    """
+    predicates, offsets, terms = predicates.tolist(), offsets.tolist(), terms.tolist()
+    built = {}
+    statements = []
+    for i, predicate in enumerate(predicates):
+        ids = (predicate,) + tuple(terms[offsets[i]:offsets[i + 1]])
+        statement = built.get(ids)
+        if statement is None:
+            statement = built[ids] = Statement.from_tokens([symbols[symbol_id] for symbol_id in ids])
+        statements.append(statement)
+    return statements
+
+
+def save(kb, path):
+    """Write a snapshot of a KnowledgeBase
+
+    Args:
+        kb (KnowledgeBase): knowledge base to save
+        path (str): file to write
+    """
+    symbols = SymbolTable()
+    facts, rules = list(kb.facts), list(kb.rules) + list(kb.backward_rules)
+    fact_pred, fact_offsets, fact_terms = statement_columns((f.statement for f in facts), symbols)
+    rule_statements = array('I', [0])
+    statements = []
+    for rule in rules:
+        statements.extend(rule.lhs)
+        statements.append(rule.rhs)
+        rule_statements.append(len(statements))
+    plans = {}
+    rule_plans, rule_depths = array('i'), array('I')
+    value_offsets, values = array('I', [0]), array('i')
+    plan_statements = array('I', [len(statements)])
+    for rule in rules:
+        if rule.plan is None:
+            rule_plans.append(-1)
+            rule_depths.append(0)
+        else:
+            number = plans.get(id(rule.plan))
+            if number is None:
+                number = plans[id(rule.plan)] = len(plans)
+                # with no values, filling gives back the statements the plan
+                # was compiled from, which compile to the same plan again
+                unbound = [None] * len(rule.plan.variables)
+                statements.extend(rule.plan.fill(template, unbound) for template in rule.plan.lhs)
+                statements.append(rule.plan.fill(rule.plan.rhs, unbound))
+                plan_statements.append(len(statements))
+            rule_plans.append(number)
+            rule_depths.append(rule.depth)
+            values.extend(-1 if value is None else symbols.id(value) for value in rule.values)
+        value_offsets.append(len(values))
+    stmt_pred, stmt_offsets, stmt_terms = statement_columns(statements, symbols)
+    index_keys, index_offsets, index_posts = index_columns(facts, symbols)
+
+    node = dict((f.key(), i) for i, f in enumerate(facts))
+    rule_node = dict((r.key(), len(facts) + i) for i, r in enumerate(rules))
+    support = array('i')
+    for supported, ids in ((facts, node), (rules, rule_node)):
+        for fact_rule in supported:
+            for fact, rule in fact_rule.supported_by:
+                if fact.key() in node and rule.key() in rule_node:
+                    support.extend((ids[fact_rule.key()], node[fact.key()], rule_node[rule.key()]))
+
+    text = bytearray()
+    symbol_offsets = array('I', [0])
+    encoded = [symbol.encode('utf-8') for symbol in symbols.symbols]
+    for symbol in encoded:
+        text.extend(symbol)
+        symbol_offsets.append(len(text))
+    symbol_order = array('I', sorted(range(len(encoded)), key=encoded.__getitem__))
+    write_sections(path, [
+        ('SYMOFF', symbol_offsets), ('SYMTXT', text),
+        ('FPRED', fact_pred), ('FTOFF', fact_offsets), ('FTERM', fact_terms),
+        ('FASSERT', bytes(bytearray(f.asserted for f in facts))),
+        ('SPRED', stmt_pred), ('STOFF', stmt_offsets), ('STERM', stmt_terms),
+        ('RSOFF', rule_statements),
+        ('RASSERT', bytes(bytearray(r.asserted for r in rules))),
+        ('RBACK', bytes(bytearray(i >= len(kb.rules) for i in range(len(rules))))),
+        ('RPLAN', rule_plans), ('RDEPTH', rule_depths),
+        ('RVOFF', value_offsets), ('RVALUE', values),
+        ('PSOFF', plan_statements),
+        ('SUPPORT', support),
+        ('SYMSORT', symbol_order),
+        ('IKEY', index_keys), ('IOFF', index_offsets), ('IPOST', index_posts),
+    ])
+
+
+def load(path, kb):
+    """Restore a snapshot into an empty KnowledgeBase, without inference
+
+    Args:
+        path (str): snapshot file
+        kb (KnowledgeBase): empty knowledge base to fill
+
+    Returns:
+        KnowledgeBase: kb
+    """
+    with open(path, 'rb') as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    sections = {}
+    try:
+        sections = read_sections(buffer)
+        symbols = read_symbols(sections)
+        facts = []
+        for statement, asserted in zip(read_statements(symbols, sections['FPRED'],
+                                                       sections['FTOFF'], sections['FTERM']),
+                                       sections['FASSERT']):
+            fact = Fact(statement)
+            fact.asserted = bool(asserted)
+            facts.append(fact)
+        statements = read_statements(symbols, sections['SPRED'], sections['STOFF'], sections['STERM'])
+        offsets = sections['RSOFF'].tolist()
+        rules, backward = [], sections.get('RBACK', bytes(len(sections['RASSERT'])))
+        # one RulePlan per plan, shared by its rules like when they were
+        # inferred, instead of compiling every rule again (older snapshots
+        # have no plans: the engine compiles each rule when it is stored)
+        plans = []
+        if 'PSOFF' in sections:
+            plan_offsets = sections['PSOFF']
+            plans = [RulePlan(Rule([statements[plan_offsets[i]:plan_offsets[i + 1] - 1],
+                                    statements[plan_offsets[i + 1] - 1]]))
+                     for i in range(len(plan_offsets) - 1)]
+            rule_plans, rule_depths = sections['RPLAN'].tolist(), sections['RDEPTH'].tolist()
+            value_offsets = sections['RVOFF'].tolist()
+            values = [None if value < 0 else symbols[value] for value in sections['RVALUE'].tolist()]
+        for i, asserted in enumerate(sections['RASSERT']):
+            rule = Rule([statements[offsets[i]:offsets[i + 1] - 1], statements[offsets[i + 1] - 1]])
+            rule.asserted = bool(asserted)
+            if plans and rule_plans[i] >= 0:
+                rule.plan = plans[rule_plans[i]]
+                rule.depth = rule_depths[i]
+                rule.values = tuple(values[value_offsets[i]:value_offsets[i + 1]])
+            if backward[i]:
+                kb.backward_rules.append(rule)
+            else:
+                rules.append(rule)
+
+        nodes = facts + rules
+        support = sections['SUPPORT'].tolist()
+        for i in range(0, len(support), 3):
+            supported, fact, rule = nodes[support[i]], facts[support[i + 1]], nodes[support[i + 2]]
+            supported.supported_by.append(Justification(fact, rule))
+            if isinstance(supported, Fact):
+                fact.supports_facts.append(supported)
+                rule.supports_facts.append(supported)
+            else:
+                fact.supports_rules.append(supported)
+                rule.supports_rules.append(supported)
+    finally:
+        # views into the map must be released before it can be closed
+        for section in sections.values():
+            section.release()
+        buffer.close()
+
+    for fact_rule in nodes:
+        kb._store(fact_rule)
+    return kb
@@ -0,0 +1,328 @@
+from util import is_var
+
+
+class OrderedStore(object):
+    """Insertion-ordered collection of Facts or Rules keyed by their canonical
+        key (see Fact.key and Rule.key). Membership, lookup and removal are
+        O(1) while iteration still visits items in the order they were added,
+        just like the list it replaces in the KnowledgeBase.
+
+    Attributes:
+        items (dictof Fact|Rule): stored facts or rules where key is the
+            canonical key of the item and value is the item itself
+    """
+    def __init__(self, items=[]):
+        """Constructor for OrderedStore with optional initial items
+
+        Args:
+            items (listof Fact|Rule): facts or rules to store, in order
+        """
+        super(OrderedStore, self).__init__()
+        self.items = {}
+        for item in items:
+            self.append(item)
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return '{}({!r})'.format(type(self).__name__, list(self.items.values()))
+
+    def __len__(self):
+        """Define behavior of len, the number of stored items
+        """
+        return len(self.items)
+
+    def __iter__(self):
+        """Iterate over stored items in insertion order, without copying.
+            The store must not change during the iteration (inference only
+            queues what it derives, see KnowledgeBase.run_agenda); iterate
+            over list(store) to change it meanwhile.
+        """
+        return iter(self.items.values())
+
+    def __contains__(self, item):
+        """Define behavior of `in`, O(1) lookup by key
+        """
+        return item.key() in self.items
+
+    def __getitem__(self, index):
+        """Positional access kept for callers written against the old list
+            based store. O(n), prefer get
+        """
+        return list(self.items.values())[index]
+
+    def get(self, item):
+        """Get the stored item equal to the given one
+
+        Args:
+            item (Fact|Rule): fact or rule we're searching for
+
+        Returns:
+            Fact|Rule|None: the stored item, None if there is none
+        """
+        return self.items.get(item.key())
+
+    def append(self, item):
+        """Add an item at the end of the store. Items already stored are left
+            where they are.
+
+        Args:
+            item (Fact|Rule): fact or rule to add
+        """
+        key = item.key()
+        if key not in self.items:
+            self.items[key] = item
+
+    def remove(self, item):
+        """Remove the stored item equal to the given one
+
+        Args:
+            item (Fact|Rule): fact or rule to remove
+
+        Raises:
+            ValueError: if no such item is stored, like list.remove
+        """
+        try:
+            del self.items[item.key()]
+        except KeyError:
+            raise ValueError("{!r} not in store".format(item))
+
+
+class ArgumentIndex(object):
+    """Discrimination index over the facts sharing one predicate and arity
+
+    Attributes:
+        facts (dictof Fact): every indexed fact, keyed by canonical key (the
+            values are whatever the owner indexes the keys with, see
+            KeyIndex.add)
+        positions (listof dictof dictof Fact): one dict per argument position
+            mapping the element at that position to the facts holding it,
+            e.g. positions[0]['bigbox'] => {key: Fact, ...}
+        var_counts (listof int): per position, how many indexed facts hold a
+            variable there (such facts match any constant in that position)
+    """
+    def __init__(self, arity):
+        """Constructor for an empty ArgumentIndex
+
+        Args:
+            arity (int): number of terms of the indexed statements
+        """
+        super(ArgumentIndex, self).__init__()
+        self.facts = {}
+        self.positions = [{} for _ in range(arity)]
+        self.var_counts = [0] * arity
+
+    def add(self, key, value):
+        """Index a key that isn't indexed yet
+
+        Args:
+            key (Statement): canonical key of a fact
+            value (any): what the key maps to in the index, e.g. the fact
+        """
+        self.facts[key] = value
+        for i, element in enumerate(key[1:]):
+            self.positions[i].setdefault(element, {})[key] = value
+            if is_var(element):
+                self.var_counts[i] += 1
+
+    def remove(self, key):
+        """Unindex an indexed key
+
+        Args:
+            key (Statement): canonical key of a fact
+        """
+        del self.facts[key]
+        for i, element in enumerate(key[1:]):
+            position = self.positions[i]
+            bucket = position[element]
+            del bucket[key]
+            if not bucket:
+                del position[element]
+            if is_var(element):
+                self.var_counts[i] -= 1
+
+    def select(self, key):
+        """Get the indexed facts that may match a statement, from its most
+            selective constant position; a position is skipped when some
+            indexed fact has a variable there
+
+        Args:
+            key (Statement): key of the statement (pattern), same predicate
+                and arity
+
+        Returns:
+            dictof Fact: candidate facts by key, in insertion order
+        """
+        best = self.facts
+        for i, element in enumerate(key[1:]):
+            # a variable in the query, or a stored fact with a variable in
+            # this position, matches anything here
+            if is_var(element) or self.var_counts[i]:
+                continue
+            bucket = self.positions[i].get(element)
+            if bucket is None:
+                return {}
+            if len(bucket) < len(best):
+                best = bucket
+        return best
+
+    def estimate(self, key, bound=()):
+        """Estimate how many indexed facts match a statement, see
+            FactStore.estimate
+
+        Args:
+            key (Statement): key of the statement (pattern), same predicate
+                and arity
+            bound (set of str): variables of the statement that will have
+                values when it is looked up
+
+        Returns:
+            float: expected number of matching facts
+        """
+        total = len(self.facts)
+        estimate = float(total)
+        for i, element in enumerate(key[1:]):
+            if self.var_counts[i]:
+                continue
+            if not is_var(element):
+                estimate *= len(self.positions[i].get(element, ())) / float(total)
+            elif element in bound:
+                estimate /= len(self.positions[i])
+        return estimate
+
+
+class KeyIndex(dict):
+    """Predicate/argument discrimination index of fact keys: index[predicate]
+        [arity] is the ArgumentIndex of the keys with that predicate and
+        arity. Used by FactStore, and by mvcc.VersionedFactStore for the keys
+        of every version
+    """
+    def add(self, key, value):
+        """Index a key that isn't indexed yet
+
+        Args:
+            key (Statement): canonical key of a fact
+            value (any): what the key maps to in the index, e.g. the fact
+        """
+        by_arity = self.setdefault(key[0], {})
+        arg_index = by_arity.get(len(key) - 1)
+        if arg_index is None:
+            arg_index = by_arity[len(key) - 1] = ArgumentIndex(len(key) - 1)
+        arg_index.add(key, value)
+
+    def remove(self, key):
+        """Unindex an indexed key, dropping the indexes left empty
+
+        Args:
+            key (Statement): canonical key of a fact
+        """
+        by_arity = self[key[0]]
+        arg_index = by_arity[len(key) - 1]
+        arg_index.remove(key)
+        if not arg_index.facts:
+            del by_arity[len(key) - 1]
+            if not by_arity:
+                del self[key[0]]
+
+    def select(self, key):
+        """Get the indexed values that may match a statement, see
+            ArgumentIndex.select
+
+        Args:
+            key (Statement): key of the statement (pattern)
+
+        Returns:
+            dictof any: candidate values by key, in insertion order
+        """
+        arg_index = self.get(key[0], {}).get(len(key) - 1)
+        if arg_index is None:
+            return {}
+        return arg_index.select(key)
+
+    def estimate(self, key, bound=()):
+        """Estimate how many indexed keys match a statement, see
+            ArgumentIndex.estimate
+        """
+        arg_index = self.get(key[0], {}).get(len(key) - 1)
+        if arg_index is None:
+            return 0.0
+        return arg_index.estimate(key, bound)
+
+
+class FactStore(OrderedStore):
+    """OrderedStore of Facts that also keeps a predicate/argument
+        discrimination index (predicate -> arity -> position -> element ->
+        facts) so a query only has to be matched against the facts that can
+        possibly unify with it.
+
+    Attributes:
+        items (dictof Fact): see OrderedStore
+        index (KeyIndex): index[predicate][arity] holds the ArgumentIndex
+            of the facts with that predicate and arity
+    """
+    def __init__(self, items=[]):
+        """Constructor for FactStore with optional initial facts
+
+        Args:
+            items (listof Fact): facts to store, in order
+        """
+        self.index = KeyIndex()
+        super(FactStore, self).__init__(items)
+
+    def append(self, item):
+        """Add a fact at the end of the store and index it
+
+        Args:
+            item (Fact): fact to add
+        """
+        key = item.key()
+        if key in self.items:
+            return
+        self.items[key] = item
+        self.index.add(key, item)
+
+    def remove(self, item):
+        """Remove the stored fact equal to the given one and unindex it
+
+        Args:
+            item (Fact): fact to remove
+
+        Raises:
+            ValueError: if no such fact is stored, like list.remove
+        """
+        key = item.key()
+        if key not in self.items:
+            raise ValueError("{!r} not in store".format(item))
+        del self.items[key]
+        self.index.remove(key)
+
+    def candidates(self, statement):
+        """Get the stored facts that may match the given statement: same
+            predicate and arity, and holding the statement's constants at
+            their positions. The most selective constant position is used; a
+            position is skipped when some stored fact has a variable there.
+
+        Args:
+            statement (Statement): statement (pattern) to look up
+
+        Returns:
+            listof Fact: candidate facts, in insertion order
+        """
+        return list(self.index.select(statement.key()).values())
+
+    def estimate(self, statement, bound=()):
+        """Estimate how many stored facts match a statement, from the index
+            statistics: the facts of its predicate and arity, scaled by the
+            share of them holding each of its constants and, for each of its
+            variables that is bound, by one over the number of distinct
+            elements at that position (positions are taken as independent)
+
+        Args:
+            statement (Statement): statement (pattern) to estimate
+            bound (set of str): variables of the statement that will have
+                values when it is looked up
+
+        Returns:
+            float: expected number of matching facts
+        """
+        return self.index.estimate(statement.key(), bound)
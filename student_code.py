@@ -1,14 +1,44 @@
+import contextlib
+import logging
 import read, copy
 from util import *
 from logical_classes import *
+from store import OrderedStore, FactStore
+from agenda import Agenda
+from cache import QueryCache
 
-verbose = 0
+# messages go through logging, formatted only when a handler takes them:
+# INFO for each assert, ask and retraction, DEBUG for each derivation
+logger = logging.getLogger(__name__)
+
+def _truncate(items, length):
+    """Undo appends to a list, see KnowledgeBase._append
+    """
+    del items[length:]
 
 class KnowledgeBase(object):
-    def __init__(self, facts=[], rules=[]):
-        self.facts = facts
-        self.rules = rules
-        self.ie = InferenceEngine()
+    def __init__(self, facts=[], rules=[], ie=None):
+        self.facts = FactStore(facts)
+        self.rules = OrderedStore(rules)
+        self.ie = ie if ie is not None else InferenceEngine()
+        for rule in self.rules:
+            self.ie.rule_added(rule)
+        # rules only used by kb_ask, see kb_assert_backward
+        self.backward_rules = OrderedStore()
+        # facts and rules waiting to be added, see run_agenda
+        self.agenda = Agenda()
+        self.agenda_limit = None
+        self._running = False
+        # undo log of the open transaction, None outside one
+        self._journal = None
+        # kb_ask results, off until cache.maxsize is set, see cache_info
+        self.cache = QueryCache()
+        # bumped whenever a fact is stored or removed
+        self._version = 0
+        # workers of kb_ask_parallel, see parallel.py
+        self._asker = None
+        # versions of the facts for reader threads, see reader
+        self.versions = None
 
     def __repr__(self):
         return 'KnowledgeBase({!r}, {!r})'.format(self.facts, self.rules)
@@ -29,9 +59,7 @@ class KnowledgeBase(object):
         Returns:
             Fact: matching fact
         """
-        for kbfact in self.facts:
-            if fact == kbfact:
-                return kbfact
+        return self.facts.get(fact)
 
     def _get_rule(self, rule):
         """INTERNAL USE ONLY
@@ -43,44 +71,285 @@ class KnowledgeBase(object):
         Returns:
             Rule: matching rule
         """
-        for kbrule in self.rules:
-            if rule == kbrule:
-                return kbrule
+        return self.rules.get(rule)
+
+    def _store(self, fact_rule):
+        """INTERNAL USE ONLY
+        Put a new fact or rule in its store and let the inference engine know
+
+        Args:
+            fact_rule (Fact|Rule): fact or rule not yet in the KB
+        """
+        if isinstance(fact_rule, Fact):
+            self.facts.append(fact_rule)
+            self.cache.invalidate(fact_rule.statement)
+            self._version += 1
+            if self.versions is not None:
+                self.versions.add(fact_rule)
+        else:
+            self.rules.append(fact_rule)
+            self.ie.rule_added(fact_rule)
+        if self._journal is not None:
+            self._journal.append((self._unstore, (fact_rule,)))
+
+    def _unstore(self, fact_rule):
+        """INTERNAL USE ONLY
+        Take a fact or rule out of its store and let the inference engine know
+
+        Args:
+            fact_rule (Fact|Rule): fact or rule in the KB
+        """
+        if isinstance(fact_rule, Fact):
+            self.facts.remove(fact_rule)
+            self.cache.invalidate(fact_rule.statement)
+            self._version += 1
+            if self.versions is not None:
+                self.versions.remove(fact_rule)
+        else:
+            self.rules.remove(fact_rule)
+            self.ie.rule_removed(fact_rule)
+        if self._journal is not None:
+            self._journal.append((self._store, (fact_rule,)))
+
+    def _own(self, fact_rule):
+        """INTERNAL USE ONLY
+        Get the version of a fact or rule of the KB that this KB may change.
+        That is the fact or rule itself, except in a fork (see fork), which
+        copies its parent's on first write
+
+        Args:
+            fact_rule (Fact|Rule): fact or rule of the KB
+
+        Returns:
+            Fact|Rule: the fact or rule to change
+        """
+        return fact_rule
+
+    def _set(self, fact_rule, attribute, value):
+        """INTERNAL USE ONLY
+        Set an attribute of a fact or rule in the KB, journaled
+
+        Args:
+            fact_rule (Fact|Rule): fact or rule in the KB
+            attribute (str): name of the attribute
+            value (any): its new value
+        """
+        fact_rule = self._own(fact_rule)
+        if self._journal is not None:
+            self._journal.append((setattr, (fact_rule, attribute, getattr(fact_rule, attribute))))
+        setattr(fact_rule, attribute, value)
+
+    def _append(self, fact_rule, attribute, item):
+        """INTERNAL USE ONLY
+        Append to the supported_by or a supports list of a fact or rule in the
+        KB, journaled
+
+        Args:
+            fact_rule (Fact|Rule): fact or rule in the KB
+            attribute (str): name of the list
+            item (Justification|Fact|Rule): what to append
+        """
+        items = getattr(self._own(fact_rule), attribute)
+        if self._journal is not None:
+            self._journal.append((_truncate, (items, len(items))))
+        items.append(item)
+
+    def _link(self, kb_fact_rule, justifications):
+        """INTERNAL USE ONLY
+        Record a fact or rule of the KB in the supports lists of the facts
+        and rules it is justified by
+
+        Args:
+            kb_fact_rule (Fact|Rule): fact or rule stored in the KB
+            justifications (listof Justification): its new justifications
+        """
+        attribute = 'supports_facts' if isinstance(kb_fact_rule, Fact) else 'supports_rules'
+        for justification in justifications:
+            for antecedent in justification:
+                self._append(antecedent, attribute, kb_fact_rule)
+
+    def _merge(self, kb_fact_rule, fact_rule):
+        """INTERNAL USE ONLY
+        Fold a fact or rule that is already in the KB into the KB's copy: its
+        support is added, or the KB's copy becomes asserted
+
+        Args:
+            kb_fact_rule (Fact|Rule): the fact or rule stored in the KB
+            fact_rule (Fact|Rule): the equal fact or rule being added
+        """
+        if fact_rule.supported_by:
+            for f in fact_rule.supported_by:
+                self._append(kb_fact_rule, 'supported_by', f)
+        elif not kb_fact_rule.asserted:
+            self._set(kb_fact_rule, 'asserted', True)
+
+    def _store_or_merge(self, fact_rule):
+        """INTERNAL USE ONLY
+        Store a fact or rule without inferring from it, or merge it into the
+        KB's copy if there is one, and link it to what it is justified by
+
+        Args:
+            fact_rule (Fact|Rule): fact or rule to add
+
+        Returns:
+            bool: True if the fact or rule is new to the KB
+        """
+        if isinstance(fact_rule, Fact):
+            kb_fact_rule = self._get_fact(fact_rule)
+        else:
+            kb_fact_rule = self._get_rule(fact_rule)
+        if kb_fact_rule is None:
+            self._store(fact_rule)
+            self._link(fact_rule, fact_rule.supported_by)
+            return True
+        if kb_fact_rule is fact_rule:
+            # this very object is stored already, it has nothing to add
+            return False
+        self._merge(kb_fact_rule, fact_rule)
+        self._link(kb_fact_rule, fact_rule.supported_by)
+        return False
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run a block of asserts and retracts as one transaction: if the
+            block raises, every change it made to the KB is undone, newest
+            first, and the exception goes on. Nothing is copied up front, the
+            KB journals each insertion, removal and support link change while
+            the transaction is open. Transactions nest, an inner one that
+            fails only undoes its own changes.
+
+            with kb.transaction():
+                kb.kb_assert(fact)
+
+        Facts and rules put back by an undone retraction come last in
+        iteration order.
+
+        Yields:
+            KnowledgeBase - this KB
+        """
+        outer = self._journal is None
+        if outer:
+            self._journal = []
+        mark = len(self._journal)
+        agenda = self.agenda.copy()
+        try:
+            yield self
+        except BaseException:
+            self._rollback(mark)
+            self.agenda = agenda
+            raise
+        finally:
+            if outer:
+                self._journal = None
+                self._publish()
+
+    def _rollback(self, mark):
+        """INTERNAL USE ONLY
+        Undo the journaled changes made since the journal had mark entries
+
+        Args:
+            mark (int): length of the journal to go back to
+        """
+        journal, self._journal = self._journal, None
+        try:
+            while len(journal) > mark:
+                undo, args = journal.pop()
+                undo(*args)
+        finally:
+            self._journal = journal
+
+    def reader(self):
+        """Pin the facts as of the last completed write for a reader thread:
+            the view it returns answers kb_ask, kb_ask_all, ask_iter,
+            ask_exists and ask_count from them, without locks, while one
+            writer thread keeps asserting and retracting. A write (kb_assert,
+            kb_assert_many, kb_retract, kb_retract_many, an outermost
+            transaction, a fork commit) becomes visible to the readers made
+            after it completes, never half of its cascade. With agenda_limit
+            set, that is once the agenda has run empty. See mvcc.py.
+
+        The KB starts keeping versions of its facts on the first call, which
+        must not race with a write.
+
+        Returns:
+            mvcc.ReadView - the view, to be released when done
+        """
+        import mvcc
+        if self.versions is None:
+            self.versions = mvcc.VersionedFactStore(self.facts)
+        return mvcc.ReadView(self, self.versions.pin())
+
+    def _publish(self):
+        """INTERNAL USE ONLY
+        Make the facts stored and removed so far visible to new readers (see
+        reader), unless a transaction is open (it publishes when it ends) or
+        items are left on the agenda (see agenda_limit): the run that empties
+        it publishes the whole cascade
+        """
+        if self.versions is not None and self._journal is None and not self.agenda:
+            self.versions.publish()
+
+    def fork(self):
+        """Make a copy-on-write fork of the KB for what-if reasoning. The fork
+            shares this KB's facts, rules and index and only records its own
+            changes: facts and rules it adds or removes, and copies of the
+            ones whose supports it changes. Making one copies only the
+            pending agenda items. With the ReteEngine, using it costs in
+            proportion to what it changes; the default engine walks all the
+            rules for each new fact, the parent's too (see
+            overlay.ForkedKnowledgeBase). Drop it to discard the changes or
+            commit it to apply them to this KB, which must not change while
+            the fork is open.
+
+        Returns:
+            KnowledgeBase - the fork, see overlay.ForkedKnowledgeBase
+        """
+        import overlay
+        return overlay.ForkedKnowledgeBase(self)
 
     def kb_add(self, fact_rule):
-        """Add a fact or rule to the KB
+        """Add a fact or rule to the KB. It goes on the agenda, which is run
+            unless it is already running (i.e. this is called from inference),
+            so inference never recurses.
+
         Args:
             fact_rule (Fact|Rule) - the fact or rule to be added
         Returns:
             None
         """
-        printv("Adding {!r}", 1, verbose, [fact_rule])
-        if isinstance(fact_rule, Fact):
-            if fact_rule not in self.facts:
-                self.facts.append(fact_rule)
-                for rule in self.rules:
-                    self.ie.fc_infer(fact_rule, rule, self)
-            else:
-                if fact_rule.supported_by:
-                    ind = self.facts.index(fact_rule)
-                    for f in fact_rule.supported_by:
-                        self.facts[ind].supported_by.append(f)
-                else:
-                    ind = self.facts.index(fact_rule)
-                    self.facts[ind].asserted = True
-        elif isinstance(fact_rule, Rule):
-            if fact_rule not in self.rules:
-                self.rules.append(fact_rule)
-                for fact in self.facts:
-                    self.ie.fc_infer(fact, fact_rule, self)
-            else:
-                if fact_rule.supported_by:
-                    ind = self.rules.index(fact_rule)
-                    for f in fact_rule.supported_by:
-                        self.rules[ind].supported_by.append(f)
-                else:
-                    ind = self.rules.index(fact_rule)
-                    self.rules[ind].asserted = True
+        logger.debug("Adding %s", fact_rule)
+        if isinstance(fact_rule, Fact) or isinstance(fact_rule, Rule):
+            self.agenda.push(fact_rule)
+            if not self._running:
+                self.run_agenda(self.agenda_limit)
+
+    def run_agenda(self, limit=None):
+        """Add the facts and rules waiting on the agenda to the KB, inferring
+            from each new one. What inference derives is pushed on the agenda
+            and added by this same loop.
+
+        Args:
+            limit (int|None) - most items to take off the agenda, None to run
+                it empty. Items left over wait for the next call
+
+        Returns:
+            int - number of items taken off the agenda
+        """
+        self._running = True
+        done = 0
+        try:
+            while self.agenda and (limit is None or done < limit):
+                fact_rule = self.agenda.pop()
+                done += 1
+                if self._store_or_merge(fact_rule):
+                    if isinstance(fact_rule, Fact):
+                        self.ie.infer_from_fact(fact_rule, self)
+                    else:
+                        self.ie.infer_from_rule(fact_rule, self)
+        finally:
+            self._running = False
+        self._publish()
+        return done
 
     def kb_assert(self, fact_rule):
         """Assert a fact or rule into the KB
@@ -88,183 +357,534 @@ class KnowledgeBase(object):
         Args:
             fact_rule (Fact or Rule): Fact or Rule we're asserting
         """
-        printv("Asserting {!r}", 0, verbose, [fact_rule])
+        logger.info("Asserting %s", fact_rule)
         self.kb_add(fact_rule)
 
+    def kb_assert_backward(self, rule):
+        """Assert a rule that is only used backward, when answering kb_ask:
+            nothing is inferred from it when it is asserted, instead kb_ask
+            derives the answers it gives on demand (see backward.py), with
+            the same justifications forward chaining would store. Forward
+            rules don't see what backward rules derive, so a backward rule
+            should conclude statements only queries ask for.
+
+        Args:
+            rule (Rule) - Rule we're asserting
+        """
+        logger.info("Asserting backward %s", rule)
+        if isinstance(rule, Rule) and rule not in self.backward_rules:
+            self.backward_rules.append(rule)
+            self.cache.invalidate(rule.rhs)
+            if self._journal is not None:
+                self._journal.append((self.backward_rules.remove, (rule,)))
+
+    def kb_assert_many(self, items):
+        """Assert many facts and rules at once. All of them are put in the KB
+            first, then inference runs semi-naively: every round joins only
+            the facts and rules that are new since the previous round against
+            the KB, so each (fact, rule) pair is tried exactly once, as with
+            kb_assert. The KB ends up with the same facts, rules and supports
+            as asserting the items one at a time.
+
+        Args:
+            items (iterable of Fact|Rule) - Facts and Rules we're asserting
+        """
+        new_facts, new_rules = [], []
+        for fact_rule in items:
+            logger.info("Asserting %s", fact_rule)
+            if isinstance(fact_rule, Fact) or isinstance(fact_rule, Rule):
+                if self._store_or_merge(fact_rule):
+                    (new_facts if isinstance(fact_rule, Fact) else new_rules).append(fact_rule)
+
+        while new_facts or new_rules:
+            new_keys = set(fact.key() for fact in new_facts)
+            inferred = []
+            # new facts against every rule, old or new
+            for fact in new_facts:
+                for rule in self.ie.rules_for(fact, self):
+                    inferred.append(self.ie.derive(fact, rule))
+            # new rules against old facts only, new ones were just done
+            for rule in new_rules:
+                for fact in self.ie.facts_for(rule, self):
+                    if fact.key() not in new_keys:
+                        inferred.append(self.ie.derive(fact, rule))
+
+            new_facts, new_rules = [], []
+            for fact_rule in inferred:
+                if fact_rule is not None and self._store_or_merge(fact_rule):
+                    (new_facts if isinstance(fact_rule, Fact) else new_rules).append(fact_rule)
+        self._publish()
+
+    def kb_assert_file(self, file, batch_size=10000):
+        """Assert the facts and rules of a statements file, streaming: they
+            are parsed lazily and asserted in batches with kb_assert_many, so
+            at most one batch of parsed items is held at a time.
+
+        Args:
+            file (str) - name of the statements file, see read.iter_tokenize
+            batch_size (int) - most facts and rules per batch
+
+        Returns:
+            int - number of facts and rules read
+        """
+        count = 0
+        for batch in read.iter_batches(read.iter_tokenize(file), batch_size):
+            self.kb_assert_many(batch)
+            count += len(batch)
+        return count
+
+    def save(self, path):
+        """Write a binary snapshot of the KB: facts, rules and the support
+            graph, see snapshot.py
+
+        Args:
+            path (str) - file to write
+        """
+        import snapshot
+        snapshot.save(self, path)
+
+    @staticmethod
+    def load(path, ie=None):
+        """Make a KnowledgeBase from a snapshot written by save. The inferred
+            state is restored as saved, nothing is inferred again.
+
+        Args:
+            path (str) - snapshot file
+            ie (InferenceEngine|None) - engine of the new KB, see __init__
+
+        Returns:
+            KnowledgeBase - the restored KB
+        """
+        import snapshot
+        return snapshot.load(path, KnowledgeBase([], [], ie))
+
     def kb_ask(self, fact):
         """Ask if a fact is in the KB
 
         Args:
-            fact (Fact) - Statement to be asked (will be converted into a Fact)
+            fact (Fact|listof Fact) - Statement to be asked (will be converted
+                into a Fact), or statements asked together, see kb_ask_all
 
         Returns:
             listof Bindings|False - list of Bindings if result found, False otherwise
         """
-        print("Asking {!r}".format(fact))
+        if isinstance(fact, list):
+            return self.kb_ask_all(fact)
+        logger.info("Asking %s", fact)
         if factq(fact):
-            f = Fact(fact.statement)
-            bindings_lst = ListOfBindings()
-            # ask matched facts
-            for fact in self.facts:
-                binding = match(f.statement, fact.statement)
-                if binding:
-                    bindings_lst.add_bindings(binding, [fact])
-
+            bindings_lst = self.cache.get(fact.statement)
+            if bindings_lst is None:
+                bindings_lst = ListOfBindings()
+                for binding, facts in self.ask_iter(fact):
+                    bindings_lst.add_bindings(binding, facts)
+                # answers of backward rules depend on any predicate
+                if not any((rule.rhs[0], len(rule.rhs)) == (fact.statement[0], len(fact.statement))
+                           for rule in self.backward_rules):
+                    self.cache.put(fact.statement, bindings_lst)
             return bindings_lst if bindings_lst.list_of_bindings else []
 
         else:
-            print("Invalid ask:", fact.statement)
+            logger.warning("Invalid ask: %s", fact.statement)
             return []
 
+    def kb_ask_parallel(self, fact, workers=None):
+        """Ask like kb_ask, matching the facts in a pool of worker processes
+            (see parallel.py): the candidates of the query are split into one
+            shard per worker and the answers merged back in kb_ask's order.
+            The workers map a snapshot of the KB, written when this is first
+            called and again whenever facts have changed since, and are kept
+            for the next call. Narrow queries are answered in this process.
 
+        Args:
+            fact (Fact) - Statement to be asked
+            workers (int|None) - number of worker processes, None for one per
+                CPU
 
+        Returns:
+            ListOfBindings|list - as kb_ask
+        """
+        logger.info("Asking %s", fact)
+        if not factq(fact):
+            logger.warning("Invalid ask: %s", fact.statement)
+            return []
+        return self.help_collect(fact.statement, self.help_asker(workers).ask(fact.statement))
 
-    def help_supports_facts_rules(self, fact_or_rule):
-        """Retract a supporting fact or rule from the KB for loop
+    def ask_batch(self, facts, workers=None):
+        """Ask many independent queries at once, spread over a pool of worker
+            processes kept warm between calls (the one of kb_ask_parallel),
+            so throughput scales with cores instead of being bound to one
+            interpreter
 
         Args:
-            fact (Fact) or rule (Rule) - Fact or Rule to be retracted
+            facts (listof Fact) - Statements to be asked
+            workers (int|None) - number of worker processes, None for one per
+                CPU
 
         Returns:
-            None
+            listof ListOfBindings|list - what kb_ask returns for each, in
+                input order
         """
+        valid = [fact.statement for fact in facts if factq(fact)]
+        answers = iter(self.help_asker(workers).ask_batch(valid) if valid else [])
+        return [self.help_collect(fact.statement, next(answers)) if factq(fact) else []
+                for fact in facts]
 
-        if isinstance(fact_or_rule, Rule):
-            rule = fact_or_rule
+    def help_asker(self, workers):
+        """Get the worker pool of kb_ask_parallel and ask_batch, starting a
+            new one on a fresh snapshot if the facts changed since the last
 
-            # check facts supported by the rule that is being removed
-            for sup_f in rule.supports_facts:
-                #remove the [fact, rule] combo that was supported by the retracted fact
-                for fr in sup_f.supported_by:
-                    # fr is a [fact, rule]
-                    if rule in fr:
-                        kb_f = self._get_fact(fr[0])
-                        kb_f.supports_facts.remove(sup_f)
+        Args:
+            workers (int|None) - number of worker processes, None for one per
+                CPU, or as the current pool
 
-                        kb_sup_f = self._get_fact(sup_f)
-                        kb_sup_f.supported_by.remove(fr)
+        Returns:
+            parallel.ParallelAsker
+        """
+        import parallel
+        asker = self._asker
+        if asker is None or asker.version != self._version or \
+                (workers is not None and asker.workers != workers):
+            if asker is not None:
+                asker.close()
+            asker = self._asker = parallel.ParallelAsker(self, workers)
+        return asker
+
+    def help_collect(self, statement, answers):
+        """Make the ListOfBindings of an ask from the answers of the workers,
+            adding those of the backward rules
 
+        Args:
+            statement (Statement) - statement asked
+            answers (listof (Bindings, Fact)) - matching stored facts
 
-                # if the fact is unsupported and not asserted, remove the fact
-                if not kb_sup_f.supported_by:
-                    self.help_kb_remove(kb_sup_f)
+        Returns:
+            ListOfBindings|list - as kb_ask
+        """
+        bindings_lst = ListOfBindings()
+        for binding, match in answers:
+            bindings_lst.add_bindings(binding, [match])
+        for binding, match in self.help_ask_backward(statement):
+            bindings_lst.add_bindings(binding, [match])
+        return bindings_lst if bindings_lst.list_of_bindings else []
+
+    def cache_info(self):
+        """Get the counters of the kb_ask cache. The cache is off until its
+            size is set, e.g. kb.cache.maxsize = 1000; it then keeps the
+            answers of that many queries, least recently used out first, and
+            drops a query's answers when a fact it could match is stored or
+            removed (see cache.QueryCache)
 
+        Returns:
+            cache.CacheInfo: hits, misses, maxsize and currsize
+        """
+        return self.cache.info()
 
-            # check the rules supported by the rule being removed
-            for sup_r in rule.supports_rules:
-                #remove the [fact, rule] combo that was supported by the retracted fact
-                for fr in sup_r.supported_by:
-                    # fr is a [fact, rule]
-                    if rule in fr:
-                        kb_f = self._get_rule(fr[0])
-                        kb_f.supports_facts.remove(sup_r)
+    def kb_ask_all(self, facts):
+        """Ask for the bindings that satisfy several statements at once, e.g.
+            (inst ?x pyramid) (color ?x red) (size ?x big). The statements
+            are joined one at a time, most selective first: the next one is
+            the one the fact index expects the fewest matches for, counting
+            the variables bound by the statements before it
+            (FactStore.estimate), and it is looked up with those variables
+            replaced by their values.
 
-                        kb_sup_r = self._get_rule(sup_r)
-                        kb_sup_r.supported_by.remove(fr)
+        Args:
+            facts (listof Fact) - Statements to be asked together
 
+        Returns:
+            ListOfBindings|list - combined Bindings of every answer, each
+                with the facts matching the statements (in the order given),
+                [] if there is none
+        """
+        logger.info("Asking %s", facts)
+        if not facts or not all(factq(fact) for fact in facts):
+            logger.warning("Invalid ask: %s", facts)
+            return []
+        bindings_lst = ListOfBindings()
+        for bindings, matched in self.ask_iter(facts):
+            bindings_lst.add_bindings(bindings, matched)
+        return bindings_lst if bindings_lst.list_of_bindings else []
 
-                if not kb_sup_r.asserted:
-                    self.help_kb_remove(kb_sup_r)
+    def ask_iter(self, fact):
+        """Iterate over the answers kb_ask would return, in the same order,
+            matching each one only when it is asked for. The KB must not
+            change until the iteration is done.
 
-            # remove the retracted fact from the KB
-            self.rules.remove(rule)
+        Args:
+            fact (Fact|listof Fact) - Statement to be asked, or statements
+                asked together (see kb_ask_all)
 
+        Yields:
+            (Bindings, listof Fact) - bindings of an answer and the facts
+                matching the statements, as in ListOfBindings
+        """
+        facts = fact if isinstance(fact, list) else [fact]
+        if not facts or not all(factq(f) for f in facts):
+            return
+        statements = [f.statement for f in facts]
+        if len(statements) == 1:
+            for binding, match in self.help_ask(statements[0]):
+                yield binding, [match]
         else:
-            fact = fact_or_rule
-
-            # check facts supported by the fact that is being removed
-            for sup_f in fact.supports_facts:
-                #remove the [fact, rule] combo that was supported by the retracted fact
-                for fr in sup_f.supported_by:
-                    # fr is a [fact, rule]
-                    if fact in fr:
-                        kb_r = self._get_rule(fr[1])
-                        kb_r.supports_facts.remove(sup_f)
-
-                        kb_sup_f = self._get_fact(sup_f)
-                        kb_sup_f.supported_by.remove(fr)
-
-
-                # if the fact is unsupported and not asserted, remove the fact
-                if not kb_sup_f.supported_by:
-                    self.help_kb_remove(kb_sup_f)
-
+            for answer in self.help_join(statements, self.help_plan(statements), Bindings(),
+                                         [None] * len(statements)):
+                yield answer
 
-            # check the rules supported by the fact being removed
-            for sup_r in fact.supports_rules:
-                #remove the [fact, rule] combo that was supported by the retracted fact
-                for fr in sup_r.supported_by:
-                    # fr is a [fact, rule]
-                    if fact in fr:
-                        kb_r = self._get_rule(fr[1])
-                        kb_r.supports_rules.remove(sup_r)
+    def ask_exists(self, fact):
+        """Check whether a kb_ask has any answer, stopping at the first
 
-                        kb_sup_r = self._get_rule(sup_r)
-                        kb_sup_r.supported_by.remove(fr)
+        Args:
+            fact (Fact|listof Fact) - Statement(s) to be asked, see ask_iter
 
-                if not kb_sup_r.asserted:
-                    self.help_kb_remove(kb_sup_r)
+        Returns:
+            bool - True if some answer exists
+        """
+        for _ in self.ask_iter(fact):
+            return True
+        return False
 
+    def ask_count(self, fact):
+        """Count the answers of a kb_ask without collecting them
 
-            # remove the retracted fact from the KB
-            self.facts.remove(fact)
+        Args:
+            fact (Fact|listof Fact) - Statement(s) to be asked, see ask_iter
 
-        return
+        Returns:
+            int - number of answers
+        """
+        return sum(1 for _ in self.ask_iter(fact))
 
+    def help_join(self, statements, order, bindings, matched):
+        """Join the statements of a conjunctive ask depth first, see kb_ask_all
 
-    def help_kb_remove(self, fact_or_rule):
-        """Retract a supporting fact or rule from the KB
+        Args:
+            statements (listof Statement) - statements asked together
+            order (listof int) - positions of the statements still to join,
+                in join order (see help_plan)
+            bindings (Bindings) - bindings of the statements joined so far
+            matched (listof Fact|None) - facts matching them, by position
+
+        Yields:
+            (Bindings, listof Fact) - combined bindings and matching facts
+        """
+        if not order:
+            yield bindings, matched
+            return
+        i = order[0]
+        for binding, fact in self.help_ask(instantiate(statements[i], bindings)):
+            combined = Bindings()
+            combined.bindings_dict.update(bindings.bindings_dict)
+            combined.bindings_dict.update(binding.bindings_dict)
+            for answer in self.help_join(statements, order[1:], combined,
+                                         matched[:i] + [fact] + matched[i + 1:]):
+                yield answer
+
+    def help_plan(self, statements):
+        """Order the statements of a conjunctive ask, see kb_ask_all. Each
+            step takes the statement with the lowest estimate given the
+            variables bound so far; statements backward rules conclude (whose
+            answers the index doesn't hold) are estimated as the whole KB.
 
         Args:
-            fact (Fact) or rule (Rule) - Fact or Rule to be retracted
+            statements (listof Statement) - statements asked together
 
         Returns:
-            None
+            listof int - positions of the statements in join order
         """
+        heads = set((rule.rhs[0], len(rule.rhs)) for rule in self.backward_rules)
+        order, bound = [], set()
+        remaining = list(range(len(statements)))
+        while remaining:
+            def estimate(i):
+                statement = statements[i]
+                if (statement[0], len(statement)) in heads:
+                    return len(self.facts)
+                return self.facts.estimate(statement, bound)
+            best = min(remaining, key=estimate)
+            remaining.remove(best)
+            order.append(best)
+            bound.update(element for element in statements[best][1:] if is_var(element))
+        return order
+
+    def help_ask(self, statement):
+        """Match a statement against the KB: the stored facts the index says
+            may unify with it, then the facts backward rules derive for it
 
-        # only facts or rules can be input
-        if not isinstance(fact_or_rule, Fact) and not isinstance(fact_or_rule, Rule):
-            print("Error: Input was not a fact or Rule")
-            return
-            
-        else:
-            #asserted rules are never retracted, check to make sure
-            if isinstance(fact_or_rule, Rule):
-                if fact_or_rule.asserted:
-                    print("Error: asserted rules can't be retracted.")
-                    return
+        Args:
+            statement (Statement) - statement (pattern) to match
 
-                else:
-                    rule = self._get_rule(fact_or_rule)
+        Yields:
+            (Bindings, Fact) - bindings of every matching fact
+        """
+        query = compile_statement(statement)
+        for fact in self.facts.candidates(statement):
+            binding = match_compiled(query, fact.statement)
+            if binding:
+                yield binding, fact
+        for answer in self.help_ask_backward(statement):
+            yield answer
+
+    def help_ask_backward(self, statement):
+        """Match a statement against the facts backward rules derive for it,
+            see kb_assert_backward
 
-                    # remove the rule if it is not supported
-                    if not rule.supported_by:
-                        print("Rule is not supported. Rule is removed")
+        Args:
+            statement (Statement) - statement (pattern) to match
 
-                        self.help_supports_facts_rules(rule)
+        Yields:
+            (Bindings, Fact) - bindings of every derived matching fact
+        """
+        if self.backward_rules:
+            import backward
+            chainer = backward.BackwardChainer(self)
+            if chainer.derivable(statement):
+                query = compile_statement(statement)
+                for fact in chainer.derive(statement):
+                    binding = match_compiled(query, fact.statement)
+                    if binding:
+                        yield binding, fact
+
+    def help_kb_remove(self, fact_or_rule, supports=None):
+        """Check whether a fact or rule that lost a support must leave the KB:
+            it must when it is neither asserted nor supported anymore
 
+        Args:
+            fact_or_rule (Fact|Rule) - Fact or Rule that lost a support, as
+                stored in the KB
+            supports (int|None) - how many of its justifications still hold,
+                None for all of its supported_by
 
-            elif isinstance(fact_or_rule, Fact):
-                # get the fact from the KB so it has the supported_by statements
-                fact = self._get_fact(fact_or_rule)
+        Returns:
+            bool - True if it must be removed
+        """
+        if supports is None:
+            supports = len(fact_or_rule.supported_by)
+        if fact_or_rule.asserted or supports:
+            return False
+        if isinstance(fact_or_rule, Rule):
+            logger.debug("Rule is not supported. Rule is removed")
+        else:
+            logger.debug("Fact was removed. Fact was not supported: %s", fact_or_rule.statement)
+        return True
 
-                # if the fact is asserted and supported, don't remove it
-                if fact.asserted and fact.supported_by:
-                    print("Fact is asserted and supported. Fact was not removed")
-                    return
+    def help_retract_closure(self, removed, report=True):
+        """Find everything left unsupported once the given facts and rules
+            are gone, in one worklist pass over supports_facts and
+            supports_rules. Nothing is changed yet.
 
-                # if it is not supported, remove the fact
-                if not fact.supported_by:
-                    print("Fact was removed. Fact was not supported.")
+        Each justification reached from a removed node dies (once, whether
+        its fact, its rule or both are removed) and takes one off the count of
+        live justifications of the node it supports; a node that is not
+        asserted is removed exactly when its count drops to zero.
 
-                    self.help_supports_facts_rules(fact)
+        Args:
+            removed (dictof Fact|Rule) - the facts and rules to remove, as
+                stored in the KB, keyed by their key. Filled with the ones
+                they leave unsupported, in removal order
+            report (bool) - log a message for each node found, see
+                help_kb_remove
 
+        Returns:
+            dictof (Justification, Fact|Rule) - the dead justifications and
+                the node each one supported, keyed by justification id
+        """
+        dead = {}
+        counts = {}
+        worklist = list(removed.values())
+        for node in worklist:
+            for justification in node.supported_by:
+                dead[justification.id] = (justification, node)
+        while worklist:
+            node = worklist.pop()
+            side = 0 if isinstance(node, Fact) else 1
+            seen = set()
+            for sup in node.supports_facts + node.supports_rules:
+                key = sup.key()
+                if key in seen:
+                    continue
+                seen.add(key)
+                kb_sup = self._get_fact(sup) if isinstance(sup, Fact) else self._get_rule(sup)
+                if kb_sup is None:
+                    continue
+                count = counts.get(key)
+                if count is None:
+                    count = len(kb_sup.supported_by)
+                for justification in kb_sup.supported_by:
+                    if justification.id not in dead and justification[side] == node:
+                        dead[justification.id] = (justification, kb_sup)
+                        count -= 1
+                counts[key] = count
+                if key in removed or kb_sup.asserted or count:
+                    continue
+                if not report or self.help_kb_remove(kb_sup, count):
+                    removed[key] = kb_sup
+                    worklist.append(kb_sup)
+        return dead
+
+    def help_retract_sweep(self, removed, dead):
+        """Remove the facts and rules found by help_retract_closure and
+            unlink the dead justifications, rebuilding each affected list
+            once instead of searching it per justification. Derived items
+            waiting on the agenda whose justification uses a removed fact or
+            rule are taken off it.
 
-                else:
-                    print("Fact was supported. Fact wasn't removed")
+        Args:
+            removed (dictof Fact|Rule) - the facts and rules to remove, keyed
+                by their key
+            dead (dictof (Justification, Fact|Rule)) - see
+                help_retract_closure
+        """
+        # surviving nodes that lost justifications, and surviving supporters
+        # with how many times each lost consequent has to leave their lists
+        pruned = {}
+        unlinked = {}
+        for justification, consequent in dead.values():
+            key = consequent.key()
+            if key not in removed:
+                pruned[key] = consequent
+            for node in justification:
+                if node.key() not in removed:
+                    drops = unlinked.setdefault(node.key(), (node, {}))[1]
+                    drops[key] = drops.get(key, 0) + 1
+        for fact_or_rule in pruned.values():
+            self._set(fact_or_rule, 'supported_by', [justification for justification in fact_or_rule.supported_by
+                                                     if justification.id not in dead])
+        for node, drops in unlinked.values():
+            node = self._own(node)
+            for attribute in ('supports_facts', 'supports_rules'):
+                kept = []
+                for sup in getattr(node, attribute):
+                    key = sup.key()
+                    if drops.get(key):
+                        drops[key] -= 1
+                    else:
+                        kept.append(sup)
+                self._set(node, attribute, kept)
+        for fact_or_rule in removed.values():
+            self._unstore(fact_or_rule)
+        if self.agenda:
+            # derivations still queued (see agenda_limit) from a removed
+            # fact or rule would otherwise be stored with a dead justification
+            self.agenda.discard(lambda item: not item.asserted and any(
+                node.key() in removed for justification in item.supported_by for node in justification))
+
+    def help_retract_cascade(self, fact_or_rule):
+        """Remove a fact or rule and everything left unsupported by its
+            removal, as a justification-based truth maintenance pass: find
+            the nodes to remove with help_retract_closure, then unlink and
+            remove them with help_retract_sweep
 
-        return
+        Args:
+            fact_or_rule (Fact|Rule) - Fact or Rule to be removed, as stored in
+                the KB
 
+        Returns:
+            listof Fact|Rule - the removed facts and rules
+        """
+        removed = {fact_or_rule.key(): fact_or_rule}
+        dead = self.help_retract_closure(removed)
+        self.help_retract_sweep(removed, dead)
+        return list(removed.values())
 
     def kb_retract(self, fact_or_rule):
         """Retract a fact from the KB
@@ -275,47 +895,169 @@ class KnowledgeBase(object):
         Returns:
             None
         """
-        printv("Retracting {!r}", 0, verbose, [fact_or_rule])
-        ####################################################
-        # Student code goes here
+        logger.info("Retracting %s", fact_or_rule)
 
-        # only facts or rules can be input
-        if not isinstance(fact_or_rule, Fact) and not isinstance(fact_or_rule, Rule):
-            print("Error: Input was not a fact or Rule")
+        # only facts can be retracted, asserted rules are never retracted
+        if isinstance(fact_or_rule, Rule):
+            logger.warning("Rules can't be retracted")
+            return
+        if not isinstance(fact_or_rule, Fact):
+            logger.warning("Input was not a fact or Rule")
             return
-        else:
-            #asserted rules are never retracted, check to make sure
-            if isinstance(fact_or_rule, Rule):
-                print("Error: Rules can't be retracted")
-                return
 
-            elif isinstance(fact_or_rule, Fact):
-                # get the fact from the KB so it has the supported_by statements
-                fact = self._get_fact(fact_or_rule)
+        # get the fact from the KB so it has the supported_by statements
+        fact = self._get_fact(fact_or_rule)
+        if fact is None:
+            logger.info("Fact is not in the KB. Fact was not removed")
+            return
 
-                # if the fact is asserted and supported, don't remove it
-                if fact.asserted and fact.supported_by:
-                    print("Fact is asserted and supported. Fact was not removed")
-                    return
+        # if the fact is supported, don't remove it
+        if fact.supported_by:
+            if fact.asserted:
+                logger.info("Fact is asserted and supported. Fact was not removed")
+            else:
+                logger.info("Fact was supported. Fact wasn't removed")
+            return
 
-                # if it is not supported, remove the fact
-                if not fact.supported_by:
-                    print("Fact was removed. Fact was not supported.")
+        logger.info("Fact was removed. Fact was not supported.")
+        self.help_retract_cascade(fact)
+        self._publish()
 
-                    self.help_supports_facts_rules(fact)
+    def kb_retract_many(self, facts):
+        """Retract a batch of facts with a single cascade: the unsupported
+            closure of all of them is found in one traversal and everything
+            in it is removed at once, with nothing logged for the cascade.
+            Like kb_retract, a supported fact is not removed, unless the batch
+            removes all of its support: the KB ends as if each fact were
+            retracted once its support is gone.
 
-                else:
-                    print("Fact was supported. Fact wasn't removed")
+        Args:
+            facts (iterable of Fact) - facts to be retracted
 
-        return
+        Returns:
+            dict - what happened: 'facts' and 'rules' removed (listof
+                Fact|Rule, the retracted facts included), 'kept' (listof
+                Fact, targets left in because they are still supported) and
+                'missing' (listof Fact, targets not in the KB)
+        """
+        removed, kept, missing = {}, [], []
+        for fact_or_rule in facts:
+            logger.info("Retracting %s", fact_or_rule)
+            fact = self._get_fact(fact_or_rule) if isinstance(fact_or_rule, Fact) else None
+            if fact is None:
+                missing.append(fact_or_rule)
+            elif fact.supported_by:
+                kept.append(fact)
+            else:
+                removed[fact.key()] = fact
+        dead = self.help_retract_closure(removed, report=False)
+        # a supported target whose justifications all die with the batch is
+        # removed too, as retracting it after the others would
+        freed = [fact for fact in kept if fact.key() not in removed
+                 and all(justification.id in dead for justification in fact.supported_by)]
+        while freed:
+            for fact in freed:
+                removed[fact.key()] = fact
+            dead = self.help_retract_closure(removed, report=False)
+            freed = [fact for fact in kept if fact.key() not in removed
+                     and all(justification.id in dead for justification in fact.supported_by)]
+        kept = [fact for fact in kept if fact.key() not in removed]
+        self.help_retract_sweep(removed, dead)
+        self._publish()
+        return {
+            'facts': [x for x in removed.values() if isinstance(x, Fact)],
+            'rules': [x for x in removed.values() if isinstance(x, Rule)],
+            'kept': kept,
+            'missing': missing,
+        }
 
 
+class InferenceEngine(object):
+    def rules_for(self, fact, kb):
+        """Get the rules of the KB that a fact should be tried against
+
+        Args:
+            fact (Fact) - A fact
+            kb (KnowledgeBase) - A KnowledgeBase
 
+        Returns:
+            iterable of Rule: every rule of the KB, its store itself
+        """
+        return kb.rules
 
+    def facts_for(self, rule, kb):
+        """Get the facts of the KB that a rule should be tried against: the
+            ones the fact index returns for its first LHS statement, as the
+            others can't match it
 
+        Args:
+            rule (Rule) - A rule
+            kb (KnowledgeBase) - A KnowledgeBase
 
+        Returns:
+            listof Fact: candidate facts, in KB order
+        """
+        return kb.facts.candidates(rule.lhs[0])
+
+    def infer_from_fact(self, fact, kb):
+        """Forward-chain from a fact just added to the KB
+
+        Args:
+            fact (Fact) - The new fact, already in the KnowledgeBase
+            kb (KnowledgeBase) - A KnowledgeBase
+
+        Returns:
+            Nothing
+        """
+        for rule in self.rules_for(fact, kb):
+            self.fc_infer(fact, rule, kb)
+
+    def infer_from_rule(self, rule, kb):
+        """Forward-chain from a rule just added to the KB
+
+        Args:
+            rule (Rule) - The new rule, already in the KnowledgeBase
+            kb (KnowledgeBase) - A KnowledgeBase
+
+        Returns:
+            Nothing
+        """
+        for fact in self.facts_for(rule, kb):
+            self.fc_infer(fact, rule, kb)
+
+    def rule_added(self, rule):
+        """Called when a rule is put in the KB, before inferring from it.
+            Compiles asserted rules; curried ones already share their parent's
+            plan. Engines keeping per-rule state extend this.
+
+        Args:
+            rule (Rule) - The new rule
+        """
+        if rule.plan is None:
+            rule.plan = RulePlan(rule)
+            rule.depth = 0
+            rule.values = (None,) * len(rule.plan.variables)
+
+    def rule_removed(self, rule):
+        """Called when a rule is taken out of the KB. Engines keeping
+            per-rule state override this.
+
+        Args:
+            rule (Rule) - The removed rule
+        """
+        pass
+
+    def fork(self):
+        """Get the engine of a fork of the KB this engine serves, see
+            KnowledgeBase.fork. This engine keeps no state of its own and
+            serves the fork too; engines keeping per-rule state override this
+            to layer the fork's rules over their own.
+
+        Returns:
+            InferenceEngine - this engine
+        """
+        return self
 
-class InferenceEngine(object):
     def fc_infer(self, fact, rule, kb):
         """Forward-chaining to infer new facts and rules
 
@@ -327,58 +1069,114 @@ class InferenceEngine(object):
         Returns:
             Nothing
         """
-        printv('Attempting to infer from {!r} and {!r} => {!r}', 1, verbose,
-            [fact.statement, rule.lhs, rule.rhs])
-        ####################################################
-        # Student code goes here
+        new_fact_rule = self.derive(fact, rule)
+        if new_fact_rule is not None:
+            kb.kb_assert(new_fact_rule)
+
+    def derive(self, fact, rule):
+        """Infer the fact or curried rule that a fact and a rule support,
+            without adding it to the KB. The result carries its
+            justification (see link); the KB records it in the supports
+            lists of the fact and the rule once it is stored or merged (see
+            KnowledgeBase._link).
+
+        Rules in the KB are compiled (see RulePlan), so this fills the plan's
+        slots from the fact; a curried rule shares the plan and carries the
+        slot values bound so far.
+
+        Args:
+            fact (Fact) - A fact from the KnowledgeBase
+            rule (Rule) - A rule from the KnowledgeBase
+
+        Returns:
+            Fact|Rule|None - the inferred fact or rule, None if the fact
+                doesn't match the first LHS statement of the rule
+        """
+        logger.debug("Attempting to infer from %r and %r => %r", fact.statement, rule.lhs, rule.rhs)
+        plan = rule.plan
+        if plan is None:
+            return self.derive_uncompiled(fact, rule)
+
+        # fill the slots of the first LHS statement from the fact
+        statement = fact.statement
+        template = plan.lhs[rule.depth]
+        if len(template) != len(statement) or template[0] != statement[0]:
+            return None
+        values = list(rule.values)
+        for code, element in zip(template[1:], statement[1:]):
+            if element[0] == "?":
+                # facts with variables bind the other way round
+                return self.derive_uncompiled(fact, rule)
+            if type(code) == int:
+                bound = values[code]
+                if bound is None:
+                    values[code] = element
+                elif bound != element:
+                    return None
+            elif code != element:
+                return None
+
+        rhs_bound = plan.fill(plan.rhs, values)
+        if rule.depth + 1 == len(plan.lhs):
+            return self.link(fact, rule, rhs_bound)
+
+        lhs_bound = [plan.fill(t, values) for t in plan.lhs[rule.depth + 1:]]
+        new_rule = self.link(fact, rule, rhs_bound, lhs_bound)
+        new_rule.plan = plan
+        new_rule.depth = rule.depth + 1
+        new_rule.values = tuple(values)
+        return new_rule
+
+    def derive_uncompiled(self, fact, rule):
+        """derive for a rule that has no plan (not in a KB) or a fact with
+            variables: match and instantiate the statements themselves
+
+        Args:
+            fact (Fact) - A fact
+            rule (Rule) - A rule
+
+        Returns:
+            Fact|Rule|None - the inferred fact or rule, None if the fact
+                doesn't match the first LHS statement of the rule
+        """
         # get the first statement from the rule
         r_state1 = rule.lhs[0]
 
         # check to see if there is a match
         rule_bind = match(fact.statement, r_state1)
 
-        # Make a list of new bound lhs statements
-        lhs_bound = []
-
         # if there is a match:
-        if rule_bind:
-            # If there are other statements in the lhs
-            for stat in rule.lhs[1:]:
-                bound_statement = instantiate(stat, rule_bind)
-                lhs_bound.append(bound_statement)
-            # bind the rhs
-            rhs_bound = instantiate(rule.rhs, rule_bind)
+        if not rule_bind:
+            return None
 
-        else:
-            return
-
-        # creating a new fact
-        #
+        # bind the other statements of the lhs and the rhs
+        lhs_bound = [instantiate(stat, rule_bind) for stat in rule.lhs[1:]]
+        rhs_bound = instantiate(rule.rhs, rule_bind)
         if len(rule.lhs) == 1:
-            print("New fact")
+            return self.link(fact, rule, rhs_bound)
+        return self.link(fact, rule, rhs_bound, lhs_bound)
 
-            # create a new fact
-            new_fact = Fact(rhs_bound, [[fact, rule]])
+    def link(self, fact, rule, rhs_bound, lhs_bound=None):
+        """Make the fact (or, given LHS statements, the curried rule) inferred
+            from a fact and a rule, justified by them. The KB adds it to the
+            supports lists of the fact and rule once it is stored or merged,
+            see KnowledgeBase._store_or_merge
 
-            # append the new fact to the fact and rule's  supports_facts lists
-            fact.supports_facts.append(new_fact)
-            rule.supports_facts.append(new_fact)
-
-
-            kb.kb_assert(new_fact)
+        Args:
+            fact (Fact) - The fact it is inferred from
+            rule (Rule) - The rule it is inferred from
+            rhs_bound (Statement) - the inferred statement or rule RHS
+            lhs_bound (listof Statement|None) - LHS of the curried rule
 
+        Returns:
+            Fact|Rule - the new fact or rule
+        """
+        # creating a new fact
+        if lhs_bound is None:
+            logger.debug("New fact %s", rhs_bound)
+            return Fact(rhs_bound, [[fact, rule]])
 
         # create a new rule
         else:
-            print("new rule")
-
-            # creating a new rule
-            new_rule = Rule([lhs_bound, rhs_bound], [[fact, rule]])
-
-            # append the new fact to the fact and rule's  supports_facts lists
-            fact.supports_rules.append(new_rule)
-            rule.supports_rules.append(new_rule)
-
-            kb.kb_assert(new_rule)
-
-        return
+            logger.debug("New rule %s -> %s", lhs_bound, rhs_bound)
+            return Rule([lhs_bound, rhs_bound], [[fact, rule]])
@@ -1,5 +1,9 @@
+import logging
+
 import logical_classes as lc
 
+logger = logging.getLogger(__name__)
+
 def is_var(var):
     """Check whether an element is a variable (either instance of Variable, 
         instance of Term (where .term is a Variable) or a string starting with 
@@ -18,6 +22,92 @@ def is_var(var):
 
     return isinstance(var, lc.Variable)
 
+def canonical_pattern(statement):
+    """Rename the variables of a statement by order of first appearance so
+        that patterns differing only in variable names share one key, e.g.
+        (inst ?x ?y) and (inst ?a ?b) both give ('inst', '?0', '?1'). The
+        key of the Rete alpha memories, the backward chainer's tables and
+        the kb_ask cache
+
+    Args:
+        statement (Statement): pattern to canonicalize
+
+    Returns:
+        tuple: canonical key of the pattern
+    """
+    names = {}
+    key = [statement[0]]
+    for element in statement[1:]:
+        if is_var(element):
+            element = names.setdefault(element, "?" + str(len(names)))
+        key.append(element)
+    return tuple(key)
+
+def compile_statement(statement):
+    """Precompile a statement for matching: which of its positions hold
+        variables and which hold constants. Worth doing once for a statement
+        that is matched many times, like a query or a rule's LHS statement.
+
+    Args:
+        statement (Statement): statement to compile
+
+    Returns:
+        (Statement, tupleof bool, tupleof int): the statement, whether the
+            element at each position is a variable (position 0 is the
+            predicate), and the positions of the constants
+    """
+    flags = tuple(element[:1] == "?" for element in statement)
+    constants = tuple(i for i in range(1, len(statement)) if not flags[i])
+    return (statement, flags, constants)
+
+def match_compiled(compiled, state2, bindings=None):
+    """Match a precompiled statement with a statement and return the
+        associated bindings or False if there is no binding. Loops over the
+        term positions once, without slicing or type checks; the Bindings is
+        only built once the match has succeeded.
+
+    Args:
+        compiled (tuple): statement to match with state2, from compile_statement
+        state2 (Statement): statement to match with the compiled one
+        bindings (Bindings|None): already associated bindings, extended in
+            place on success
+
+    Returns:
+        Bindings|False: either associated bindings or no match found
+    """
+    state1, flags, constants = compiled
+    if len(state1) != len(state2) or state1[0] != state2[0]:
+        return False
+    # cheap rejection on clashing constants before binding anything
+    for i in constants:
+        element = state2[i]
+        if element != state1[i] and element[0] != "?":
+            return False
+
+    bound = bindings.bindings_dict if bindings else {}
+    added = None
+    for i in range(1, len(state1)):
+        if flags[i]:
+            variable, value = state1[i], state2[i]
+        elif state2[i][0] == "?":
+            variable, value = state2[i], state1[i]
+        else:
+            continue
+        current = bound.get(variable) or (added and added.get(variable))
+        if current:
+            if current != value:
+                return False
+        else:
+            if added is None:
+                added = {}
+            added[variable] = value
+
+    if not bindings:
+        bindings = lc.Bindings()
+    if added:
+        bindings.bindings_dict.update(added)
+    return bindings
+
 def match(state1, state2, bindings=None):
     """Match two statements and return the associated bindings or False if there
         is no binding
@@ -30,14 +120,15 @@ def match(state1, state2, bindings=None):
     Returns:
         Bindings|False: either associated bindings or no match found
     """
-    if len(state1.terms) != len(state2.terms) or state1.predicate != state2.predicate:
+    # statements are tuples of predicate and term elements, compare those
+    # before compiling anything
+    if len(state1) != len(state2) or state1[0] != state2[0]:
         return False
-    if not bindings:
-        bindings = lc.Bindings()
-    return match_recursive(state1.terms, state2.terms, bindings)
+    return match_compiled(compile_statement(state1), state2, bindings)
 
 def match_recursive(terms1, terms2, bindings):  # recursive...
-    """Recursive helper for match
+    """Recursive term-by-term matcher, the original implementation of match,
+        kept for comparison (see bench.py match)
 
     Args:
         terms1 (listof Term): terms to match with terms2
@@ -67,15 +158,16 @@ def instantiate(statement, bindings):
         statement (Statement): statement to generate new statement from
         bindings (Bindings): bindings to substitute into statement
     """
-    def handle_term(term):
-        if is_var(term):
-            bound_value = bindings.bound_to(term.term)
-            return lc.Term(bound_value) if bound_value else term
+    bound = bindings.bindings_dict
+    def handle_term(element):
+        if element[0] == "?":
+            return bound.get(element) or element
         else:
-            return term
+            return element
 
-    new_terms = [handle_term(t) for t in statement.terms]
-    return lc.Statement([statement.predicate] + new_terms)
+    # statements are tuples of predicate and term elements
+    new_terms = [handle_term(e) for e in statement[1:]]
+    return lc.Statement([statement[0]] + new_terms)
 
 def factq(element):
     """Check if element is a fact
@@ -89,14 +181,16 @@ def factq(element):
     return isinstance(element, lc.Fact)
 
 def printv(message, level, verbose, data=[]):
-    """Prints given message formatted with data if passed in verbose flag is greater than level
+    """Logs given message formatted with data, at INFO level through logging,
+        if passed in verbose flag is greater than level. The message is only
+        formatted if a handler takes it
 
     Args:
-        message (str): message to print, if format string data should have values
+        message (str): message to log, if format string data should have values
             to format with
-        level (int): value of verbose required to print
+        level (int): value of verbose required to log
         verbose (int): value of verbose flag
         data (listof any): optional data to format message with
     """
-    if verbose > level:
-        print(message.format(*data) if data else message)
\ No newline at end of file
+    if verbose > level and logger.isEnabledFor(logging.INFO):
+        logger.info(message.format(*data) if data else message)
\ No newline at end of file